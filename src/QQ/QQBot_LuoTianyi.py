@@ -20,17 +20,26 @@ from ncatbot.core import BotClient, GroupMessage, PrivateMessage
 
 from src.QQ.QQutils.cmds.commands import CommandRegistry, ImageCommand, MusicCommand, HelpCommand, \
     CheckinCommand, LyricCommand, DailyReportCommand, BanCommand, MorningCommand, ImageGeneratorCommand, \
-    UpdateMemoryCommand, GroupSendCommand, SendLikeCommand, BiliDownloadCommand
+    UpdateMemoryCommand, GroupSendCommand, SendLikeCommand, BiliDownloadCommand, ModelStatsCommand
 from src.QQ.QQutils.msg.chat_session import ChatSession, MessageContext
 from src.QQ.QQutils.msg.msg_wrapper import RecvMessageWrapper, SendMessageBuilder
 # from src.QQ.QQutils.msg.process_img import MessageNormalizer
 from src.QQ.QQutils.msg.send_msg import MessageSender
 from src.QQ.QQutils.res.history_loader import HistoryLoader
 from src.QQ.QQutils.res.history_storage import HistoryLogger
+from src.QQ.QQutils.res.history_writer import HistoryWriter
+from src.QQ.QQutils.res.image_description_cache import ImageDescriptionCache
 from src.QQ.QQutils.res.image_storage import ImageStorage
+from src.QQ.QQutils.res.media_pipeline import MediaPipeline
 from src.config.QQ_bot_info_loader import BotInfoConfigLoader
 from src.utils.chat.img_describer import ImageDescriber
 from src.utils.chat.decider.reply_decider import ReplyDecisionData
+from src.utils.chat.history.summary_worker import SummaryWorker
+from src.utils.chat.llm.client_pool import LLMClientPool
+from src.utils.tools.executor import BlockingExecutor, LoopLagMonitor
+from src.utils.tools.fetcher import MediaFetcher
+from src.utils.tools.metrics import ModelCallMetrics
+from src.utils.tools.tracing import Tracer
 from src.utils.tools.res.emoji_detector import EmojiDetector
 
 # from src.utils.chat.img_describer import ImageDescriber
@@ -46,16 +55,37 @@ CONFIG = BotInfoConfigLoader.load("LuoTianyi")
 
 
 class BotManager:
+    # 退出时等待执行中的摘要任务的最长秒数
+    SUMMARY_CLOSE_TIMEOUT = 60.0
+
     def __init__(self, bot: BotClient):
         self.bot = bot  # BotClient 实例
         self.sessions: Dict[str, ChatSession] = {}  # 统一存储所有会话，key是 "group_111" 或 "private_111" 以防冲突
         # self.msg_sender: MessageSender | None = None  # 当前消息的 sender 对象，后续发送消息都通过它来调用 API
         self.image_storage = ImageStorage(bot_id=CONFIG.bot_id)
-        # self.history_logger = HistoryLogger(CONFIG)
+        # 进程级共享记录器：开启 buffered 时由后台线程攒批写盘，事件循环不再逐条打开文件。
+        self.history_logger = HistoryLogger(CONFIG, writer=self._create_history_writer())
 
         # 进程级共享图片描述器与表情检测器，避免每条消息重复创建连接/会话。
-        self.image_describer = ImageDescriber()
-        self.emoji_detector = EmojiDetector(CONFIG.paths.emoji_dir)
+        # 描述缓存与图片索引共用 image_index.db，重复出现的图片不再调用 VLM
+        self.image_description_cache = ImageDescriptionCache(self.image_storage.db_path)
+        self.image_describer = ImageDescriber(cache=self.image_description_cache)
+        # 转发后重新压缩的表情包 SHA256 对不上，用感知哈希兜底
+        # 表情库在后台增量同步并每 5 分钟轮询一次，启动不再等待哈希计算
+        self.emoji_detector = EmojiDetector(
+            CONFIG.paths.emoji_dir,
+            perceptual=True,
+            background=True,
+            watch_interval=300,
+        )
+        # 一条消息的多张图片并发下载、保存、识别
+        self.media_pipeline = MediaPipeline(self.image_storage, self.image_describer, self.emoji_detector)
+        # 摘要同步在后台执行，回复不再等待；上次退出时未完成的任务在这里恢复。
+        self.summary_worker = SummaryWorker(bot_id=CONFIG.bot_id)
+        self.summary_worker.resume()
+
+        # 事件循环卡顿超过 0.5s 时记录调用栈；事件循环启动后（第一条消息）才能开始
+        self.loop_monitor = LoopLagMonitor(threshold=0.5)
 
         self.registry = CommandRegistry()
         self._init_registry()
@@ -65,7 +95,9 @@ class BotManager:
         prefix = "private_" if is_private else "group_"
         key = f"{prefix}{session_id}"
         if key not in self.sessions:
-            self.sessions[key] = ChatSession(session_id, is_private, CONFIG, self.emoji_detector)
+            self.sessions[key] = ChatSession(session_id, is_private, CONFIG, self.emoji_detector,
+                                             history_logger=self.history_logger,
+                                             summary_worker=self.summary_worker)
         return self.sessions[key]
 
     # api参考 https://docs.ncatbot.xyz/reference
@@ -81,16 +113,25 @@ class BotManager:
         #     message_id="1311274050", emoji_id="424", set=True
         # )
 
+        self.loop_monitor.start()
+
+        # 每条消息一个 trace，回复阶段（ReplyScheduler 稍后触发）通过 ctx.trace 延续同一个 trace
+        with Tracer.trace("handle_message", message_id=getattr(msg, "message_id", "")):
+            await self._handle_message(msg)
+
+    async def _handle_message(self, msg: PrivateMessage | GroupMessage):
         is_private = isinstance(msg, PrivateMessage)
         session_id = str(msg.user_id if is_private else msg.group_id)
         session = self.get_session(session_id, is_private)
         session.session_id = session_id
         logger.info(f"收到消息 type={'private' if is_private else 'group'}, id={session_id}")
+        Tracer.annotate(session=f"{'private' if is_private else 'group'}_{session_id}")
 
         # =========================
         # 1. 是否能回复（不在黑名单里）
         # =========================
-        can_reply = await self._can_reply(session, is_private, msg)
+        with Tracer.span("blacklist"):
+            can_reply = await self._can_reply(session, is_private, msg)
         if not can_reply:
             logger.info(f"黑名单用户/群不回复")
             return
@@ -98,16 +139,18 @@ class BotManager:
         # =========================
         # 2. 格式化消息，处理多模态数据，建立ctx
         # =========================
-        recv_msg_wrapper = RecvMessageWrapper(msg, CONFIG,
-                                              emoji_detector=self.emoji_detector, image_describer=self.image_describer)
-        # 先保存图片到本地，VLM 描述与表情检测直接读文件，避免同一 URL 被下载多次。
-        recv_msg_wrapper = self.image_storage.process(recv_msg_wrapper)
-        recv_msg_wrapper.process_content()
+        with Tracer.span("parse"):
+            recv_msg_wrapper = RecvMessageWrapper(msg, CONFIG, emoji_detector=self.emoji_detector,
+                                                  image_describer=self.image_describer)
+        # 每张图片只下载一次，保存与 VLM 描述都用同一份数据；多张图片并发处理，不阻塞其他会话的消息接收。
+        with Tracer.span("media"), \
+                ModelCallMetrics.session(f"{CONFIG.bot_id}/{'private' if is_private else 'group'}/{session_id}"):
+            recv_msg_wrapper = await self.media_pipeline.process(recv_msg_wrapper)
         print(f"原始消息：{recv_msg_wrapper.raw_msg}\nLLM输入消息：{recv_msg_wrapper.llm_msg}\n"
               f"工具类输入消息：{recv_msg_wrapper.tool_msg}")
 
-        history_logger = HistoryLogger(config=CONFIG)
-        history_logger.append_recv(msg, recv_msg_wrapper)  # 保存消息（raw+json+LLM输入+人类可读）
+        with Tracer.span("history.append_recv"):
+            self.history_logger.append_recv(msg, recv_msg_wrapper)  # 保存消息（raw+json+LLM输入+人类可读）
 
         msg_sender = MessageSender(self.bot, session_id=session_id, is_private=is_private)
         ctx = MessageContext(
@@ -129,7 +172,8 @@ class BotManager:
         # =========================
         # 3. 工具类指令
         # =========================
-        handled = await self.registry.dispatch(ctx)
+        with Tracer.span("commands.dispatch"):
+            handled = await self.registry.dispatch(ctx)
         if handled:
             ctx.session.rate_limiter.record()  # 记录
             return
@@ -137,6 +181,7 @@ class BotManager:
         # =========================
         # 调用计时器+计数器回复消息的逻辑
         # =========================
+        ctx.trace = Tracer.current()
         await session.reply_scheduler.on_new_message(ctx)
 
     def _init_registry(self):
@@ -153,6 +198,7 @@ class BotManager:
         self.registry.register(GroupSendCommand())
         self.registry.register(SendLikeCommand())
         self.registry.register(BiliDownloadCommand())
+        self.registry.register(ModelStatsCommand())
 
     def _login_bilibili(self):
         login_service = LoginService()
@@ -161,10 +207,32 @@ class BotManager:
             success = service.qr_login()  # 阻塞轮询，默认 60s 超时
             print(f"登录结果：{success}")
 
+    @staticmethod
+    def _create_history_writer() -> HistoryWriter | None:
+        """按 bot YAML 的 history 配置创建缓冲写入器；关闭 buffered 时逐条同步写。"""
+        options = CONFIG.history
+        if not options.buffered:
+            return None
+        return HistoryWriter(
+            flush_interval=options.flush_interval,
+            flush_records=options.flush_records,
+            max_open_files=options.max_open_files,
+        )
+
     def close(self):
         """关闭进程级共享资源；bot.run() 退出后由入口调用。"""
+        # 等执行中的摘要任务做完（最多 SUMMARY_CLOSE_TIMEOUT 秒）再关闭 LLM 连接池；
+        # 排队中和超时仍未完成的任务写入 summary_queue.json，下次启动继续
+        self.summary_worker.close(wait=True, timeout=self.SUMMARY_CLOSE_TIMEOUT)
+        self.history_logger.close()  # 先写完缓冲中的聊天记录
+        Tracer.close()
         self.emoji_detector.close()
         self.image_storage.close()
+        self.image_description_cache.close()
+        self.loop_monitor.stop()
+        BlockingExecutor.shutdown(wait=False)
+        MediaFetcher.close()
+        LLMClientPool.close()  # 最后关闭共享的 LLM 连接池（摘要任务可能仍在使用）
 
     async def _can_reply(self, session: ChatSession, is_private: bool, msg) -> bool:
         """
@@ -16,12 +16,14 @@ from libs.BiliTools.src.services.video import VideoService
 from src.QQ.QQutils.msg.msg_wrapper import RecvMessageWrapper
 # todo 帮助只实现了洛天依的部分，可以考虑单独写一个类来自定义
 from src.QQ.QQutils.msg.chat_session import MessageContext
+from src.QQ.QQutils.res.history_loader import HistoryLoader
 from src.config.QQ_bot_info_loader import BotConfig
 from src.config.path import PICTURES_DIR, HISTORY_DIR, PROMPT_DIR, QQ_HISTORY_DIR, VOICE_DIR, API_KEY_DIR
 from src.utils.chat.history.manage_summary import SummaryManager, SummaryGenerator
 from src.utils.chat.llm.run_prompt import PromptRunner
 from src.utils.chat.role_chat import DeepSeekClient
 from src.utils.tools.file import load_from_txt
+from src.utils.tools.metrics import ModelCallMetrics
 from src.utils.tools.res.specify_lyric import LyricRepository
 from src.utils.tools.res.specify_music import MusicRepository
 
@@ -297,8 +299,14 @@ class DailyReportGenerator:
     def read_chat_history(self) -> str:
         """
         读取今天聊天记录
+
+        走 HistoryLoader，只写 canonical 的会话也能拿到 llm_input 格式的文本
         """
-        return load_from_txt(self.llm_input_path)
+        return HistoryLoader.load_today(
+            bot_id=self.config.bot_id,
+            is_private=self.recv_msg_wrapper.is_private,
+            session_id=self.recv_msg_wrapper.session_id,
+        )
 
     # async def generate(self) -> str:
     #     """
@@ -925,6 +933,38 @@ class BiliDownloadCommand(BaseCommand):
         return True
 
 
+# --- 指令：模型调用统计 ---
+class ModelStatsCommand(BaseCommand):
+    """
+    管理员查看各环节模型调用的耗时、token 与失败率。
+
+    格式：
+        #模型统计          发送文字报表
+        #模型统计 导出     另外导出 JSONL 明细与 Prometheus 文本
+    """
+
+    def match(self, text: str) -> bool:
+        return text.strip().startswith("#模型统计")
+
+    async def handle(self, ctx: MessageContext) -> bool:
+        if str(ctx.recv_msg_wrapper.user_id) != str(ctx.config.admin_qq_id):
+            await ctx.msg_sender.text("这个命令只有特别的伙伴才可以使用哦~")
+            return True
+
+        await ctx.msg_sender.text(ModelCallMetrics.report())
+
+        if "导出" in ctx.tool_text:
+            try:
+                jsonl_path, prom_path = await asyncio.to_thread(ModelCallMetrics.export)
+            except Exception as e:
+                logger.exception("模型调用统计导出失败")
+                await ctx.msg_sender.text(f"导出失败：{e}")
+                return True
+            await ctx.msg_sender.text(f"已导出：\n{jsonl_path}\n{prom_path}")
+
+        return True
+
+
 if __name__ == "__main__":
     class MockMsgSender:
         async def text(self, text: str):
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 import random
-import asyncio
 import logging
+from collections.abc import AsyncIterator
 from dataclasses import dataclass
 from typing import Union
 
@@ -19,10 +19,14 @@ from src.config.QQ_reply_settings import QQReplySettings
 from src.utils.chat.decider.emoji_decider import EmojiDecider
 from src.utils.chat.decider.reply_decider import ReplyDecider, ReplyDecisionData
 from src.utils.chat.history.manage_summary import SummaryGenerator, SummaryManager
+from src.utils.chat.history.summary_worker import SummaryWorker
 from src.utils.chat.llm.run_prompt import PromptRunner
 from src.utils.chat.prompt.load_prompt import RoleLoader
 from src.utils.chat.rate_limit import RateLimiter
 from src.utils.chat.reply_scheduler import ReplyScheduler, ReplyTrigger
+from src.utils.tools.executor import BlockingExecutor
+from src.utils.tools.metrics import ModelCallMetrics
+from src.utils.tools.tracing import TraceRef, Tracer
 from src.utils.tools.res.emoji_detector import EmojiDetector
 from src.utils.tools.res.rand_pic import RandomPicture
 
@@ -41,6 +45,8 @@ class MessageContext:
     tool_text: str
     is_private: bool
     session_id: str
+    # 收到这条消息时的 trace，回复阶段在另一个 Task 中延续它
+    trace: TraceRef | None = None
 
 
 class ChatSession:
@@ -50,6 +56,8 @@ class ChatSession:
             is_private: bool = False,
             config: BotConfig | None = None,
             emoji_detector: EmojiDetector | None = None,
+            history_logger: HistoryLogger | None = None,
+            summary_worker: SummaryWorker | None = None,
     ):
         self.session_id = session_id
         self.is_private = is_private
@@ -65,14 +73,16 @@ class ChatSession:
         self.rate_limiter = RateLimiter(max_calls=3, window_seconds=60)  # 滑动窗口
         self.reply_service: ReplyService | None = None
         self.pipeline: ChatPipeline | None = None
+        self.summary_worker = summary_worker
         if config is not None:
-            self._init_reply_service(config)
+            self._init_reply_service(config, history_logger)
         logger.info(f"已为{'私聊' if is_private else '群聊'} {session_id} 初始化 AI 会话")
 
-    def _init_reply_service(self, config: BotConfig) -> None:
+    def _init_reply_service(self, config: BotConfig, history_logger: HistoryLogger | None = None) -> None:
         """初始化与会话绑定的历史记录器和回复服务。"""
 
-        self.history_logger = HistoryLogger(config=config)
+        # BotManager 传入进程级共享的（缓冲）记录器，所有会话共用一个写盘线程。
+        self.history_logger = history_logger or HistoryLogger(config=config)
         self.send_builder = SendMessageBuilder(
             session_id=self.session_id,
             is_private=self.is_private,
@@ -83,6 +93,7 @@ class ChatSession:
         composer = ReplyComposer(
             emoji_decider=self.emoji_decider,
             emoji_probability=0.2,
+            min_segment_chars=config.reply.min_segment_chars,
         )
         recorder = ReplyRecorder(
             history_logger=self.history_logger,
@@ -108,18 +119,25 @@ class ChatSession:
         调用 ChatPipeline 生成回复
         """
         try:
-            loop = asyncio.get_running_loop()
             pipeline = self._get_pipeline(ctx)
-            reply = await loop.run_in_executor(None, pipeline.chat, text)
-            return reply
+            # LLM 请求走进程共享的异步客户端，不再为每次回复占用一个线程
+            return await pipeline.chat_async(text)
         except Exception:
             logger.exception("AI 生成回复失败")
             return f"呜... {ctx.config.name_zh}有点晕晕的..."
 
+    async def stream_reply(self, ctx: MessageContext, text: str) -> AsyncIterator[str]:
+        """
+        流式调用 ChatPipeline，逐段产出回复文本；异常交给 ReplyService.respond_stream 处理
+        """
+        pipeline = self._get_pipeline(ctx)
+        async for delta in pipeline.chat_stream(text):
+            yield delta
+
     def _get_pipeline(self, ctx: MessageContext) -> ChatPipeline:
-        """会话内复用 ChatPipeline/SummaryManager，避免每次回复都重建 LLM client 与摘要状态。"""
+        """会话内复用 ChatPipeline/SummaryManager，避免每次回复都重建摘要状态（LLM client 由 LLMClientPool 全局共享）。"""
         if self.pipeline is None:
-            runner = PromptRunner()
+            runner = PromptRunner(caller="summary")
             generator = SummaryGenerator(runner)
             manager = SummaryManager(
                 bot_id=ctx.config.bot_id,
@@ -135,6 +153,9 @@ class ChatSession:
                 name_en=ctx.config.name_en,
                 summary_manager=manager,
                 name_zh=ctx.config.name_zh,
+                summary_worker=self.summary_worker,
+                knowledge_config=ctx.config.knowledge,
+                context_config=ctx.config.context,
             )
         return self.pipeline
 
@@ -143,21 +164,49 @@ class ChatSession:
         ReplyScheduler 回调，只负责判断和编排，不处理具体媒体发送细节。
         """
 
+        # 本次回复中的模型调用（回复判定、知识检索、聊天、表情）都记到这个会话下
+        with ModelCallMetrics.session(self.metrics_key(ctx)), \
+                Tracer.trace("reply", trace=ctx.trace, trigger=trigger.name):
+            if ctx.trace is not None:
+                Tracer.add_span("reply_scheduler.wait", start=ctx.trace.at)
+            await self._reply(ctx, trigger)
+
+    @staticmethod
+    def metrics_key(ctx: MessageContext) -> str:
+        return f"{ctx.config.bot_id}/{'private' if ctx.is_private else 'group'}/{ctx.session_id}"
+
+    async def _reply(self, ctx: MessageContext, trigger: ReplyTrigger) -> None:
         logger.info("回复调度触发，原因: %s", trigger.name)
-        history_msg = HistoryLoader.load_last(bot_id=ctx.config.bot_id, is_private=ctx.is_private,
-                                              session_id=ctx.session_id, max_lines=20)
+        # 缓冲写入时先等刚收到的消息落盘，保证下面读到的历史包含它
+        with Tracer.span("history.load"):
+            await BlockingExecutor.run(self.history_logger.flush)
+            history_msg = await BlockingExecutor.run(HistoryLoader.load_last, bot_id=ctx.config.bot_id,
+                                                     is_private=ctx.is_private, session_id=ctx.session_id,
+                                                     max_lines=20)
 
-        decision = await self._should_reply(ctx, history_msg)
+        with Tracer.span("reply_decider"):
+            decision = await self._should_reply(ctx, history_msg)
         if not await self._decision_to_bool(decision):
             logger.info("决定不回复这条消息: %s", ctx.recv_msg_wrapper.tool_msg[:10])
             return
 
-        ai_reply = await self.generate_reply(ctx=ctx, text=ctx.recv_msg_wrapper.llm_msg)
         if self.reply_service is None:
             logger.error("回复服务未初始化，无法发送 AI 回复")
             return
 
-        outcome = await self.reply_service.respond(ctx=ctx, ai_reply=ai_reply)
+        if ctx.config.reply.stream:
+            # 第一句话生成完就发送，其余片段边生成边发
+            with Tracer.span("reply_service.respond_stream"):
+                outcome = await self.reply_service.respond_stream(
+                    ctx=ctx,
+                    deltas=self.stream_reply(ctx=ctx, text=ctx.recv_msg_wrapper.llm_msg),
+                    fallback=f"呜... {ctx.config.name_zh}有点晕晕的...",
+                )
+        else:
+            with Tracer.span("pipeline.chat"):
+                ai_reply = await self.generate_reply(ctx=ctx, text=ctx.recv_msg_wrapper.llm_msg)
+            with Tracer.span("reply_service.respond"):
+                outcome = await self.reply_service.respond(ctx=ctx, ai_reply=ai_reply)
         logger.info(
             "回复处理完成: delivered=%d, failed=%d, recorded=%d, rate_recorded=%s",
             outcome.delivered_count,
@@ -180,11 +229,12 @@ class ChatSession:
         image_files = ctx.recv_msg_wrapper.image_files
         # 检查有多少张图片，如果只有一张才进行表情包检测
         if len(image_files) == 1:
-            is_emoji = ctx.session.emoji_detector.is_emoji_file(image_files[0])
+            is_emoji = await BlockingExecutor.run(ctx.session.emoji_detector.is_emoji_file, image_files[0])
             logger.debug("%s is emoji: %s", image_files, is_emoji)
         elif len(ctx.recv_msg_wrapper.image_urls) == 1:
             # 图片落盘失败时退回 URL 检测，保证表情包仍然可以被识别。
-            is_emoji = ctx.session.emoji_detector.is_emoji(ctx.recv_msg_wrapper.image_urls[0])
+            is_emoji = await BlockingExecutor.run(ctx.session.emoji_detector.is_emoji,
+                                                  ctx.recv_msg_wrapper.image_urls[0])
             logger.debug("%s is emoji: %s", ctx.recv_msg_wrapper.image_urls, is_emoji)
         else:
             is_emoji = False
@@ -193,8 +243,9 @@ class ChatSession:
                 needs_reply="skip",
                 reason="只是表情包，不回复"
             )  # 如果是表情包就不回复
-        # 群聊还要由模型判定是否回复
-        return ctx.session.reply_decider.check_if_should_reply(ctx.recv_msg_wrapper.llm_msg, history_msg)
+        # 群聊还要由模型判定是否回复（同步 DeepSeek 请求，放到线程池）
+        return await BlockingExecutor.run(ctx.session.reply_decider.check_if_should_reply,
+                                          ctx.recv_msg_wrapper.llm_msg, history_msg)
 
     @staticmethod
     async def _decision_to_bool(decision: ReplyDecisionData) -> bool:
@@ -7,6 +7,7 @@ from ncatbot.core import BotClient, GroupMessage, PrivateMessage
 
 from src.config.QQ_bot_info_loader import BotConfig
 from src.QQ.QQutils.msg.reply_model import DeliveredPart, ReplyPartKind
+from src.QQ.QQutils.res.history_render import HistoryRenderer
 from src.utils.chat.img_describer import ImageDescriber
 from src.utils.tools.res.emoji_detector import EmojiDetector
 
@@ -188,39 +189,11 @@ class RecvMessageWrapper:
         """
         if not self.processed:
             self.process_content()
-        result = []
         for seg in self.segments:
-            seg_type = seg["type"]
-            if seg_type == "text":
-                result.append(seg.get("content") or "")
-            elif seg_type == "qq_face":
-                result.append(seg.get("content") or "")
-            elif seg_type == "qq_emoji":
-                result.append(f'发送了一个名为"{seg.get("summary") or ''}"的表情包，')
-                result.append(f'【表情包内容】：{seg.get("content") or ""}')
-            elif seg_type == "at":
-                result.append(f'@{seg.get("qq_id") or ""}')
-            elif seg_type == "image":
-                if seg["content"]:
-                    result.append(f'发送了一张图片，')
-                    result.append(f'【图片内容】：{seg.get("content") or ""}')
-                else:
-                    result.append(f'发送了一个图片，但是内容没有被上层正确识别，所以当做本图片不存在')
-                    print(f"[MessageWrapper] 图片内容未识别，可能是OCR/VLM识别失败: {seg.get('url') or ""}")
-
-        content = " ".join(
-            str(x) for x in result
-            if x is not None
-        )
-        time_str = time.strftime(
-            "%Y-%m-%d %H:%M:%S",
-            time.localtime(self.timestamp)
-        )
-        return (
-            f"[{time_str}] "
-            f"{self.user_nickname}："
-            f"{content}"
-        )
+            if seg["type"] == "image" and not seg["content"]:
+                print(f"[MessageWrapper] 图片内容未识别，可能是OCR/VLM识别失败: {seg.get('url') or ''}")
+        # 渲染规则与 HistoryLoader 由 canonical 按需渲染时共用
+        return HistoryRenderer.recv_llm_text(self.data)
 
     @property
     def tool_msg(self) -> str:
@@ -353,48 +326,7 @@ class SendMessageWrapper:
         与RecvMessageWrapper保持一致。
         """
 
-        result = []
-
-        for seg in self.segments:
-            seg_type = seg["type"]
-
-            if seg_type == "text":
-                result.append(seg["content"])
-
-            elif seg_type == "qq_face":
-                result.append(seg["content"])
-
-            elif seg_type == "qq_emoji":
-                result.append(seg["content"])
-
-            elif seg_type == "at":
-                result.append(f'@{seg["qq_id"]}')
-
-            elif seg_type == "image":
-                if seg["content"]:
-                    result.append(f'【图片内容】：{seg["content"]}')
-                else:
-                    result.append("[图片]")
-
-            elif seg_type == "record":
-                content = seg.get("content")
-                if content:
-                    result.append(f'【语音内容】：{content}')
-                else:
-                    result.append("[语音]")
-
-        content = " ".join(result)
-
-        time_str = time.strftime(
-            "%Y-%m-%d %H:%M:%S",
-            time.localtime(self.timestamp)
-        )
-
-        return (
-            f"[{time_str}] "
-            f"{self.user_nickname}："
-            f"{content}"
-        )
+        return HistoryRenderer.send_llm_text(self.data)
 
 
 class SendMessageBuilder:
@@ -1,18 +1,26 @@
 from __future__ import annotations
 
+from collections.abc import AsyncIterator
 from pathlib import Path
 from typing import Optional
 
 from src.QQ.QQutils.res.history_loader import HistoryLoader
 # from src.QQ.QQutils.msg.msgctx import MessageContext
+from src.config.QQ_bot_info_loader import BotContext, BotKnowledge
 from src.config.path import PROMPT_DIR
 from src.utils.chat.history.manage_summary import SummaryManager, SummaryGenerator
+from src.utils.chat.history.summary_worker import SummaryWorker
+from src.utils.chat.llm.cache_stats import PromptCacheStats
 from src.utils.chat.llm.llm_chat import LLMDSAPI
 from src.utils.chat.llm.run_prompt import PromptRunner
 from src.utils.chat.manager.conversation import ConversationManager
 from src.utils.chat.model_type import LLMModelType
+from src.utils.chat.prompt.context_assembler import ContextAssembler
 from src.utils.chat.prompt.load_prompt import KnowledgeLoader, KnowledgeRetriever
+from src.utils.chat.search.knowledge_retriever import EmbeddingKnowledgeRetriever, KnowledgeMatch
+from src.utils.tools.executor import BlockingExecutor
 from src.utils.tools.file import load_from_txt
+from src.utils.tools.tracing import Tracer
 
 
 class ChatPipeline:
@@ -58,16 +66,32 @@ class ChatPipeline:
             name_en: Optional[str] = None,
             summary_manager: Optional[SummaryManager] = None,
             name_zh: Optional[str] = None,
+            summary_worker: Optional[SummaryWorker] = None,
+            knowledge_config: Optional[BotKnowledge] = None,
+            context_config: Optional[BotContext] = None,
     ):
 
         self.bot_id = bot_id
         self.is_private = is_private
         self.session_id = session_id
 
-        self.llm = LLMDSAPI(model=LLMModelType.DS_PRO)
+        # 每个会话单独统计上下文缓存命中的 token，用于衡量 stable_prefix 布局的效果
+        self.cache_stats = PromptCacheStats.for_session(
+            f"{bot_id}/{'private' if is_private else 'group'}/{session_id}"
+        )
+        self.llm = LLMDSAPI(model=LLMModelType.DS_PRO, on_usage=self.cache_stats.record, caller="chat")
+        # LLM 选择知识单独统计，不计入对话的缓存命中
+        self.selector_llm = LLMDSAPI(model=LLMModelType.DS_PRO, caller="knowledge_selector")
         self.base_system_prompt = system_prompt
         self.summary_manager = summary_manager
+        # 有 worker 时摘要同步放到后台执行，chat() 不等待摘要相关的 LLM 调用
+        self.summary_worker = summary_worker
+        # 记忆、知识、历史按 token 预算拼接，预算随模型而定
+        self.context_assembler = ContextAssembler(context_config or BotContext(), self.llm.model)
 
+        self.name_en = name_en
+        # 知识检索方式：llm / embedding / hybrid，见 BotKnowledge
+        self.knowledge_config = knowledge_config or BotKnowledge()
         self.knowledge = None
         if name_en:
             try:
@@ -75,6 +99,8 @@ class ChatPipeline:
             except FileNotFoundError:
                 # 角色没有知识库时继续聊天，不让缺少可选知识目录导致整个会话不可用。
                 self.knowledge = None
+        # 知识目录只随知识文件变化，渲染一次作为 system prompt 的不变前缀
+        self.knowledge_index = KnowledgeRetriever.render_index(self.knowledge) if self.knowledge else ""
         self.name_zh = name_zh
 
     # ======================================================
@@ -85,62 +111,181 @@ class ChatPipeline:
         完整聊天流程
         """
         # 1. 获取记忆
-        memory_context = self._get_memory()
+        with Tracer.span("pipeline.memory"):
+            memory_context = self._get_memory()
         # 2. 知识检索
-        knowledge_context = self._retrieve_knowledge(user_query)
-        # 3. 构造system prompt
-        system_prompt = self._build_system_prompt(memory_context, knowledge_context)
-        # print(system_prompt)
-        # 4. 创建Conversation
-        conv = ConversationManager(system_prompt=system_prompt, enable_memory=False)
-        # 5. 读取历史消息
-        self._append_history(conv=conv)
-        # 6. 兜底：正常 QQ 流程会先写历史再读回，因此历史最后一条通常是当前 user；
-        #    若直接调用 ChatPipeline 或历史未包含当前消息，则显式补上，避免漏发。
-        if len(conv) <= 1 or conv.messages[-1].get("role") != "user":
-            conv.add_user(user_query)
+        with Tracer.span("pipeline.knowledge"):
+            knowledge_context = self._retrieve_knowledge(user_query)
+        # 3~6. 读取历史消息，按 token 预算拼接 system prompt 与历史
+        with Tracer.span("pipeline.context"):
+            conv = self._build_conversation(memory_context, knowledge_context, user_query)
         # 7. 调用LLM
         reply = self.llm.one_chat(conv.messages)
         # 8. 同步summary
-        if self.summary_manager is not None:
-            self.summary_manager.sync()
+        with Tracer.span("pipeline.summary_sync"):
+            self._sync_summary()
+        return reply
+
+    async def chat_async(self, user_query: str) -> str:
+        """
+        chat 的异步版本。
+
+        LLM 请求直接 await 共享的 AsyncOpenAI，读文件的步骤放到线程池，
+        回复期间不再为每个会话占用一个线程等待 HTTP 响应。
+        """
+        # 1~6. 记忆、知识、system prompt、历史消息
+        conv = await self._prepare_async(user_query)
+        # 7. 调用LLM
+        reply = await self.llm.one_chat_async(conv.messages)
+        # 8. 同步summary
+        await self._sync_summary_async()
         return reply
 
+    async def chat_stream(self, user_query: str) -> AsyncIterator[str]:
+        """
+        流式版本的 chat，逐段产出回答的增量文本，生成结束后同步 summary。
+        """
+        # 1~6. 记忆、知识、system prompt、历史消息
+        conv = await self._prepare_async(user_query)
+        # 7. 流式调用LLM
+        async for delta in self.llm.one_chat_stream(conv.messages):
+            yield delta
+        # 8. 同步summary
+        await self._sync_summary_async()
+
+    async def _prepare_async(self, user_query: str) -> ConversationManager:
+        # 1. 获取记忆
+        with Tracer.span("pipeline.memory"):
+            memory_context = await BlockingExecutor.run(self._get_memory)
+        # 2. 知识检索
+        with Tracer.span("pipeline.knowledge"):
+            knowledge_context = await self._retrieve_knowledge_async(user_query)
+        # 3~6. 读取历史消息，按 token 预算拼接 system prompt 与历史
+        with Tracer.span("pipeline.context"):
+            return await BlockingExecutor.run(self._build_conversation, memory_context, knowledge_context, user_query)
+
+    async def _sync_summary_async(self) -> None:
+        # 没有 worker 时 sync 会同步调用 LLM，放到线程池
+        with Tracer.span("pipeline.summary_sync"):
+            if self.summary_worker is not None:
+                self._sync_summary()
+            else:
+                await BlockingExecutor.run(self._sync_summary)
+
+    def _build_conversation(
+            self,
+            memory: dict | None,
+            knowledge: KnowledgeMatch | None,
+            user_query: str,
+    ) -> ConversationManager:
+        # 3. 读取历史消息
+        history = self._history_messages()
+        # 4. 兜底：正常 QQ 流程会先写历史再读回，因此历史最后一条通常是当前 user；
+        #    若直接调用 ChatPipeline 或历史未包含当前消息，则显式补上，避免漏发。
+        if not history or history[-1]["role"] != "user":
+            history.append({"role": "user", "content": user_query})
+        # 5. 按 token 预算拼接记忆、知识与历史
+        context = self.context_assembler.assemble(
+            base_prompt=self.base_system_prompt,
+            memory=memory,
+            knowledge=knowledge.selected if knowledge else None,
+            history=history,
+            passage_order=knowledge.passage_order if knowledge else None,
+            knowledge_index=self.knowledge_index,
+        )
+        # 6. 创建Conversation
+        conv = ConversationManager(system_prompt=context.system_prompt, enable_memory=False)
+        for message in context.history:
+            if message["role"] == "user":
+                conv.add_user(message["content"])
+            else:
+                conv.add_assistant(message["content"])
+        return conv
+
+    def _sync_summary(self) -> None:
+        if self.summary_manager is None:
+            return
+        if self.summary_worker is not None:
+            self.summary_worker.submit(self.summary_manager)
+        else:
+            self.summary_manager.sync()
+
     # ======================================================
     # Memory
     # ======================================================
     def _get_memory(self):
         if self.summary_manager is None:
             return None
+        if self.summary_worker is not None and self.summary_manager.long_term_pending():
+            # 初始化是整段历史的 map-reduce，不在回复路径上执行；
+            # 交给后台与 sync 排在同一个 Session 队列里，不会与 sync 并发改写 long_term.txt
+            self.summary_worker.submit(self.summary_manager, "initialize_long_term")
+            long_term = self.summary_manager.load_long_term(initialize=False)
+        else:
+            long_term = self.summary_manager.load_long_term()
         return {
-            "long_term": self.summary_manager.load_long_term(),
+            "long_term": long_term,
             "short_term": self.summary_manager.load_short_term()
         }
 
     # ======================================================
     # Knowledge
     # ======================================================
-    def _retrieve_knowledge(self, query: str):
+    def _retrieve_knowledge(self, query: str) -> KnowledgeMatch | None:
+        if self.knowledge is None:
+            return None
+        if self.knowledge_config.retriever != "llm":
+            match = self._retrieve_by_embedding(query)
+            if match is not None:
+                return match
+        selector_conv = self._build_selector_conv(query)
+        selected_text = (self.selector_llm.one_chat(selector_conv.messages))
+        selected = (KnowledgeRetriever.parse_response(selected_text, self.knowledge))
+        return KnowledgeMatch(selected=selected)
+
+    async def _retrieve_knowledge_async(self, query: str) -> KnowledgeMatch | None:
         if self.knowledge is None:
             return None
+        if self.knowledge_config.retriever != "llm":
+            # 查询向量请求与首次构建索引都是阻塞调用
+            match = await BlockingExecutor.run(self._retrieve_by_embedding, query)
+            if match is not None:
+                return match
+        selector_conv = self._build_selector_conv(query)
+        selected_text = await self.selector_llm.one_chat_async(selector_conv.messages)
+        selected = (KnowledgeRetriever.parse_response(selected_text, self.knowledge))
+        return KnowledgeMatch(selected=selected)
+
+    def _retrieve_by_embedding(self, query: str) -> KnowledgeMatch | None:
+        """
+        向量检索知识；返回 None 表示需要交给 LLM 选择器
+        （hybrid 下结果不确定，或向量检索出错）
+        """
+        config = self.knowledge_config
+        try:
+            retriever = EmbeddingKnowledgeRetriever.for_role(self.name_en)
+            match = retriever.retrieve(
+                query,
+                k=config.top_k,
+                min_score=config.min_score,
+                accept_score=config.accept_score,
+            )
+        except Exception as e:
+            print(f"[ChatPipeline] 向量检索知识失败，改用 LLM 选择：{e}")
+            return None
+        if match.ambiguous and config.retriever == "hybrid":
+            return None
+        return match
+
+    def _build_selector_conv(self, query: str) -> ConversationManager:
         selector_prompt = (KnowledgeRetriever.build_prompt(query=query, knowledge=self.knowledge))
         selector_conv = ConversationManager(system_prompt=selector_prompt)
         selector_conv.add_user(query)
-        selected_text = (self.llm.one_chat(selector_conv.messages))
-        selected = (KnowledgeRetriever.parse_response(selected_text, self.knowledge))
-        return selected
+        return selector_conv
 
     # ======================================================
-    # Prompt
+    # History
     # ======================================================
-    def _build_system_prompt(self, memory, knowledge):
-        prompt = self.base_system_prompt
-        if memory:
-            prompt += f"\n\n以下是历史记忆:\n{memory}"
-        if knowledge:
-            prompt += f"\n\n以下是相关知识:\n{knowledge}"
-        return prompt
-
     def _get_history(self) -> list[dict]:
         return HistoryLoader.load_recent_messages(
             bot_id=self.bot_id,
@@ -149,23 +294,25 @@ class ChatPipeline:
             max_messages=30,
         )
 
-    def _append_history(self, conv: ConversationManager) -> None:
-        """把 canonical 结构化历史写入 Conversation，按 user/assistant 交替组织。"""
+    def _history_messages(self) -> list[dict]:
+        """把 canonical 结构化历史整理成 user/assistant 交替的消息列表。"""
+        messages = []
         buffer = []
         for msg in self._get_history():
             is_bot = str(msg.get("user_id")) == str(self.bot_id)
             text = self._segments_text(msg.get("segments", []))
             if is_bot:
                 if buffer:
-                    conv.add_user("\n".join(buffer))
+                    messages.append({"role": "user", "content": "\n".join(buffer)})
                     buffer.clear()
                 if text:
-                    conv.add_assistant(text)
+                    messages.append({"role": "assistant", "content": text})
             else:
                 nickname = msg.get("user_nickname") or msg.get("user_id") or "用户"
                 buffer.append(f"{nickname}：{text}")
         if buffer:
-            conv.add_user("\n".join(buffer))
+            messages.append({"role": "user", "content": "\n".join(buffer)})
+        return messages
 
     @staticmethod
     def _segments_text(segments: list[dict]) -> str:
@@ -223,3 +370,4 @@ if __name__ == "__main__":
         "洛天依什么时候发布的V5声库"
     )
     print(reply)
+    print(pipeline.cache_stats.snapshot())
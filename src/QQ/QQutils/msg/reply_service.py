@@ -1,17 +1,24 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import re
+from collections.abc import AsyncIterator
 from pathlib import Path
 from typing import TYPE_CHECKING, Protocol
 
 from src.QQ.QQutils.msg.msg_wrapper import SendMessageBuilder
 from src.QQ.QQutils.msg.reply_model import (
+    DeliveredPart,
+    DeliveryFailure,
     ReplyDeliveryResult,
     ReplyOutcome,
     ReplyPart,
     ReplyPartKind,
 )
 from src.QQ.QQutils.res.history_storage import HistoryLogger
+from src.utils.tools.executor import BlockingExecutor
+from src.utils.tools.tracing import Tracer
 
 if TYPE_CHECKING:
     from src.QQ.QQutils.msg.chat_session import MessageContext
@@ -34,6 +41,67 @@ class VoiceDeciderLike(Protocol):
         ...
 
 
+class ReplySegmenter:
+    """
+    把流式生成的增量文本切成可以先发送的片段。
+
+    前 sentence_segments 个片段在句末标点处切分，让第一句话尽早发出；
+    之后只在换行（段落）处切分，避免一条回复刷出很多条短消息。
+    短于 min_chars 的句子继续与后文合并；换行总是切分。
+    """
+
+    # 句末标点，后面可以跟右引号/右括号；换行单独作为段落边界
+    BOUNDARY = re.compile(r"\n+|[。！？!?…~～]+[”’」』）)\]]*")
+
+    def __init__(self, min_chars: int = 8, sentence_segments: int = 1):
+        self.min_chars = max(1, min_chars)
+        self.sentence_segments = sentence_segments
+        self._buffer = ""
+        self._emitted = 0
+
+    def feed(self, delta: str) -> list[str]:
+        """加入一段增量文本，返回已经完整、可以发送的片段。"""
+
+        self._buffer += delta
+        segments = []
+
+        while (cut := self._find_cut()) is not None:
+            segment = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+                self._emitted += 1
+
+        return segments
+
+    def flush(self) -> str:
+        """生成结束，返回剩余的文本。"""
+
+        rest = self._buffer.strip()
+        self._buffer = ""
+        if rest:
+            self._emitted += 1
+        return rest
+
+    def _find_cut(self) -> int | None:
+        allow_sentence = self._emitted < self.sentence_segments
+
+        for match in self.BOUNDARY.finditer(self._buffer):
+            end = match.end()
+            is_paragraph = match.group().startswith("\n")
+
+            if not is_paragraph:
+                # 标点在末尾时后面可能还有“！”或引号，等下一段增量再判断
+                if not allow_sentence or end == len(self._buffer):
+                    continue
+                if len(self._buffer[:end].strip()) < self.min_chars:
+                    continue
+
+            return end
+
+        return None
+
+
 class ReplyComposer:
     """将 AI 回复转换为一组按顺序发送的消息部件。"""
 
@@ -44,6 +112,7 @@ class ReplyComposer:
             emoji_probability: float = 0.2,
             voice_decider: VoiceDeciderLike | None = None,
             voice_dir: Path | None = None,
+            min_segment_chars: int = 8,
     ):
         if not 0 <= emoji_probability <= 1:
             raise ValueError("emoji_probability 必须在 0 到 1 之间")
@@ -52,6 +121,7 @@ class ReplyComposer:
         self.emoji_probability = emoji_probability
         self.voice_decider = voice_decider
         self.voice_dir = Path(voice_dir) if voice_dir else None
+        self.min_segment_chars = min_segment_chars
 
     def compose(self, ai_reply: str) -> list[ReplyPart]:
         """组装文本、表情和可选语音，文本始终放在第一位。"""
@@ -62,10 +132,22 @@ class ReplyComposer:
                 content=ai_reply,
             )
         ]
+        parts.extend(self.compose_extras(ai_reply))
+        return parts
+
+    def compose_extras(self, ai_reply: str) -> list[ReplyPart]:
+        """根据完整回复文本组装表情和可选语音（不含文本本身）。"""
+
+        parts: list[ReplyPart] = []
         self._append_emoji_part(parts, ai_reply)
         self._append_voice_part(parts, ai_reply)
         return parts
 
+    def segmenter(self) -> ReplySegmenter:
+        """为一次流式回复创建文本切分器。"""
+
+        return ReplySegmenter(min_chars=self.min_segment_chars)
+
     def _append_emoji_part(self, parts: list[ReplyPart], ai_reply: str) -> None:
         if self.emoji_decider is None:
             return
@@ -161,16 +243,134 @@ class ReplyService:
         部分发送失败时仍会记录已经成功的消息，保证用户可见内容与历史尽量一致。
         """
 
-        parts = self.composer.compose(ai_reply)
+        # 表情决策会同步调用 LLM，放到线程池
+        with Tracer.span("reply.compose"):
+            parts = await BlockingExecutor.run(self.composer.compose, ai_reply)
         delivery = await ctx.msg_sender.send_parts(parts)
 
+        return self._finish(ctx, delivery)
+
+    async def respond_stream(
+            self,
+            ctx: MessageContext,
+            deltas: AsyncIterator[str],
+            fallback: str = "",
+    ) -> ReplyOutcome:
+        """
+        边生成边发送的回复。
+
+        每切出一个完整片段就交给后台发送任务，生成继续进行；
+        生成结束后再根据完整文本决定表情/语音，最后统一记录历史和限流。
+        生成中途失败时保留已经发出的片段；一个字都没发出时发送 fallback。
+
+        历史中文本只记一条（完整回复），逐片段的发送结果只用于失败统计。
+        """
+
+        segmenter = self.composer.segmenter()
+        queue: asyncio.Queue[ReplyPart | None] = asyncio.Queue()
+        delivered: list[DeliveredPart] = []
+        failures: list[DeliveryFailure] = []
+
+        async def send_queued() -> None:
+            while (part := await queue.get()) is not None:
+                result = await ctx.msg_sender.send_parts([part])
+                delivered.extend(result.delivered)
+                failures.extend(result.failures)
+
+        def enqueue(text: str) -> None:
+            queue.put_nowait(ReplyPart(kind=ReplyPartKind.TEXT, content=text))
+
+        sender = asyncio.create_task(send_queued())
+        chunks: list[str] = []
+        queued = 0
+        completed = False
+
+        try:
+            try:
+                async for delta in deltas:
+                    chunks.append(delta)
+                    for segment in segmenter.feed(delta):
+                        enqueue(segment)
+                        queued += 1
+                completed = True
+            except Exception:
+                logger.exception("流式生成回复中断，保留已经发送的片段")
+
+            rest = segmenter.flush()
+            if rest:
+                enqueue(rest)
+                queued += 1
+            if not queued and fallback:
+                enqueue(fallback)
+
+            queue.put_nowait(None)
+            await sender
+        finally:
+            if not sender.done():
+                sender.cancel()
+
+        ai_reply = "".join(chunks).strip()
+        if completed and ai_reply:
+            with Tracer.span("reply.compose"):
+                extra_parts = await BlockingExecutor.run(self.composer.compose_extras, ai_reply)
+            extras = await ctx.msg_sender.send_parts(extra_parts)
+            delivered.extend(extras.delivered)
+            failures.extend(extras.failures)
+
+        delivery = ReplyDeliveryResult(
+            delivered=tuple(delivered),
+            failures=tuple(failures),
+        )
+        return self._finish(ctx, delivery, self._merge_segments(delivery, ai_reply))
+
+    @staticmethod
+    def _merge_segments(delivery: ReplyDeliveryResult, ai_reply: str) -> ReplyDeliveryResult:
+        """
+        把流式发送的文本片段合并成一条用于写历史的文本部件，表情/语音保持不变。
+
+        文本片段全部发送成功时记录完整的 ai_reply；有片段失败（或只发出了 fallback）时，
+        只记录实际发出的片段。合并后的消息使用第一个片段的 message_id。
+        """
+
+        texts = [item for item in delivery.delivered if item.part.kind is ReplyPartKind.TEXT]
+        others = tuple(item for item in delivery.delivered if item.part.kind is not ReplyPartKind.TEXT)
+        if not texts:
+            return ReplyDeliveryResult(delivered=others)
+
+        text_failed = any(item.part.kind is ReplyPartKind.TEXT for item in delivery.failures)
+        if ai_reply and not text_failed:
+            content = ai_reply
+        else:
+            content = "\n".join(item.part.content for item in texts)
+
+        merged = DeliveredPart(
+            part=ReplyPart(kind=ReplyPartKind.TEXT, content=content),
+            message_id=texts[0].message_id,
+        )
+        return ReplyDeliveryResult(delivered=(merged, *others))
+
+    def _finish(
+            self,
+            ctx: MessageContext,
+            delivery: ReplyDeliveryResult,
+            history: ReplyDeliveryResult | None = None,
+    ) -> ReplyOutcome:
+        """
+        记录已发送的部件并计入限流。
+
+        Parameters
+        ----------
+        history
+            写入历史的部件；缺省时与 delivery 相同
+        """
+
         recorded_count = 0
         record_error = None
         rate_recorded = False
 
         if delivery.sent_any:
             try:
-                recorded_count = self.recorder.record(delivery)
+                recorded_count = self.recorder.record(history or delivery)
             except Exception as exc:
                 record_error = f"{type(exc).__name__}: {exc}"
                 logger.exception("回复历史写入失败，已发送消息不会被重复发送")
@@ -10,6 +10,7 @@ from src.QQ.QQutils.msg.reply_model import (
     ReplyPart,
     ReplyPartKind,
 )
+from src.utils.tools.tracing import Tracer
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -112,7 +113,8 @@ class MessageSender:
 
         for part in tuple(parts):
             try:
-                message_id = await self.send_part(part)
+                with Tracer.span("send", kind=part.kind.value):
+                    message_id = await self.send_part(part)
             except Exception as exc:
                 logger.warning(
                     "回复部件发送失败: kind=%s, error=%s",
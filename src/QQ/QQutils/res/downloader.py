@@ -2,6 +2,11 @@ import requests
 import os
 import re
 
+from src.utils.tools.fetcher import MediaFetcher
+
+# 语音文件大小上限
+MAX_AUDIO_BYTES = 50 * 1024 * 1024
+
 
 def download_qq_audio(url, save_path=None):
     """
@@ -20,67 +25,62 @@ def download_qq_audio(url, save_path=None):
 
     try:
         print("正在请求链接，伪装成手机客户端...")
-        # 设置 stream=True 以便流式下载大文件
-        response = requests.get(url, headers=headers, stream=True, timeout=30)
+        # 经 MediaFetcher 下载：连接池复用、失败重试，同一链接重复下载直接命中缓存
+        asset = MediaFetcher.fetch_asset(url, headers=headers, max_bytes=MAX_AUDIO_BYTES, timeout=30)
 
-        # 检查是否成功获取文件
-        if response.status_code == 200:
-            # 2. 获取文件类型（根据 Content-Type 判断后缀）
-            content_type = response.headers.get('Content-Type', '').lower()
-            extension = '.mp3'  # 默认
+        # 2. 获取文件类型（根据 Content-Type 判断后缀）
+        content_type = asset.content_type.lower()
+        extension = '.mp3'  # 默认
 
-            if 'mpeg' in content_type or 'mp3' in content_type:
-                extension = '.mp3'
-            elif 'm4a' in content_type or 'mp4a' in content_type:
-                extension = '.m4a'
-            elif 'aac' in content_type:
-                extension = '.aac'
-            elif 'amr' in content_type:
-                extension = '.amr'
-            elif 'silk' in content_type:
-                extension = '.silk'
-            elif 'octet-stream' in content_type:
-                # 如果是二进制流，尝试从文件名或链接中提取
-                extension = '.audio'
+        if 'mpeg' in content_type or 'mp3' in content_type:
+            extension = '.mp3'
+        elif 'm4a' in content_type or 'mp4a' in content_type:
+            extension = '.m4a'
+        elif 'aac' in content_type:
+            extension = '.aac'
+        elif 'amr' in content_type:
+            extension = '.amr'
+        elif 'silk' in content_type:
+            extension = '.silk'
+        elif 'octet-stream' in content_type:
+            # 如果是二进制流，尝试从文件名或链接中提取
+            extension = '.audio'
 
-            # 3. 确定保存路径
-            if save_path is None:
-                # 从 URL 中提取 fileid 作为文件名，或者直接使用默认名
-                file_id_match = re.search(r'fileid=([^&]+)', url)
-                if file_id_match:
-                    base_name = file_id_match.group(1)[:20]  # 截取前20位防止过长
-                else:
-                    base_name = 'qq_audio'
-                save_path = f"{base_name}{extension}"
+        # 3. 确定保存路径
+        if save_path is None:
+            # 从 URL 中提取 fileid 作为文件名，或者直接使用默认名
+            file_id_match = re.search(r'fileid=([^&]+)', url)
+            if file_id_match:
+                base_name = file_id_match.group(1)[:20]  # 截取前20位防止过长
+            else:
+                base_name = 'qq_audio'
+            save_path = f"{base_name}{extension}"
 
-            # 4. 保存文件（分块写入）
-            total_size = int(response.headers.get('content-length', 0))
-            print(f"开始下载，文件大小约 {total_size // 1024} KB，保存为: {save_path}")
+        # 4. 保存文件
+        print(f"下载完成，文件大小约 {len(asset.data) // 1024} KB，保存为: {save_path}")
 
-            with open(save_path, 'wb') as f:
-                downloaded = 0
-                for chunk in response.iter_content(chunk_size=1024 * 1024):  # 1MB/块
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        # 简单进度条
-                        if total_size > 0:
-                            percent = (downloaded / total_size) * 100
-                            print(f"\r下载进度: {percent:.1f}%", end='')
+        with open(save_path, 'wb') as f:
+            f.write(asset.data)
 
-            print(f"\n✅ 下载完成！文件保存在: {os.path.abspath(save_path)}")
+        print(f"✅ 下载完成！文件保存在: {os.path.abspath(save_path)}")
+        return save_path
 
-        elif response.status_code == 403:
+    except requests.exceptions.HTTPError as e:
+        status_code = e.response.status_code if e.response is not None else None
+        if status_code == 403:
             print("❌ 下载失败 (403 Forbidden)：链接可能已过期或需要登录态（Cookie）。")
             print("提示：如果链接来自私密聊天，请尝试在浏览器登录QQ后再复制Cookie到脚本中。")
         else:
-            print(f"❌ 下载失败，状态码: {response.status_code}")
-            # 打印返回的前200个字符，看看是不是返回了HTML页面
-            print("返回内容预览:", response.text[:200])
-
+            print(f"❌ 下载失败，状态码: {status_code}")
+            if e.response is not None:
+                # 打印返回的前200个字符，看看是不是返回了HTML页面
+                print("返回内容预览:", e.response.text[:200])
     except requests.exceptions.RequestException as e:
         print(f"❌ 网络请求异常: {e}")
+    except ValueError as e:
+        print(f"❌ 下载失败: {e}")
 
+    return None
 
 if __name__ == "__main__":
     # 将你的链接粘贴到下面的变量中
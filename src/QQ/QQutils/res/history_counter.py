@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from src.QQ.QQutils.res.history_index import CANONICAL_INDEX, LLM_INPUT_INDEX, MessageOffsetIndex
+from src.config.path import QQ_HISTORY_DIR
+
+
+class MessageCounter:
+    """
+    按 (会话, 日期) 持久化的消息计数。
+
+        QQ_HISTORY_DIR/
+            bot_id/
+                counters.db
+
+    每个日文件（llm_input 的 .txt 或 canonical 的 .jsonl）一行，记录消息数和已经计入的字节数 size。
+    HistoryLogger 写盘后调用 sync，只数 size 之后新增的内容；
+    count 只需一次查询加一次 stat，与当天消息量无关。
+
+    size 只推进到最后一个完整行（"\n"）之后：写盘线程可能正写到一半，
+    未写完的行留到下次 sync 再数，避免写了一半的消息头被跳过。
+
+    进程崩溃、外部修改导致 size 与文件大小对不上时，count 会自动补数或整份重数，
+    所以计数表丢失或落后都不影响正确性。
+    """
+
+    FILENAME = "counters.db"
+
+    _instances: dict[str, MessageCounter] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, bot_id: str | int, root: str | Path = QQ_HISTORY_DIR):
+        self.bot_id = str(bot_id)
+        self.bot_root = Path(root) / self.bot_id
+        self.bot_root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.bot_root / self.FILENAME
+
+        # HistoryWriter 线程写、run_in_executor 线程读，共用连接并加锁
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+
+        self._init_database()
+
+    @classmethod
+    def for_bot(cls, bot_id: str | int) -> MessageCounter:
+        """
+        获取 bot 对应的共享实例
+        """
+
+        key = str(bot_id)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(key)
+            return cls._instances[key]
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+        with self._instances_lock:
+            if self._instances.get(self.bot_id) is self:
+                del self._instances[self.bot_id]
+
+    # ==========================================================
+    # sqlite
+    # ==========================================================
+
+    def _init_database(self) -> None:
+        """
+        初始化数据库
+        """
+
+        with self._lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters(
+                path TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """)
+            self.conn.commit()
+
+    # ==========================================================
+    # 对外接口
+    # ==========================================================
+
+    def count(self, file: Path) -> int:
+        """
+        获取日文件中的消息数量
+
+        记录的 size 与文件大小一致时直接返回，否则先 sync。
+        """
+
+        if not file.exists():
+            return 0
+
+        row = self._get(file)
+        if row is not None and row[1] == file.stat().st_size:
+            return row[0]
+
+        return self.sync(file)
+
+    def sync(self, file: Path) -> int:
+        """
+        把文件新增的内容计入计数，返回最新消息数
+
+        只读取上次计入位置之后的字节；文件变小（被截断、替换）或没有记录时整份重数。
+        """
+
+        with self._lock:
+            if not file.exists():
+                self._delete(file)
+                return 0
+
+            row = self._get(file)
+            file_size = file.stat().st_size
+
+            if row is None or row[1] > file_size:
+                return self.recount(file)
+
+            count, size = row
+            if size == file_size:
+                return count
+
+            with file.open("rb") as f:
+                f.seek(size)
+                data = f.read()
+
+            # 只计入完整的行
+            data = data[:data.rfind(b"\n") + 1]
+            if not data:
+                return count
+
+            count += self._count_headers(self._index(file), data, base=size)
+
+            self._put(file, count, size + len(data))
+            return count
+
+    def recount(self, file: Path) -> int:
+        """
+        用偏移索引整份重数，只计入最后一个完整行之前的消息
+        """
+
+        with self._lock:
+            if not file.exists():
+                self._put(file, 0, 0)
+                return 0
+            size = self._complete_size(file)
+            count = self._index(file).count_before(file, size)
+            self._put(file, count, size)
+            return count
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    @staticmethod
+    def _index(file: Path) -> MessageOffsetIndex:
+        return CANONICAL_INDEX if file.suffix == ".jsonl" else LLM_INPUT_INDEX
+
+    @staticmethod
+    def _complete_size(file: Path, chunk_size: int = 4096) -> int:
+        """
+        文件中最后一个 "\n" 之后的位置（没有完整行时为 0）
+        """
+
+        with file.open("rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - chunk_size)
+                f.seek(start)
+                chunk = f.read(end - start)
+                position = chunk.rfind(b"\n")
+                if position >= 0:
+                    return start + position + 1
+                end = start
+        return 0
+
+    @staticmethod
+    def _count_headers(index: MessageOffsetIndex, data: bytes, base: int) -> int:
+        """
+        数 data 中的消息头，规则与 MessageOffsetIndex._scan 一致
+        """
+
+        count = 0
+        for position, line in enumerate(data.splitlines()):
+            text = line.decode("utf-8", errors="replace").rstrip("\r")
+            if index.header.match(text) or (base == 0 and position == 0):
+                count += 1
+        return count
+
+    def _key(self, file: Path) -> str:
+        try:
+            return Path(os.path.relpath(file, self.bot_root)).as_posix()
+        except ValueError:
+            return file.as_posix()
+
+    def _get(self, file: Path) -> tuple[int, int] | None:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT count, size FROM counters WHERE path = ?",
+                (self._key(file),),
+            ).fetchone()
+
+    def _put(self, file: Path, count: int, size: int) -> None:
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT INTO counters(path, count, size) VALUES (?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET count = excluded.count, size = excluded.size
+                """,
+                (self._key(file), count, size),
+            )
+            self.conn.commit()
+
+    def _delete(self, file: Path) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM counters WHERE path = ?", (self._key(file),))
+            self.conn.commit()
@@ -0,0 +1,600 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+import threading
+from collections.abc import Iterable
+from datetime import date, datetime
+from pathlib import Path
+from typing import Generator
+
+from src.QQ.QQutils.res.history_index import LLM_INPUT_INDEX
+from src.QQ.QQutils.res.history_render import HistoryRenderer
+from src.config.path import QQ_HISTORY_DIR
+
+# keyset 分页的游标：(timestamp, id)
+Cursor = tuple[int, int]
+
+
+class HistoryDatabase:
+    """
+    SQLite 聊天记录存储（history.backend = sqlite 时使用）。
+
+    每个 bot 一个库：
+
+        QQ_HISTORY_DIR/
+            bot_id/
+                history.db
+
+    表结构：
+
+    - messages：一行一条消息，保存 canonical JSON 与渲染好的 llm_input 文本，
+      (session_type, session_id, timestamp, id) 上有索引，按会话的区间读取走索引；
+    - message_counts：按 (会话, 日期) 计数，由触发器维护，count / count_today 不必扫描；
+    - messages_fts：llm_text 的 FTS5 全文索引（external content，trigram 分词以支持中文子串），
+      SQLite 未编译 FTS5 时退化为 LIKE 查询。
+
+    HistoryLogger 写入、HistoryLoader 读取共用同一个实例（for_bot），连接加锁后可跨线程使用。
+    """
+
+    FILENAME = "history.db"
+
+    _INSERT_SQL = """
+    INSERT INTO messages(session_type, session_id, timestamp, day, message_id, user_id, data, llm_text)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    _instances: dict[str, HistoryDatabase] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, bot_id: str | int, root: str | Path = QQ_HISTORY_DIR):
+        self.bot_id = str(bot_id)
+        self.bot_root = Path(root) / self.bot_id
+        self.bot_root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.bot_root / self.FILENAME
+
+        # 写入方（HistoryWriter 线程）和读取方（run_in_executor 线程）共用连接，统一加锁
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+        self.fts = False
+        self._init_database()
+
+    @classmethod
+    def for_bot(cls, bot_id: str | int) -> HistoryDatabase:
+        """
+        获取 bot 对应的共享实例
+        """
+
+        key = str(bot_id)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(key)
+            return cls._instances[key]
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+        with self._instances_lock:
+            if self._instances.get(self.bot_id) is self:
+                del self._instances[self.bot_id]
+
+    # ==========================================================
+    # sqlite
+    # ==========================================================
+
+    def _init_database(self) -> None:
+        """
+        初始化数据库
+        """
+
+        with self._lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+
+            self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages(
+                id INTEGER PRIMARY KEY,
+                session_type TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                message_id TEXT,
+                user_id TEXT,
+                data TEXT,
+                llm_text TEXT NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_messages_session
+            ON messages(session_type, session_id, timestamp, id);
+
+            CREATE TABLE IF NOT EXISTS message_counts(
+                session_type TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY(session_type, session_id, day)
+            );
+
+            CREATE TRIGGER IF NOT EXISTS messages_count_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO message_counts(session_type, session_id, day, count)
+                VALUES (new.session_type, new.session_id, new.day, 1)
+                ON CONFLICT(session_type, session_id, day) DO UPDATE SET count = count + 1;
+            END;
+            """)
+
+            try:
+                self.conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+                USING fts5(llm_text, content='messages', content_rowid='id', tokenize='trigram');
+
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts(rowid, llm_text) VALUES (new.id, new.llm_text);
+                END;
+                """)
+                self.fts = True
+            except sqlite3.OperationalError:
+                # SQLite 未编译 FTS5 或不支持 trigram 分词
+                self.fts = False
+
+            self.conn.commit()
+
+    # ==========================================================
+    # 写入
+    # ==========================================================
+
+    def insert(self, data: dict, llm_text: str) -> None:
+        """
+        插入一条消息
+
+        Parameters
+        ----------
+        data
+            canonical JSON
+        llm_text
+            llm_input 文本
+        """
+
+        self.insert_many([(data, llm_text)])
+
+    def insert_many(self, rows: Iterable[tuple[dict, str]]) -> int:
+        """
+        在一个事务中批量插入 (canonical JSON, llm_input 文本)
+        """
+
+        params = [self._row(data, llm_text) for data, llm_text in rows]
+        if not params:
+            return 0
+
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(self._INSERT_SQL, params)
+
+        return len(params)
+
+    @staticmethod
+    def _row(data: dict, llm_text: str) -> tuple:
+        timestamp = data["timestamp"]
+        return (
+            "private" if data["is_private"] else "group",
+            str(data["session_id"]),
+            timestamp,
+            datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d"),
+            data.get("message_id"),
+            data.get("user_id"),
+            json.dumps(data, ensure_ascii=False),
+            llm_text,
+        )
+
+    def insert_legacy(
+            self,
+            session_type: str,
+            session_id: str,
+            messages: list[tuple[int, str]],
+    ) -> int:
+        """
+        插入只有 llm_input 文本的旧消息
+
+        Parameters
+        ----------
+        messages
+            (时间戳, llm_input 文本)
+        """
+
+        params = [
+            (
+                session_type,
+                str(session_id),
+                timestamp,
+                datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d"),
+                None,
+                None,
+                None,
+                llm_text,
+            )
+            for timestamp, llm_text in messages
+        ]
+        if not params:
+            return 0
+
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(self._INSERT_SQL, params)
+
+        return len(params)
+
+    # ==========================================================
+    # 读取
+    # ==========================================================
+
+    def count(self, session_type: str, session_id: str | int, day: date | None = None) -> int:
+        """
+        消息数量，day 为 None 时统计整个会话
+        """
+
+        sql = "SELECT COALESCE(SUM(count), 0) FROM message_counts WHERE session_type = ? AND session_id = ?"
+        params: list = [session_type, str(session_id)]
+        if day is not None:
+            sql += " AND day = ?"
+            params.append(day.isoformat())
+
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()[0]
+
+    def load_range(
+            self,
+            session_type: str,
+            session_id: str | int,
+            start: int,
+            end: int,
+            day: date | None = None,
+    ) -> list[str]:
+        """
+        按会话内（或某天内）的消息序号读取第 start 条（包含）到第 end 条（不包含）
+
+        先用计数表跳过整天，只在 start 所在的那一天内定位，再从该位置按游标读取，
+        不会让 SQLite 从会话开头逐行扫描、丢弃前 start 条
+        """
+
+        if end <= start:
+            return []
+
+        after = self._seek(session_type, session_id, start, day) if start > 0 else None
+        if start > 0 and after is None:
+            return []
+
+        messages, _ = self.load_page(session_type, session_id, end - start, after, day)
+        return messages
+
+    def load_page(
+            self,
+            session_type: str,
+            session_id: str | int,
+            limit: int,
+            after: Cursor | None = None,
+            day: date | None = None,
+    ) -> tuple[list[str], Cursor | None]:
+        """
+        从游标之后按时间顺序读取 limit 条（keyset 分页）
+
+        Parameters
+        ----------
+        after
+            上一页返回的游标，None 表示从头开始
+
+        Returns
+        -------
+        tuple
+            (llm_input 文本, 本页最后一条的游标)；没有更多数据时游标为传入的 after
+        """
+
+        sql = "SELECT llm_text, timestamp, id FROM messages WHERE session_type = ? AND session_id = ?"
+        params: list = [session_type, str(session_id)]
+        if day is not None:
+            sql += " AND timestamp >= ? AND timestamp < ?"
+            params.extend(self._day_bounds(day))
+        if after is not None:
+            sql += " AND (timestamp, id) > (?, ?)"
+            params.extend(after)
+        sql += " ORDER BY timestamp, id LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        if not rows:
+            return [], after
+        return [row[0] for row in rows], (rows[-1][1], rows[-1][2])
+
+    def _seek(
+            self,
+            session_type: str,
+            session_id: str | int,
+            position: int,
+            day: date | None,
+    ) -> Cursor | None:
+        """
+        第 position 条之前那条消息的游标（position 从 0 开始）；超出范围时返回 None
+        """
+
+        if day is None:
+            # 按天累计计数，找到 position 所在的日期，只在这一天内偏移
+            with self._lock:
+                counts = self.conn.execute(
+                    """
+                    SELECT day, count FROM message_counts
+                    WHERE session_type = ? AND session_id = ? AND count > 0
+                    ORDER BY day
+                    """,
+                    (session_type, str(session_id)),
+                ).fetchall()
+
+            for current, count in counts:
+                if position < count:
+                    day = date.fromisoformat(current)
+                    break
+                position -= count
+            else:
+                return None
+
+        start, end = self._day_bounds(day)
+        if position == 0:
+            # 当天第一条之前：当天开始之前的任意位置
+            return start - 1, 2 ** 63 - 1
+
+        with self._lock:
+            row = self.conn.execute(
+                """
+                SELECT timestamp, id FROM messages
+                WHERE session_type = ? AND session_id = ? AND timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp, id LIMIT 1 OFFSET ?
+                """,
+                (session_type, str(session_id), start, end, position - 1),
+            ).fetchone()
+
+        return (row[0], row[1]) if row is not None else None
+
+    def load_last(
+            self,
+            session_type: str,
+            session_id: str | int,
+            limit: int,
+            day: date | None = None,
+    ) -> list[str]:
+        """
+        最近 limit 条 llm_input 文本，按时间正序返回
+        """
+
+        return [row["llm_text"] for row in self._last_rows(session_type, session_id, limit, day)]
+
+    def load_recent_records(self, session_type: str, session_id: str | int, limit: int) -> list[dict]:
+        """
+        最近 limit 条 canonical 消息，按时间正序返回；跳过没有结构化数据的旧消息
+        """
+
+        with self._lock:
+            rows = self.conn.execute(
+                """
+                SELECT data FROM messages
+                WHERE session_type = ? AND session_id = ? AND data IS NOT NULL
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+                """,
+                (session_type, str(session_id), limit),
+            ).fetchall()
+
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def iter_days(
+            self,
+            session_type: str,
+            session_id: str | int,
+    ) -> Generator[tuple[date, list[str]], None, None]:
+        """
+        按日期遍历会话，每次只取一天的数据
+        """
+
+        for day in self.days(session_type, session_id):
+            messages = self.load_range(session_type, session_id, 0, self.count(session_type, session_id, day), day)
+            if messages:
+                yield day, messages
+
+    def days(self, session_type: str, session_id: str | int) -> list[date]:
+        """
+        有消息的日期，按时间顺序
+        """
+
+        with self._lock:
+            rows = self.conn.execute(
+                """
+                SELECT day FROM message_counts
+                WHERE session_type = ? AND session_id = ? AND count > 0
+                ORDER BY day
+                """,
+                (session_type, str(session_id)),
+            ).fetchall()
+
+        return [date.fromisoformat(row[0]) for row in rows]
+
+    def search(
+            self,
+            query: str,
+            session_type: str | None = None,
+            session_id: str | int | None = None,
+            limit: int = 20,
+    ) -> list[tuple[date, str]]:
+        """
+        全文搜索 llm_input 文本，按时间倒序返回 (日期, 文本)
+
+        trigram 分词要求关键词至少 3 个字符，更短时退化为 LIKE。
+        """
+
+        params: list = []
+        if self.fts and len(query) >= 3:
+            sql = (
+                "SELECT m.day, m.llm_text FROM messages_fts f JOIN messages m ON m.id = f.rowid "
+                "WHERE messages_fts MATCH ?"
+            )
+            # 整体作为短语匹配，避免用户输入被当作 FTS 语法
+            params.append('"' + query.replace('"', '""') + '"')
+        else:
+            sql = "SELECT m.day, m.llm_text FROM messages m WHERE m.llm_text LIKE ? ESCAPE '\\'"
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+
+        if session_type is not None:
+            sql += " AND m.session_type = ?"
+            params.append(session_type)
+        if session_id is not None:
+            sql += " AND m.session_id = ?"
+            params.append(str(session_id))
+
+        sql += " ORDER BY m.timestamp DESC, m.id DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            return [(date.fromisoformat(row[0]), row[1]) for row in self.conn.execute(sql, params)]
+
+    def _last_rows(self, session_type: str, session_id: str | int, limit: int, day: date | None):
+        sql = "SELECT llm_text FROM messages WHERE session_type = ? AND session_id = ?"
+        params: list = [session_type, str(session_id)]
+        if day is not None:
+            sql += " AND timestamp >= ? AND timestamp < ?"
+            params.extend(self._day_bounds(day))
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        rows.reverse()
+        return rows
+
+    @staticmethod
+    def _day_bounds(day: date) -> tuple[int, int]:
+        """
+        本地时区下一天的时间戳区间 [start, end)，让按天查询也能走 (会话, timestamp) 索引
+        """
+
+        start = datetime(day.year, day.month, day.day)
+        end = datetime.fromordinal(day.toordinal() + 1)
+        return int(start.timestamp()), int(end.timestamp())
+
+    # ==========================================================
+    # 迁移
+    # ==========================================================
+
+    def import_tree(self, root: str | Path | None = None) -> int:
+        """
+        从文件目录树导入历史
+
+        每天优先导入 canonical（保留结构化数据），只有 llm_input 的旧数据按文本导入。
+        库中已有数据的 (会话, 日期) 跳过，可以重复执行。
+
+        Returns
+        -------
+        int
+            导入的消息数
+        """
+
+        bot_root = Path(root) / self.bot_id if root is not None else self.bot_root
+        imported = 0
+
+        for session_type in ("private", "group"):
+            type_dir = bot_root / session_type
+            if not type_dir.exists():
+                continue
+
+            for session_dir in sorted(p for p in type_dir.iterdir() if p.is_dir()):
+                imported += self._import_session(session_type, session_dir)
+
+        return imported
+
+    def _import_session(self, session_type: str, session_dir: Path) -> int:
+        session_id = session_dir.name
+        imported = 0
+
+        files: dict[str, Path] = {
+            file.stem: file for file in (session_dir / "llm_input").glob("*/*.txt")
+        }
+        files.update({
+            file.stem: file for file in (session_dir / "canonical").glob("*/*.jsonl")
+        })
+
+        for day_str in sorted(files):
+            try:
+                day = date.fromisoformat(day_str)
+            except ValueError:
+                continue
+
+            if self.count(session_type, session_id, day):
+                continue
+
+            file = files[day_str]
+            if file.suffix == ".jsonl":
+                imported += self.insert_many(
+                    (data, HistoryRenderer.llm_text(data, self.bot_id))
+                    for data in self._read_canonical(file)
+                )
+            else:
+                imported += self.insert_legacy(session_type, session_id, self._read_llm_input(file))
+
+        return imported
+
+    @staticmethod
+    def _read_canonical(file: Path) -> list[dict]:
+        records = []
+        with file.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    @staticmethod
+    def _read_llm_input(file: Path) -> list[tuple[int, str]]:
+        """
+        拆分 llm_input 文本，时间戳取自消息头；没有消息头的开头部分归到当天 0 点
+        """
+
+        messages = []
+        fallback = int(datetime.strptime(file.stem, "%Y-%m-%d").timestamp())
+
+        for text in LLM_INPUT_INDEX.read(file, 0, LLM_INPUT_INDEX.count(file)):
+            try:
+                timestamp = int(datetime.strptime(text[1:20], "%Y-%m-%d %H:%M:%S").timestamp())
+            except ValueError:
+                timestamp = fallback
+            messages.append((timestamp, text))
+
+        return messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite 聊天记录库：导入文件历史 / 全文搜索")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="把 QQ_HISTORY_DIR 下的文件历史导入 history.db")
+    import_parser.add_argument("bot_id")
+
+    search_parser = subparsers.add_parser("search", help="全文搜索")
+    search_parser.add_argument("bot_id")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--session", help="限定会话，例如 group/1039857271")
+    search_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    database = HistoryDatabase(args.bot_id)
+
+    if args.command == "import":
+        print(f"已导入 {database.import_tree()} 条消息")
+    else:
+        session_type, session_id = args.session.split("/", 1) if args.session else (None, None)
+        for day, text in database.search(args.query, session_type, session_id, limit=args.limit):
+            print(day, text)
+
+    database.close()
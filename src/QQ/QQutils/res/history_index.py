@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import bisect
+import os
+import re
+import struct
+import threading
+from pathlib import Path
+
+
+class MessageOffsetIndex:
+    """
+    聊天记录日文件的消息偏移索引。
+
+    每个 YYYY-MM-DD.txt 旁边维护一个同名的 .idx 文件，按顺序记录每条消息头在
+    文本文件中的字节偏移，每条固定 8 字节（小端 uint64）：
+
+        llm_input/
+            2026-07/
+                2026-07-13.txt
+                2026-07-13.idx
+
+    HistoryLogger 追加消息后调用 refresh 补记新消息的偏移；HistoryLoader 读取最近 N 条、按区间读取、
+    计数时只需要读索引的几个条目，再 seek 到文本文件对应位置读取少量字节，
+    不必每次把一整天的文件重新读入并逐行拆分。
+
+    索引缺失、被截断或与文本文件对不上时自动全量重建；
+    文本文件尾部比索引多出消息（例如旧版本写入的数据）时只补齐尾部。
+    """
+
+    SUFFIX = ".idx"
+
+    _ENTRY = struct.Struct("<Q")
+
+    # 写入方（事件循环线程）与读取方（run_in_executor 线程）可能同时补齐同一个索引，
+    # 统一加锁，避免同一偏移被写入两次。
+    _lock = threading.RLock()
+
+    def __init__(self, header: re.Pattern) -> None:
+        """
+        Parameters
+        ----------
+        header
+            消息起始行的正则，与 HistoryLoader 拆分消息使用同一规则。
+        """
+
+        self.header = header
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def index_path(self, file: Path) -> Path:
+        """
+        获取文本文件对应的索引文件路径。
+        """
+
+        return file.with_suffix(self.SUFFIX)
+
+    def count(self, file: Path) -> int:
+        """
+        获取文件中的消息数量。
+        """
+
+        return self.refresh(file)
+
+    def count_before(self, file: Path, limit: int) -> int:
+        """
+        获取起始偏移小于 limit 的消息数量。
+        """
+
+        total = self.refresh(file)
+
+        if not total:
+            return 0
+
+        with self.index_path(file).open("rb") as f:
+            raw = f.read(total * self._ENTRY.size)
+
+        offsets = [value for (value,) in self._ENTRY.iter_unpack(raw)]
+
+        return bisect.bisect_left(offsets, limit)
+
+    def read(self, file: Path, start: int, end: int) -> list[str]:
+        """
+        读取第 start 条（包含）到第 end 条（不包含）消息。
+        """
+
+        total = self.refresh(file)
+
+        start = max(0, start)
+        end = min(end, total)
+
+        if start >= end:
+            return []
+
+        index_file = self.index_path(file)
+
+        # 多读一个偏移作为最后一条消息的结束位置；end 已到末尾时读到 EOF。
+        with index_file.open("rb") as f:
+            f.seek(start * self._ENTRY.size)
+            raw = f.read((end - start + 1) * self._ENTRY.size)
+
+        offsets = [value for (value,) in self._ENTRY.iter_unpack(raw)]
+
+        with file.open("rb") as f:
+            f.seek(offsets[0])
+            if len(offsets) > end - start:
+                data = f.read(offsets[-1] - offsets[0])
+            else:
+                data = f.read()
+
+        base = offsets[0]
+        bounds = [offset - base for offset in offsets[:end - start]] + [len(data)]
+
+        return [
+            self._decode(data[bounds[i]:bounds[i + 1]])
+            for i in range(end - start)
+        ]
+
+    def read_last(self, file: Path, max_messages: int) -> list[str]:
+        """
+        读取最后 max_messages 条消息。
+        """
+
+        total = self.refresh(file)
+
+        return self.read(file, max(0, total - max_messages), total)
+
+    def refresh(self, file: Path) -> int:
+        """
+        校验索引并补齐尾部，返回消息数量。
+
+        只读取索引最后一个条目和文本文件中从该偏移到末尾的内容，
+        索引与文本一致时开销与文件大小无关。
+
+        HistoryLogger 每追加一条消息调用一次，此时尾部只有上一条和新的一条消息。
+        索引缺失（例如当天文件由旧版本写入）时直接全量重建。
+        """
+
+        with self._lock:
+            index_file = self.index_path(file)
+
+            if not file.exists():
+                return 0
+
+            file_size = file.stat().st_size
+
+            if not index_file.exists() or index_file.stat().st_size % self._ENTRY.size:
+                return len(self.rebuild(file))
+
+            last = self._read_last_entry(index_file)
+
+            if last is None:
+                return len(self.rebuild(file)) if file_size else 0
+
+            # 文本文件被截断或替换
+            if last >= file_size:
+                return len(self.rebuild(file))
+
+            with file.open("rb") as f:
+                f.seek(last)
+                tail = f.read()
+
+            starts = self._scan(tail, base=last)
+
+            # 最后一个偏移不再指向消息头，说明文本文件被改写过
+            if not starts or starts[0] != last:
+                return len(self.rebuild(file))
+
+            if len(starts) > 1:
+                with index_file.open("ab") as f:
+                    f.write(b"".join(self._ENTRY.pack(offset) for offset in starts[1:]))
+
+            return index_file.stat().st_size // self._ENTRY.size
+
+    def rebuild(self, file: Path) -> list[int]:
+        """
+        扫描整个文本文件重建索引。
+        """
+
+        with self._lock:
+            index_file = self.index_path(file)
+
+            offsets = self._scan(file.read_bytes()) if file.exists() else []
+
+            # 先写临时文件再替换，读取方不会看到写了一半的索引
+            tmp_file = index_file.with_suffix(self.SUFFIX + ".tmp")
+            tmp_file.write_bytes(b"".join(self._ENTRY.pack(offset) for offset in offsets))
+            os.replace(tmp_file, index_file)
+
+            return offsets
+
+    # ------------------------------------------------------------------
+    # Private
+    # ------------------------------------------------------------------
+
+    def _scan(self, data: bytes, base: int = 0) -> list[int]:
+        """
+        找出 data 中每条消息的起始偏移（加上 base）。
+
+        与 HistoryLoader._split_messages 保持一致：
+        文件开头不是消息头时（兼容异常或旧格式数据），开头也算作一条消息。
+        """
+
+        offsets: list[int] = []
+        pos = 0
+
+        for line in data.splitlines(keepends=True):
+            text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+
+            if self.header.match(text) or (base == 0 and pos == 0):
+                offsets.append(base + pos)
+
+            pos += len(line)
+
+        return offsets
+
+    def _read_last_entry(self, index_file: Path) -> int | None:
+        if not index_file.exists():
+            return None
+
+        size = index_file.stat().st_size
+
+        if size < self._ENTRY.size:
+            return None
+
+        with index_file.open("rb") as f:
+            f.seek(size - size % self._ENTRY.size - self._ENTRY.size)
+            (value,) = self._ENTRY.unpack(f.read(self._ENTRY.size))
+
+        return value
+
+    @staticmethod
+    def _decode(chunk: bytes) -> str:
+        """
+        将一条消息的字节还原为文本，换行规则与 _scan 一致。
+
+        在字节上按行拆分：ensure_ascii=False 写入的 U+2028、U+0085 等字符不算换行。
+        """
+
+        return "\n".join(line.decode("utf-8") for line in chunk.splitlines())
+
+
+# llm_input 文本的消息头：[2026-07-13 09:59:32] 昵称：
+LLM_INPUT_INDEX = MessageOffsetIndex(re.compile(r"^\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] .+?："))
+
+# canonical JSONL：每行一条消息（layout=canonical 时 HistoryLoader 由它按需渲染 llm_input 视图）。
+# 要求以 } 结尾，写了一半的残缺行不计为消息。
+CANONICAL_INDEX = MessageOffsetIndex(re.compile(r"^\{.*\}$"))
@@ -1,10 +1,15 @@
 from __future__ import annotations
 import json
+import os
 import re
 from datetime import datetime, date
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Iterator
 
+from src.QQ.QQutils.res.history_counter import MessageCounter
+from src.QQ.QQutils.res.history_db import HistoryDatabase
+from src.QQ.QQutils.res.history_index import CANONICAL_INDEX, LLM_INPUT_INDEX
+from src.QQ.QQutils.res.history_render import HistoryRenderer
 from src.config.path import QQ_HISTORY_DIR
 
 
@@ -30,6 +35,15 @@ class HistoryLoader:
 
     下一条时间戳即表示上一条消息结束。
 
+    每个日文件旁边有 HistoryLogger 维护的 .idx 偏移索引（见 MessageOffsetIndex），
+    最近 N 条、区间读取和计数都走索引，不再整天重新拆分；索引缺失或过期时自动重建。
+
+    某天没有 llm_input 文件（HistoryLogger 使用 layout=canonical）时，
+    改为读取当天的 canonical JSONL 并用 HistoryRenderer 渲染成同样格式的文本，调用方无感知。
+
+    bot 使用 sqlite 后端时，HistoryLogger 会通过 register_database 注册 HistoryDatabase，
+    之后该 bot 的所有读取都走数据库（计数查计数表，区间读取走索引），接口不变。
+
     目录结构：
 
         QQ_HISTORY_DIR/
@@ -39,6 +53,7 @@ class HistoryLoader:
                         llm_input/
                             2026-07/
                                 2026-07-01.txt
+                                2026-07-01.idx
                                 ...
 
                 group/
@@ -50,8 +65,35 @@ class HistoryLoader:
 
     DEFAULT_MAX_LINES = 100
     DEFAULT_CHUNK_SIZE = 500
+    REVERSE_BLOCK_SIZE = 64 * 1024
 
-    _MESSAGE_HEADER = re.compile(r"^\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] .+?：")
+    _MESSAGE_HEADER = LLM_INPUT_INDEX.header
+
+    # bot_id → sqlite 后端
+    _databases: dict[str, HistoryDatabase] = {}
+
+    # ------------------------------------------------------------------
+    # Backend
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def register_database(cls, bot_id: str | int, database: HistoryDatabase | None) -> None:
+        """
+        指定 bot 改用 sqlite 后端读取；database 为 None 时恢复读文件。
+        """
+
+        if database is None:
+            cls._databases.pop(str(bot_id), None)
+        else:
+            cls._databases[str(bot_id)] = database
+
+    @classmethod
+    def _database(cls, bot_id: str | int) -> HistoryDatabase | None:
+        return cls._databases.get(str(bot_id))
+
+    @staticmethod
+    def _session_type(is_private: bool) -> str:
+        return "private" if is_private else "group"
 
     # ------------------------------------------------------------------
     # Public API
@@ -97,7 +139,11 @@ class HistoryLoader:
         if max_lines <= 0:
             raise ValueError("max_lines 必须大于0。")
 
-        file = cls._get_history_file(
+        database = cls._database(bot_id)
+        if database is not None:
+            return database.load_last(cls._session_type(is_private), session_id, max_lines, datetime.now().date())
+
+        file = cls._get_day_file(
             bot_id,
             is_private,
             session_id,
@@ -107,8 +153,9 @@ class HistoryLoader:
         if not file.exists():
             return []
 
-        messages = cls._split_messages(cls._read_all(file))
-        return messages[-max_lines:]
+        total = cls._count_file(bot_id, file)
+
+        return cls._read_file(bot_id, file, max(0, total - max_lines), total)
 
     @classmethod
     def load_recent_messages(
@@ -123,20 +170,31 @@ class HistoryLoader:
 
         canonical 是 ChatPipeline 构造上下文的可靠来源，包含 user_id、nickname、
         timestamp、segments 等字段，不再依赖 llm_input 的文本格式。
+
+        从最新的文件开始、每个文件从末尾按块倒着读，凑够 max_messages 条就停止，
+        耗时只与 max_messages 有关，与聊天历史的长度无关。
         """
         if max_messages <= 0:
             raise ValueError("max_messages 必须大于0。")
+        database = cls._database(bot_id)
+        if database is not None:
+            return database.load_recent_records(cls._session_type(is_private), session_id, max_messages)
         result: list[dict] = []
-        for _, file in cls.iter_canonical_files(bot_id, is_private, session_id):
-            for line in file.read_text(encoding="utf-8").splitlines():
+        for _, file in cls.iter_canonical_files(bot_id, is_private, session_id, reverse=True):
+            for line in cls._iter_lines_reversed(file):
                 if not line.strip():
                     continue
                 try:
-                    result.append(json.loads(line))
-                except json.JSONDecodeError:
+                    result.append(json.loads(line.decode("utf-8")))
+                except (UnicodeDecodeError, json.JSONDecodeError):
                     # 单条损坏不影响其他历史消息，跳过比整体失败更稳。
                     continue
-        return result[-max_messages:]
+                if len(result) >= max_messages:
+                    break
+            if len(result) >= max_messages:
+                break
+        result.reverse()
+        return result
 
     @classmethod
     def load_today(
@@ -216,7 +274,13 @@ class HistoryLoader:
         list[str]
         """
 
-        file = cls._get_history_file(
+        database = cls._database(bot_id)
+        if database is not None:
+            session_type = cls._session_type(is_private)
+            total = database.count(session_type, session_id, target_date)
+            return database.load_range(session_type, session_id, 0, total, target_date)
+
+        file = cls._get_day_file(
             bot_id,
             is_private,
             session_id,
@@ -226,7 +290,7 @@ class HistoryLoader:
         if not file.exists():
             return []
 
-        return cls._split_messages(cls._read_all(file))
+        return cls._read_day_messages(bot_id, file)
 
     @classmethod
     def iter_daily(
@@ -239,8 +303,17 @@ class HistoryLoader:
         按日期遍历聊天记录。
         """
 
+        database = cls._database(bot_id)
+        if database is not None:
+            for day, messages in database.iter_days(cls._session_type(is_private), session_id):
+                yield day, "\n".join(messages)
+            return
+
         for day, file in cls.iter_files(bot_id, is_private, session_id):
-            history = cls._read_all(file)
+            if cls._is_canonical(file):
+                history = "\n".join(cls._read_day_messages(bot_id, file))
+            else:
+                history = cls._read_all(file)
             if history.strip():
                 yield day, history
 
@@ -273,9 +346,7 @@ class HistoryLoader:
         start_date: date | None = None
         end_date: date | None = None
 
-        for day, history in cls.iter_daily(bot_id, is_private, session_id):
-            messages = cls._split_messages(history)
-
+        for day, messages in cls._iter_day_messages(bot_id, is_private, session_id):
             if not messages:
                 continue
 
@@ -305,8 +376,15 @@ class HistoryLoader:
             is_private: bool,
             session_id: str | int,
     ) -> Generator[tuple[date, Path], None, None]:
-        """按时间顺序遍历 llm_input 文本文件。"""
-        yield from cls._iter_category_files(bot_id, is_private, session_id, "llm_input", "*.txt")
+        """
+        按时间顺序遍历每天的历史文件。
+
+        有 llm_input 文本时返回 .txt，只有 canonical 时返回 .jsonl（读取时按需渲染）。
+        """
+        files = dict(cls._iter_category_files(bot_id, is_private, session_id, "canonical", "*.jsonl"))
+        files.update(cls._iter_category_files(bot_id, is_private, session_id, "llm_input", "*.txt"))
+        for day in sorted(files):
+            yield day, files[day]
 
     @classmethod
     def iter_canonical_files(
@@ -314,9 +392,10 @@ class HistoryLoader:
             bot_id: str | int,
             is_private: bool,
             session_id: str | int,
+            reverse: bool = False,
     ) -> Generator[tuple[date, Path], None, None]:
-        """按时间顺序遍历 canonical JSONL 文件，供结构化历史读取使用。"""
-        yield from cls._iter_category_files(bot_id, is_private, session_id, "canonical", "*.jsonl")
+        """按时间顺序遍历 canonical JSONL 文件，供结构化历史读取使用；reverse=True 时从最新开始。"""
+        yield from cls._iter_category_files(bot_id, is_private, session_id, "canonical", "*.jsonl", reverse)
 
     @classmethod
     def count(
@@ -329,14 +408,17 @@ class HistoryLoader:
         获取当前 Session 总消息数量。
         用于 SummaryManager 判断是否需要更新 short_term。
         """
+        database = cls._database(bot_id)
+        if database is not None:
+            return database.count(cls._session_type(is_private), session_id)
+
         total = 0
         for _, file in cls.iter_files(
                 bot_id,
                 is_private,
                 session_id,
         ):
-            history = cls._read_all(file)
-            total += len(cls._split_messages(history))
+            total += cls._count_file(bot_id, file)
         return total
 
     @classmethod
@@ -347,17 +429,36 @@ class HistoryLoader:
             session_id: str | int,
     ) -> int:
         """
-        获取当前 Session 总消息数量。
+        获取当前 Session 今天的消息数量。
         用于 SummaryManager 判断是否需要更新 short_term。
         """
-        return len(
-            cls.load_today_list(
-                bot_id,
-                is_private,
-                session_id,
-            )
+        return cls.count_date(bot_id, is_private, session_id, datetime.now().date())
+
+    @classmethod
+    def count_date(
+            cls,
+            bot_id: str | int,
+            is_private: bool,
+            session_id: str | int,
+            target_date: date,
+    ) -> int:
+        """
+        获取当前 Session 指定日期的消息数量。
+        SummaryManager 补 daily summary 时据此跳过没有聊天的日期。
+        """
+        database = cls._database(bot_id)
+        if database is not None:
+            return database.count(cls._session_type(is_private), session_id, target_date)
+
+        file = cls._get_day_file(
+            bot_id,
+            is_private,
+            session_id,
+            target_date,
         )
 
+        return cls._count_file(bot_id, file)
+
     @classmethod
     def load_range(
             cls,
@@ -391,6 +492,10 @@ class HistoryLoader:
         if end <= start:
             return ""
 
+        database = cls._database(bot_id)
+        if database is not None:
+            return "\n".join(database.load_range(cls._session_type(is_private), session_id, start, end))
+
         result = []
 
         index = 0
@@ -401,19 +506,20 @@ class HistoryLoader:
                 session_id,
         ):
 
-            history = cls._read_all(file)
-
-            messages = cls._split_messages(history)
-
-            for message in messages:
-
-                if index >= end:
-                    break
+            # 先用索引计数，整天都在区间之前的文件不必读取正文
+            count = cls._count_file(bot_id, file)
 
-                if index >= start:
-                    result.append(message)
+            if index + count > start:
+                result.extend(
+                    cls._read_file(
+                        bot_id,
+                        file,
+                        start - index,
+                        end - index,
+                    )
+                )
 
-                index += 1
+            index += count
 
             if index >= end:
                 break
@@ -429,17 +535,29 @@ class HistoryLoader:
             start: int,
             end: int,
     ) -> str:
+        """
+        按今天的消息索引读取历史，区间含义同 load_range。
+        """
+
+        if start >= end:
+            return ""
 
-        messages = cls.load_today_list(
+        database = cls._database(bot_id)
+        if database is not None:
+            return "\n".join(
+                database.load_range(cls._session_type(is_private), session_id, start, end, datetime.now().date())
+            )
+
+        file = cls._get_day_file(
             bot_id,
             is_private,
             session_id,
+            datetime.now().date(),
+        )
+
+        return "\n".join(
+            cls._read_file(bot_id, file, start, end)
         )
-        if start < end:
-            return "\n".join(
-                messages[start:end]
-            )
-        return ""
 
     @classmethod
     def get_first_date(
@@ -457,6 +575,11 @@ class HistoryLoader:
             如果不存在聊天记录，则返回 None。
         """
 
+        database = cls._database(bot_id)
+        if database is not None:
+            days = database.days(cls._session_type(is_private), session_id)
+            return days[0] if days else None
+
         for day, _ in cls.iter_files(bot_id, is_private, session_id):
             return day
 
@@ -478,6 +601,11 @@ class HistoryLoader:
             如果不存在聊天记录，则返回 None。
         """
 
+        database = cls._database(bot_id)
+        if database is not None:
+            days = database.days(cls._session_type(is_private), session_id)
+            return days[-1] if days else None
+
         last_day = None
 
         for day, _ in cls.iter_files(bot_id, is_private, session_id):
@@ -485,10 +613,50 @@ class HistoryLoader:
 
         return last_day
 
+    @classmethod
+    def search(
+            cls,
+            bot_id: str | int,
+            is_private: bool,
+            session_id: str | int,
+            query: str,
+            limit: int = 20,
+    ) -> list[tuple[date, str]]:
+        """
+        在当前 Session 中全文搜索，按时间倒序返回 (日期, 消息)。
+
+        仅 sqlite 后端支持；文件后端请先用 history_db 的 import 导入。
+        """
+
+        database = cls._database(bot_id)
+        if database is None:
+            raise RuntimeError("全文搜索需要 sqlite 后端（history.backend: sqlite）。")
+
+        return database.search(query, cls._session_type(is_private), session_id, limit)
+
     # ------------------------------------------------------------------
     # Private
     # ------------------------------------------------------------------
 
+    @classmethod
+    def _iter_day_messages(
+            cls,
+            bot_id: str | int,
+            is_private: bool,
+            session_id: str | int,
+    ) -> Generator[tuple[date, list[str]], None, None]:
+        """
+        按日期遍历，每天返回拆分好的消息列表。
+        """
+
+        database = cls._database(bot_id)
+        if database is not None:
+            yield from database.iter_days(cls._session_type(is_private), session_id)
+            return
+
+        for day, file in cls.iter_files(bot_id, is_private, session_id):
+            yield day, cls._read_day_messages(bot_id, file)
+
     @staticmethod
     def _get_session_dir(
             bot_id: str | int,
@@ -524,13 +692,14 @@ class HistoryLoader:
             session_id: str | int,
             category: str,
             pattern: str,
+            reverse: bool = False,
     ) -> Generator[tuple[date, Path], None, None]:
         """按 YYYY-MM/YYYY-MM-DD.后缀 的顺序遍历某个历史分类目录。"""
         history_dir = cls._get_session_dir(bot_id, is_private, session_id) / category
         if not history_dir.exists():
             return
-        for month_dir in sorted(p for p in history_dir.iterdir() if p.is_dir()):
-            for file in sorted(month_dir.glob(pattern)):
+        for month_dir in sorted((p for p in history_dir.iterdir() if p.is_dir()), reverse=reverse):
+            for file in sorted(month_dir.glob(pattern), reverse=reverse):
                 try:
                     yield datetime.strptime(file.stem, "%Y-%m-%d").date(), file
                 except ValueError:
@@ -566,6 +735,132 @@ class HistoryLoader:
 
         return cls._get_history_dir(bot_id, is_private, session_id) / month / filename
 
+    @classmethod
+    def _get_day_file(
+            cls,
+            bot_id: str | int,
+            is_private: bool,
+            session_id: str | int,
+            target_date: date,
+    ) -> Path:
+        """
+        获取指定日期的历史文件：优先 llm_input 文本，不存在时退回 canonical JSONL。
+        """
+
+        file = cls._get_history_file(bot_id, is_private, session_id, target_date)
+        if file.exists():
+            return file
+
+        return (
+                cls._get_session_dir(bot_id, is_private, session_id)
+                / "canonical"
+                / file.parent.name
+                / f"{file.stem}.jsonl"
+        )
+
+    @staticmethod
+    def _is_canonical(file: Path) -> bool:
+        return file.suffix == ".jsonl"
+
+    @classmethod
+    def _count_file(cls, bot_id: str | int, file: Path) -> int:
+        """
+        日文件中的消息数量。
+
+        读 HistoryLogger 写入时维护的计数表（MessageCounter），一次查询加一次 stat；
+        计数表落后或缺失时按文件自动补齐。
+        """
+
+        return MessageCounter.for_bot(bot_id).count(file)
+
+    @classmethod
+    def _read_file(
+            cls,
+            bot_id: str | int,
+            file: Path,
+            start: int,
+            end: int,
+    ) -> list[str]:
+        """
+        读取日文件中第 start 条（包含）到第 end 条（不包含）消息的 llm_input 文本。
+        """
+
+        if not cls._is_canonical(file):
+            return LLM_INPUT_INDEX.read(file, start, end)
+
+        return cls._render_lines(bot_id, CANONICAL_INDEX.read(file, start, end))
+
+    @classmethod
+    def _read_day_messages(cls, bot_id: str | int, file: Path) -> list[str]:
+        """
+        读取整个日文件并拆分为消息。
+        """
+
+        if not cls._is_canonical(file):
+            return cls._split_messages(cls._read_all(file))
+
+        return cls._render_lines(bot_id, cls._split_lines(cls._read_all(file)))
+
+    @staticmethod
+    def _split_lines(text: str) -> list[str]:
+        """
+        按 \\n、\\r\\n、\\r 拆分行，与 MessageOffsetIndex 在字节上的拆分一致。
+
+        str.splitlines 还会在 U+2028、U+0085 等字符处断开，而这些字符会被
+        ensure_ascii=False 原样写进消息正文，不能用它拆分日文件。
+        """
+
+        lines = re.split(r"\r\n|\r|\n", text)
+        if lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+    @staticmethod
+    def _render_lines(bot_id: str | int, lines: list[str]) -> list[str]:
+        """
+        将 canonical JSON 行渲染为 llm_input 文本，损坏的行跳过。
+        """
+
+        messages = []
+        for line in lines:
+            # 索引把紧跟其后的非 JSON 行（空行、残缺行）并入同一条，只取第一行
+            line = line.partition("\n")[0]
+            if not line.strip():
+                continue
+            try:
+                messages.append(HistoryRenderer.llm_text(json.loads(line), bot_id))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+        return messages
+
+    @classmethod
+    def _iter_lines_reversed(cls, file_path: Path) -> Iterator[bytes]:
+        """
+        从文件末尾按块倒序读取，逐行返回（不含换行符，未解码）。
+
+        只有真正用到的行才会被解码，调用方拿够数据后停止迭代即可不再读盘。
+        """
+
+        with file_path.open("rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            remainder = b""
+
+            while position > 0:
+                size = min(cls.REVERSE_BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+
+                lines = (f.read(size) + remainder).split(b"\n")
+
+                # 块的第一行可能只读到一半，留到下一块拼接
+                remainder = lines[0]
+
+                for line in reversed(lines[1:]):
+                    yield line.rstrip(b"\r")
+
+            if remainder:
+                yield remainder.rstrip(b"\r")
+
     @staticmethod
     def _read_all(file_path: Path) -> str:
         """
@@ -594,7 +889,7 @@ class HistoryLoader:
         messages: list[str] = []
         current: list[str] = []
 
-        for line in history.splitlines():
+        for line in cls._split_lines(history):
             if cls._MESSAGE_HEADER.match(line):
                 if current:
                     messages.append("\n".join(current))
@@ -620,12 +915,7 @@ class HistoryLoader:
         读取最后 max_messages 条消息。
         """
 
-        messages = cls._split_messages(file_path.read_text(encoding="utf-8"))
-
-        if len(messages) <= max_messages:
-            return "\n".join(messages)
-
-        return "\n".join(messages[-max_messages:])
+        return "\n".join(LLM_INPUT_INDEX.read_last(file_path, max_messages))
 
 if __name__ == "__main__":
 
@@ -0,0 +1,477 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from collections.abc import Callable
+from datetime import datetime
+from pathlib import Path
+
+from src.QQ.QQutils.res.history_index import LLM_INPUT_INDEX
+from src.config.path import QQ_HISTORY_DIR
+
+
+class HistoryRenderer:
+    """
+    由 canonical 消息（RecvMessageWrapper / SendMessageWrapper 的 json）生成派生视图。
+
+    - llm_input：给 LLM 阅读的单条文本，[时间] 昵称：内容
+    - human：人类阅读版 Markdown（HTML增强）
+
+    消息包装类和 HistoryLogger 都调用这里，HistoryLoader 在只有 canonical 的日期按需渲染，
+    保证同一条消息无论实时写入还是事后导出，得到的文本完全一致。
+    """
+
+    # ==========================================================
+    # llm_input
+    # ==========================================================
+
+    @classmethod
+    def llm_text(cls, data: dict, bot_id: str | int) -> str:
+        """
+        渲染 LLM 输入文本，发送者是 bot 自己时按发送消息的格式渲染
+        """
+
+        if str(data.get("user_id")) == str(bot_id):
+            return cls.send_llm_text(data)
+        return cls.recv_llm_text(data)
+
+    @classmethod
+    def recv_llm_text(cls, data: dict) -> str:
+        """
+        接收消息的 LLM 输入文本
+        """
+
+        result = []
+        for seg in data["segments"]:
+            seg_type = seg["type"]
+            if seg_type == "text":
+                result.append(seg.get("content") or "")
+            elif seg_type == "qq_face":
+                result.append(seg.get("content") or "")
+            elif seg_type == "qq_emoji":
+                summary = seg.get("summary") or ""
+                result.append(f'发送了一个名为"{summary}"的表情包，')
+                result.append(f'【表情包内容】：{seg.get("content") or ""}')
+            elif seg_type == "at":
+                result.append(f'@{seg.get("qq_id") or ""}')
+            elif seg_type == "image":
+                if seg["content"]:
+                    result.append(f'发送了一张图片，')
+                    result.append(f'【图片内容】：{seg.get("content") or ""}')
+                else:
+                    result.append(f'发送了一个图片，但是内容没有被上层正确识别，所以当做本图片不存在')
+
+        content = " ".join(
+            str(x) for x in result
+            if x is not None
+        )
+        return cls._with_header(data, content)
+
+    @classmethod
+    def send_llm_text(cls, data: dict) -> str:
+        """
+        发送消息的 LLM 输入文本
+        """
+
+        result = []
+
+        for seg in data["segments"]:
+            seg_type = seg["type"]
+
+            if seg_type == "text":
+                result.append(seg["content"])
+
+            elif seg_type == "qq_face":
+                result.append(seg["content"])
+
+            elif seg_type == "qq_emoji":
+                result.append(seg["content"])
+
+            elif seg_type == "at":
+                result.append(f'@{seg["qq_id"]}')
+
+            elif seg_type == "image":
+                if seg["content"]:
+                    result.append(f'【图片内容】：{seg["content"]}')
+                else:
+                    result.append("[图片]")
+
+            elif seg_type == "record":
+                content = seg.get("content")
+                if content:
+                    result.append(f'【语音内容】：{content}')
+                else:
+                    result.append("[语音]")
+
+        content = " ".join(result)
+        return cls._with_header(data, content)
+
+    @staticmethod
+    def _with_header(data: dict, content: str) -> str:
+        time_str = time.strftime(
+            "%Y-%m-%d %H:%M:%S",
+            time.localtime(data["timestamp"])
+        )
+
+        return (
+            f"[{time_str}] "
+            f"{data['user_nickname']}："
+            f"{content}"
+        )
+
+    # ==========================================================
+    # Human Markdown
+    # ==========================================================
+
+    @classmethod
+    def human_markdown(
+            cls,
+            data: dict,
+            relative_file: Callable[[str], str],
+    ) -> str:
+        """
+        构造人类阅读版 Markdown（HTML增强）
+
+        Parameters
+        ----------
+        data
+            canonical 消息
+        relative_file
+            把 segment 中的 file（相对 bot 历史根目录）转换为 Markdown 可用的路径
+        """
+
+        time_str = datetime.fromtimestamp(
+            data["timestamp"]
+        ).strftime("%Y-%m-%d %H:%M:%S")
+
+        lines = [
+            f"### {time_str}　**{data['user_nickname']}**",
+            ""
+        ]
+
+        for seg in data["segments"]:
+
+            seg_type = seg["type"]
+
+            # --------------------------------------------------
+            # 文本
+            # --------------------------------------------------
+            if seg_type == "text":
+
+                text = (
+                    seg["content"].strip()
+                    .replace("&", "&amp;")
+                    .replace("<", "&lt;")
+                    .replace(">", "&gt;")
+                    .replace("\n", "<br>")
+                )
+
+                lines.append(
+                    f"""
+    <div style="
+    display:inline-block;
+    background-color: rgba(102, 204, 255, 0.2);
+    color:#1F2937;
+    padding:8px 12px;
+    border-radius:12px;
+    max-width:75%;
+    line-height:1.6;
+    margin:6px 0;
+    word-break:break-word;
+    ">
+    {text}
+    </div>
+    """.strip()
+                )
+
+            # --------------------------------------------------
+            # @
+            # --------------------------------------------------
+            elif seg_type == "at":
+
+                lines.append(
+                    f"""
+    <div style="
+    display:inline-block;
+    background-color: rgbA(255, 248, 220, 0.8);
+    color:#1F2937;
+    padding:8px 12px;
+    border-radius:12px;
+    margin:6px 0;
+    ">
+    @{seg["qq_id"]}
+    </div>
+    """.strip()
+                )
+
+            # --------------------------------------------------
+            # QQ系统表情
+            # --------------------------------------------------
+            elif seg_type == "qq_face":
+
+                content = seg.get("content") or "[QQ表情]"
+
+                lines.append(
+                    f"""
+    <div style="
+    display:inline-block;
+    background-color: rgba(102, 204, 255, 0.2);
+    color:#1F2937;
+    padding:8px 12px;
+    border-radius:12px;
+    max-width:75%;
+    line-height:1.6;
+    margin:6px 0;
+    ">
+    {content}
+    </div>
+                """.strip()
+                )
+
+            # --------------------------------------------------
+            # 语音
+            # --------------------------------------------------
+            elif seg_type == "record":
+
+                lines.append(
+                    """
+    <div style="
+    display:inline-block;
+    background-color: rgba(102, 204, 255, 0.2);
+    color:#1F2937;
+    padding:8px 12px;
+    border-radius:12px;
+    max-width:75%;
+    line-height:1.6;
+    margin:6px 0;
+    ">
+    [语音]
+    </div>
+    """.strip()
+                )
+
+            # --------------------------------------------------
+            # 图片
+            # --------------------------------------------------
+            elif seg_type in ("image", "qq_emoji"):
+
+                file = seg.get("file")
+
+                if file:
+
+                    file = relative_file(file)
+
+                    if seg_type == "image":
+                        lines.append(
+                            f"""
+<img src="{file}"
+style="
+max-width:250px;
+width:auto;
+height:auto;
+margin:8px 0;
+display:block;
+">
+""".strip()
+                        )
+                    elif seg_type == "qq_emoji":
+                        lines.append(
+                            f"""
+<img src="{file}"
+style="
+max-width:150px;
+width:auto;
+height:auto;
+margin:8px 0;
+display:block;
+">
+""".strip()
+                        )
+
+                else:
+
+                    lines.append(
+                        """
+    <div style="
+    display:inline-block;
+    background:#66CCFF;
+    color:#1F2937;
+    padding:12px 16px;
+    border-radius:16px;
+    margin:6px 0;
+    ">
+    [图片]
+    </div>
+    """.strip()
+                    )
+
+            # --------------------------------------------------
+            # 未知类型
+            # --------------------------------------------------
+            else:
+
+                lines.append(
+                    f"""
+    <div style="
+    display:inline-block;
+    background:#EEEEEE;
+    color:#666666;
+    padding:10px 14px;
+    border-radius:12px;
+    margin:6px 0;
+    ">
+    未知消息类型：{seg_type}
+    </div>
+    """.strip()
+                )
+
+        lines.append("")
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def relative_to(bot_root: Path, md_dir: Path, file: str) -> str:
+        """
+        返回 markdown 到图片的相对路径
+        """
+
+        image_path = bot_root / file
+
+        try:
+            return os.path.relpath(
+                image_path,
+                md_dir
+            ).replace("\\", "/")
+        except ValueError:
+            # 跨盘符（如 D: 资源写到 G: 历史）时 relpath 无意义，直接返回绝对路径。
+            return str(image_path).replace("\\", "/")
+
+
+class HistoryExporter:
+    """
+    离线导出：由 canonical JSONL 生成 llm_input 文本（含 .idx）与 human Markdown。
+
+    用于 layout=canonical 时按需查看，或补齐旧数据缺失的派生视图。
+    默认跳过已存在的日文件，force=True 时覆盖。
+    """
+
+    VIEWS = ("llm_input", "human")
+
+    def __init__(self, bot_id: str | int, root: str | Path = QQ_HISTORY_DIR):
+        self.bot_id = str(bot_id)
+        self.bot_root = Path(root) / self.bot_id
+
+    def export(
+            self,
+            views: tuple[str, ...] = VIEWS,
+            session: str | None = None,
+            force: bool = False,
+    ) -> int:
+        """
+        导出派生视图
+
+        Parameters
+        ----------
+        views
+            要生成的视图
+        session
+            只导出某个会话，格式 private/123 或 group/456；None 表示全部
+        force
+            覆盖已存在的文件
+
+        Returns
+        -------
+        int
+            写入的文件数
+        """
+
+        written = 0
+
+        for canonical_file in self._iter_canonical_files(session):
+            session_dir = canonical_file.parent.parent.parent
+            month = canonical_file.parent.name
+            day = canonical_file.stem
+
+            records = self._load_records(canonical_file)
+            if not records:
+                continue
+
+            if "llm_input" in views:
+                target = session_dir / "llm_input" / month / f"{day}.txt"
+                if force or not target.exists():
+                    text = "".join(
+                        HistoryRenderer.llm_text(record, self.bot_id) + "\n"
+                        for record in records
+                    )
+                    self._write_text(target, text)
+                    LLM_INPUT_INDEX.rebuild(target)
+                    written += 1
+
+            if "human" in views:
+                target = session_dir / "human" / month / f"{day}.md"
+                if force or not target.exists():
+                    md_dir = target.parent
+                    text = "".join(
+                        HistoryRenderer.human_markdown(
+                            record,
+                            lambda file: HistoryRenderer.relative_to(self.bot_root, md_dir, file),
+                        ) + "\n\n"
+                        for record in records
+                    )
+                    self._write_text(target, text)
+                    written += 1
+
+        return written
+
+    def _iter_canonical_files(self, session: str | None):
+        if session:
+            session_dirs = [self.bot_root / session]
+        else:
+            session_dirs = [
+                session_dir
+                for session_type in ("private", "group")
+                if (self.bot_root / session_type).exists()
+                for session_dir in sorted((self.bot_root / session_type).iterdir())
+                if session_dir.is_dir()
+            ]
+
+        for session_dir in session_dirs:
+            yield from sorted((session_dir / "canonical").glob("*/*.jsonl"))
+
+    @staticmethod
+    def _load_records(file: Path) -> list[dict]:
+        records = []
+        with file.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    @staticmethod
+    def _write_text(target: Path, text: str) -> None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # 与 HistoryLogger 一样按文本模式写（换行转换为系统换行符）
+        with target.open("w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由 canonical 聊天记录导出 llm_input / human 视图")
+    parser.add_argument("bot_id")
+    parser.add_argument("--session", help="只导出一个会话，例如 group/1039857271")
+    parser.add_argument("--views", nargs="+", choices=HistoryExporter.VIEWS, default=list(HistoryExporter.VIEWS))
+    parser.add_argument("--force", action="store_true", help="覆盖已存在的文件")
+    args = parser.parse_args()
+
+    count = HistoryExporter(args.bot_id).export(
+        views=tuple(args.views),
+        session=args.session,
+        force=args.force,
+    )
+    print(f"已写入 {count} 个文件")
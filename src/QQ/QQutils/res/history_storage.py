@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import copy
 import json
 import os
 import pickle
@@ -8,6 +9,12 @@ from datetime import datetime
 from pathlib import Path
 
 from src.QQ.QQutils.msg.msg_wrapper import RecvMessageWrapper, SendMessageWrapper
+from src.QQ.QQutils.res.history_counter import MessageCounter
+from src.QQ.QQutils.res.history_db import HistoryDatabase
+from src.QQ.QQutils.res.history_index import CANONICAL_INDEX, LLM_INPUT_INDEX
+from src.QQ.QQutils.res.history_loader import HistoryLoader
+from src.QQ.QQutils.res.history_render import HistoryRenderer
+from src.QQ.QQutils.res.history_writer import HistoryWriter
 from src.config.path import HISTORY_DIR, QQ_HISTORY_DIR
 
 
@@ -31,6 +38,7 @@ class HistoryLogger:
                         llm_input/
                             2026-06/
                                 2026-06-27.txt
+                                2026-06-27.idx
                         human/
                             2026-06/
                                 2026-06-27.md
@@ -38,11 +46,33 @@ class HistoryLogger:
                 group/
                     group_id/
                         ...
+
+    layout 为 canonical（bot YAML 的 history.layout）时只写 canonical，
+    llm_input / human 视图由 HistoryLoader 按需渲染，或用 HistoryExporter 离线导出；
+    默认 full 四种格式都写。
+
+    backend 为 sqlite（history.backend）时 canonical 与 llm_input 改存到每个 bot 一个的 history.db
+    （见 HistoryDatabase），并注册给 HistoryLoader；layout=full 时 raw / human 仍写文件。
+
+    传入 writer 时所有文件写入交给 HistoryWriter 后台攒批完成，append_* 不再阻塞在磁盘 I/O 上；
+    读取前需要看到最新记录时调用 flush。不传时保持逐条同步写入。
     """
 
-    def __init__(self, config):
+    def __init__(self, config, writer: HistoryWriter | None = None):
         self.bot_id = str(config.bot_id)
         self.root = Path(QQ_HISTORY_DIR) / self.bot_id
+        self.writer = writer
+        self.layout = config.history.layout
+
+        # 按 (会话, 日期) 的消息计数，HistoryLoader.count* / SummaryManager 直接读取
+        self.counter = MessageCounter.for_bot(self.bot_id)
+
+        self.database: HistoryDatabase | None = None
+        if config.history.backend == "sqlite":
+            self.database = HistoryDatabase.for_bot(self.bot_id)
+            HistoryLoader.register_database(self.bot_id, self.database)
+        # 已创建过的目录，避免每条消息都 mkdir
+        self._dirs: set[Path] = set()
 
     # ==========================================================
     # 对外接口
@@ -60,10 +90,13 @@ class HistoryLogger:
             标准化消息
         """
 
-        self._append_raw(msg, message_wrapper)
-        self._append_canonical(message_wrapper)
-        self._append_llm_input(message_wrapper)
-        self._append_human(message_wrapper)
+        if self.layout == "full":
+            self._append_raw(msg, message_wrapper)
+
+        self._append_structured(message_wrapper)
+
+        if self.layout == "full":
+            self._append_human(message_wrapper)
 
     def append_send(self, message_wrapper: SendMessageWrapper):
         """
@@ -80,9 +113,10 @@ class HistoryLogger:
 
         # 发送消息也写 canonical，让 ChatPipeline 可以从结构化历史读取机器人回复，
         # 而不是只能从 llm_input 文本里猜角色。
-        self._append_canonical(message_wrapper)
-        self._append_llm_input(message_wrapper)
-        self._append_human(message_wrapper)
+        self._append_structured(message_wrapper)
+
+        if self.layout == "full":
+            self._append_human(message_wrapper)
 
     def append_sends(self, message_wrappers: Iterable[SendMessageWrapper]) -> int:
         """
@@ -96,6 +130,55 @@ class HistoryLogger:
             self.append_send(wrapper)
         return len(wrappers)
 
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        等待缓冲中的记录写盘，同步模式下直接返回 True
+        """
+
+        if self.writer is None:
+            return True
+        return self.writer.flush(timeout)
+
+    def close(self) -> None:
+        """
+        写完缓冲中的记录并关闭文件
+        """
+
+        if self.writer is not None:
+            self.writer.close()
+
+        if self.database is not None:
+            self.database.close()
+
+    # ==========================================================
+    # 写入
+    # ==========================================================
+
+    def _write(self, path: Path, data: bytes, on_flush=None) -> None:
+        """
+        追加字节到文件
+
+        有 writer 时入队由后台线程写，否则立即写入；写入后对文件调用 on_flush。
+        """
+
+        if self.writer is not None:
+            self.writer.write(path, data, on_flush=on_flush)
+            return
+
+        with path.open("ab") as f:
+            f.write(data)
+
+        if on_flush is not None:
+            on_flush(path)
+
+    @staticmethod
+    def _encode_text(text: str) -> bytes:
+        """
+        按文本模式的规则编码（换行转换为系统换行符），与原先 open("a") 写出的文件保持一致
+        """
+
+        return text.replace("\n", os.linesep).encode("utf-8")
+
     # ==========================================================
     # 路径
     # ==========================================================
@@ -145,13 +228,56 @@ class HistoryLogger:
                 / self._month_str(wrapper)
         )
 
-        folder.mkdir(
-            parents=True,
-            exist_ok=True
-        )
+        # 缓冲模式下由 HistoryWriter 在写盘时创建目录
+        if self.writer is None and folder not in self._dirs:
+            folder.mkdir(
+                parents=True,
+                exist_ok=True
+            )
+            self._dirs.add(folder)
 
         return folder / f"{self._day_str(wrapper)}.{suffix}"
 
+    # ==========================================================
+    # canonical + llm_input
+    # ==========================================================
+
+    def _append_structured(
+            self,
+            wrapper: RecvMessageWrapper | SendMessageWrapper
+    ):
+        """
+        写结构化记录：sqlite 后端写库，文件后端写 canonical（layout=full 时再写 llm_input）
+        """
+
+        if self.database is not None:
+            self._append_database(wrapper)
+            return
+
+        self._append_canonical(wrapper)
+
+        if self.layout == "full":
+            self._append_llm_input(wrapper)
+
+    def _append_database(
+            self,
+            wrapper: RecvMessageWrapper | SendMessageWrapper
+    ):
+        """
+        sqlite 后端
+
+        入队前复制数据并渲染文本，后续对 wrapper 的修改不会影响落库内容；
+        缓冲模式下同一批的行由 insert_many 在一个事务中写入
+        """
+
+        data = copy.deepcopy(wrapper.json)
+        llm_text = wrapper.llm_msg
+
+        if self.writer is not None:
+            self.writer.insert(self.database.insert_many, (data, llm_text))
+        else:
+            self.database.insert(data, llm_text)
+
     # ==========================================================
     # raw
     # ==========================================================
@@ -173,12 +299,14 @@ class HistoryLogger:
             "pkl"
         )
 
-        with path.open("ab") as f:
-            pickle.dump(
+        # 入队前就序列化，后续对 msg 的修改不会影响落盘内容
+        self._write(
+            path,
+            pickle.dumps(
                 msg,
-                f,
                 protocol=pickle.HIGHEST_PROTOCOL
             )
+        )
 
     # ==========================================================
     # canonical
@@ -200,17 +328,17 @@ class HistoryLogger:
             "jsonl"
         )
 
-        with path.open(
-                "a",
-                encoding="utf-8"
-        ) as f:
-            json.dump(
-                wrapper.json,
-                f,
-                ensure_ascii=False
-            )
+        line = json.dumps(
+            wrapper.json,
+            ensure_ascii=False
+        )
 
-            f.write("\n")
+        # canonical 布局下 HistoryLoader 直接按 canonical 的偏移索引读取、按它计数，写盘后顺手补齐
+        self._write(
+            path,
+            self._encode_text(line + "\n"),
+            on_flush=self._after_canonical if self.layout == "canonical" else None
+        )
 
     # ==========================================================
     # llm_input
@@ -222,6 +350,8 @@ class HistoryLogger:
     ):
         """
         LLM输入文本
+
+        写盘后在 .idx 中记录这条消息的起始偏移，供 HistoryLoader 直接 seek 读取，并更新计数表
         """
 
         path = self._build_file(
@@ -230,12 +360,19 @@ class HistoryLogger:
             "txt"
         )
 
-        with path.open(
-                "a",
-                encoding="utf-8"
-        ) as f:
-            f.write(wrapper.llm_msg)
-            f.write("\n")
+        self._write(
+            path,
+            self._encode_text(wrapper.llm_msg + "\n"),
+            on_flush=self._after_llm_input
+        )
+
+    def _after_llm_input(self, path: Path) -> None:
+        LLM_INPUT_INDEX.refresh(path)
+        self.counter.sync(path)
+
+    def _after_canonical(self, path: Path) -> None:
+        CANONICAL_INDEX.refresh(path)
+        self.counter.sync(path)
 
     # ==========================================================
     # human
@@ -260,12 +397,7 @@ class HistoryLogger:
             wrapper
         )
 
-        with path.open(
-                "a",
-                encoding="utf-8"
-        ) as f:
-            f.write(markdown)
-            f.write("\n\n")
+        self._write(path, self._encode_text(markdown + "\n\n"))
 
     # ==========================================================
     # Human Markdown
@@ -276,200 +408,13 @@ class HistoryLogger:
             wrapper: RecvMessageWrapper | SendMessageWrapper
     ) -> str:
         """
-        构造人类阅读版 Markdown（HTML增强）
+        构造人类阅读版 Markdown（HTML增强），渲染规则见 HistoryRenderer
         """
 
-        time_str = datetime.fromtimestamp(
-            wrapper.timestamp
-        ).strftime("%Y-%m-%d %H:%M:%S")
-
-        lines = [
-            f"### {time_str}　**{wrapper.user_nickname}**",
-            ""
-        ]
-
-        for seg in wrapper.segments:
-
-            seg_type = seg["type"]
-
-            # --------------------------------------------------
-            # 文本
-            # --------------------------------------------------
-            if seg_type == "text":
-
-                text = (
-                    seg["content"].strip()
-                    .replace("&", "&amp;")
-                    .replace("<", "&lt;")
-                    .replace(">", "&gt;")
-                    .replace("\n", "<br>")
-                )
-
-                lines.append(
-                    f"""
-    <div style="
-    display:inline-block;
-    background-color: rgba(102, 204, 255, 0.2);
-    color:#1F2937;
-    padding:8px 12px;
-    border-radius:12px;
-    max-width:75%;
-    line-height:1.6;
-    margin:6px 0;
-    word-break:break-word;
-    ">
-    {text}
-    </div>
-    """.strip()
-                )
-
-            # --------------------------------------------------
-            # @
-            # --------------------------------------------------
-            elif seg_type == "at":
-
-                lines.append(
-                    f"""
-    <div style="
-    display:inline-block;
-    background-color: rgbA(255, 248, 220, 0.8);
-    color:#1F2937;
-    padding:8px 12px;
-    border-radius:12px;
-    margin:6px 0;
-    ">
-    @{seg["qq_id"]}
-    </div>
-    """.strip()
-                )
-
-            # --------------------------------------------------
-            # QQ系统表情
-            # --------------------------------------------------
-            elif seg_type == "qq_face":
-
-                content = seg.get("content") or "[QQ表情]"
-
-                lines.append(
-                    f"""
-    <div style="
-    display:inline-block;
-    background-color: rgba(102, 204, 255, 0.2);
-    color:#1F2937;
-    padding:8px 12px;
-    border-radius:12px;
-    max-width:75%;
-    line-height:1.6;
-    margin:6px 0;
-    ">
-    {content}
-    </div>
-                """.strip()
-                )
-
-            # --------------------------------------------------
-            # 语音
-            # --------------------------------------------------
-            elif seg_type == "record":
-
-                lines.append(
-                    """
-    <div style="
-    display:inline-block;
-    background-color: rgba(102, 204, 255, 0.2);
-    color:#1F2937;
-    padding:8px 12px;
-    border-radius:12px;
-    max-width:75%;
-    line-height:1.6;
-    margin:6px 0;
-    ">
-    [语音]
-    </div>
-    """.strip()
-                )
-
-            # --------------------------------------------------
-            # 图片
-            # --------------------------------------------------
-            elif seg_type in ("image", "qq_emoji"):
-
-                file = seg.get("file")
-
-                if file:
-
-                    file = self._human_relative_file(
-                        wrapper,
-                        file
-                    )
-
-                    if seg_type == "image":
-                        lines.append(
-                            f"""
-<img src="{file}"
-style="
-max-width:250px;
-width:auto;
-height:auto;
-margin:8px 0;
-display:block;
-">
-""".strip()
-                        )
-                    elif seg_type == "qq_emoji":
-                        lines.append(
-                            f"""
-<img src="{file}"
-style="
-max-width:150px;
-width:auto;
-height:auto;
-margin:8px 0;
-display:block;
-">
-""".strip()
-                        )
-
-                else:
-
-                    lines.append(
-                        """
-    <div style="
-    display:inline-block;
-    background:#66CCFF;
-    color:#1F2937;
-    padding:12px 16px;
-    border-radius:16px;
-    margin:6px 0;
-    ">
-    [图片]
-    </div>
-    """.strip()
-                    )
-
-            # --------------------------------------------------
-            # 未知类型
-            # --------------------------------------------------
-            else:
-
-                lines.append(
-                    f"""
-    <div style="
-    display:inline-block;
-    background:#EEEEEE;
-    color:#666666;
-    padding:10px 14px;
-    border-radius:12px;
-    margin:6px 0;
-    ">
-    未知消息类型：{seg_type}
-    </div>
-    """.strip()
-                )
-
-        lines.append("")
-
-        return "\n".join(lines)
+        return HistoryRenderer.human_markdown(
+            wrapper.json,
+            lambda file: self._human_relative_file(wrapper, file)
+        )
 
     def _human_relative_file(
             self,
@@ -486,13 +431,8 @@ display:block;
             "md"
         ).parent
 
-        image_path = self.root / file
-
-        try:
-            return os.path.relpath(
-                image_path,
-                md_dir
-            ).replace("\\", "/")
-        except ValueError:
-            # 跨盘符（如 D: 资源写到 G: 历史）时 relpath 无意义，直接返回绝对路径。
-            return str(image_path).replace("\\", "/")
+        return HistoryRenderer.relative_to(
+            self.root,
+            md_dir,
+            file
+        )
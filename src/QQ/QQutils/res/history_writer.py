@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _Record:
+    path: Path
+    data: bytes
+    on_flush: Callable[[Path], object] | None = None
+
+
+@dataclass(slots=True)
+class _Row:
+    sink: Callable[[list], object]
+    row: object
+
+
+@dataclass(slots=True)
+class _Task:
+    func: Callable[[], object]
+
+
+@dataclass(slots=True)
+class _FlushRequest:
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """
+    聊天记录的缓冲写入器。
+
+    HistoryLogger 把已经序列化好的字节交给 write 后立即返回，
+    由后台线程攒批写盘，事件循环不再为每条消息打开/关闭文件：
+
+    - 每个 (会话, 类别, 日期) 文件的句柄保存在 LRU 中复用，超过 max_open_files 时关闭最久未用的；
+    - 已创建过的目录记在集合里，不再每条消息 mkdir；
+    - 攒够 flush_records 条或距第一条未写记录超过 flush_interval 秒时写盘；
+    - 同一类别目录换到新的一天时，关闭前一天的句柄；
+    - close 时写完队列中剩余的记录并关闭所有句柄。
+
+    写盘后按文件调用一次记录附带的 on_flush（例如刷新 llm_input 的 .idx 索引）。
+    SQLite 后端的插入用 insert 逐行提交，同一批中交给同一个 sink 的行合并为一次调用（一个事务）；
+    其他非文件的写入用 submit 交给同一个线程，按提交顺序执行。
+    需要立即读到刚写的记录时（例如回复前读取历史）调用 flush，等待队列写完。
+    """
+
+    def __init__(
+            self,
+            flush_interval: float = 1.0,
+            flush_records: int = 64,
+            max_open_files: int = 64,
+    ):
+        """
+        Parameters
+        ----------
+        flush_interval
+            第一条未写记录最多等待的秒数
+        flush_records
+            累计多少条记录立即写盘
+        max_open_files
+            同时保持打开的文件句柄上限
+        """
+
+        self.flush_interval = flush_interval
+        self.flush_records = max(1, flush_records)
+        self.max_open_files = max(1, max_open_files)
+
+        self._queue: queue.Queue = queue.Queue()
+        self._handles: OrderedDict[Path, object] = OrderedDict()
+        # 类别目录（.../llm_input）→ 当前正在写的日文件，用于检测跨天
+        self._current_day: dict[Path, Path] = {}
+        self._dirs: set[Path] = set()
+
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name="HistoryWriter",
+            daemon=True,
+        )
+        self._thread.start()
+
+    # ==========================================================
+    # 对外接口
+    # ==========================================================
+
+    def write(
+            self,
+            path: Path,
+            data: bytes,
+            on_flush: Callable[[Path], object] | None = None,
+    ) -> None:
+        """
+        追加一段字节到文件末尾（异步）
+
+        Parameters
+        ----------
+        path
+            目标文件
+        data
+            已编码好的内容
+        on_flush
+            这批记录写盘后，对该文件调用一次
+        """
+
+        self._put(_Record(path, data, on_flush))
+
+    def insert(self, sink: Callable[[list], object], row: object) -> None:
+        """
+        提交一行给 sink（异步），同一批中同一 sink 的行按顺序合并为一次 sink(rows) 调用
+
+        Parameters
+        ----------
+        sink
+            批量写入函数，例如 HistoryDatabase.insert_many
+        row
+            一行数据
+        """
+
+        self._put(_Row(sink, row))
+
+    def submit(self, func: Callable[[], object]) -> None:
+        """
+        在写盘线程中执行 func（异步），与文件记录一起攒批
+        """
+
+        self._put(_Task(func))
+
+    def _put(self, item: _Record | _Row | _Task) -> None:
+        with self._close_lock:
+            if not self._closed:
+                self._queue.put(item)
+                return
+
+        # 关闭后仍有写入（例如退出过程中收到的消息），等后台线程写完后直接同步写，避免丢记录
+        self._thread.join()
+        self._write_batch([item])
+        self._close_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        等待此前提交的记录全部写盘
+
+        Returns
+        -------
+        bool
+            超时返回 False
+        """
+
+        if threading.current_thread() is self._thread:
+            return True
+
+        if self._closed:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+
+        request = _FlushRequest()
+        self._queue.put(request)
+
+        return request.done.wait(timeout)
+
+    def close(self) -> None:
+        """
+        写完剩余记录，关闭所有文件句柄
+        """
+
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+
+        self._thread.join()
+
+    # ==========================================================
+    # 后台线程
+    # ==========================================================
+
+    def _run(self) -> None:
+        pending: list[_Record | _Row | _Task] = []
+        deadline: float | None = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, (_Record, _Row, _Task)):
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) < self.flush_records:
+                    continue
+
+            # 达到条数上限、超时、收到 flush 请求或停止信号时写盘
+            if pending:
+                self._write_batch(pending)
+                pending = []
+            deadline = None
+
+            if isinstance(item, _FlushRequest):
+                item.done.set()
+            elif item is _STOP:
+                break
+
+        self._close_all()
+
+        # close 与 flush 并发时，唤醒停止信号之后才排进队列的 flush 请求
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if isinstance(item, _FlushRequest):
+                item.done.set()
+
+    def _write_batch(self, records: list[_Record | _Row | _Task]) -> None:
+        """
+        按文件合并后写入，保持同一文件内的记录顺序；再按 sink 批量写入行；之后按顺序执行任务
+        """
+
+        grouped: dict[Path, list[_Record]] = {}
+        rows: dict[Callable[[list], object], list[object]] = {}
+        tasks: list[_Task] = []
+        for record in records:
+            if isinstance(record, _Task):
+                tasks.append(record)
+            elif isinstance(record, _Row):
+                rows.setdefault(record.sink, []).append(record.row)
+            else:
+                grouped.setdefault(record.path, []).append(record)
+
+        for path, items in grouped.items():
+            try:
+                f = self._handle(path)
+                f.write(b"".join(item.data for item in items))
+                # 只写到操作系统缓冲，读取方（HistoryLoader）即可看到完整内容
+                f.flush()
+            except OSError:
+                logger.exception("写入聊天记录失败: %s", path)
+                self._close_handle(path)
+                # 目录可能被外部删除，下次重新创建
+                self._dirs.discard(path.parent)
+                continue
+
+            callbacks = {item.on_flush for item in items if item.on_flush is not None}
+            for callback in callbacks:
+                try:
+                    callback(path)
+                except Exception:
+                    logger.exception("聊天记录写入回调失败: %s", path)
+
+        for sink, items in rows.items():
+            try:
+                sink(items)
+            except Exception:
+                logger.exception("聊天记录批量写入失败（%d 条）", len(items))
+
+        for task in tasks:
+            try:
+                task.func()
+            except Exception:
+                logger.exception("聊天记录写入任务失败")
+
+    # ==========================================================
+    # 文件句柄
+    # ==========================================================
+
+    def _handle(self, path: Path):
+        f = self._handles.get(path)
+
+        if f is not None:
+            self._handles.move_to_end(path)
+            return f
+
+        # 同一类别换到新的一天：前一天的文件不会再写，直接关闭
+        category_dir = path.parent.parent
+        previous = self._current_day.get(category_dir)
+        if previous is not None and previous != path:
+            self._close_handle(previous)
+        self._current_day[category_dir] = path
+
+        folder = path.parent
+        if folder not in self._dirs:
+            folder.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(folder)
+
+        f = path.open("ab")
+        self._handles[path] = f
+
+        while len(self._handles) > self.max_open_files:
+            _, oldest = self._handles.popitem(last=False)
+            oldest.close()
+
+        return f
+
+    def _close_handle(self, path: Path) -> None:
+        f = self._handles.pop(path, None)
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                logger.exception("关闭聊天记录文件失败: %s", path)
+
+    def _close_all(self) -> None:
+        for path in list(self._handles):
+            self._close_handle(path)
+        self._current_day.clear()
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class ImageDescriptionCache:
+    """
+    图片描述缓存，与 ImageStorage 共用 image_index.db。
+
+        image_descriptions(
+            sha256, model, prompt_version,   -- 主键
+            description, created_time, last_used
+        )
+
+    以图片内容的 SHA256 为键，同一个表情包/图片被反复转发时直接返回上次的 VLM 描述。
+    模型或提示词变化时 (model, prompt_version) 不同，旧描述自然失效，
+    不再被使用的旧记录按 last_used 最早优先被淘汰。
+
+    淘汰规则：
+        - 超过 max_age_days 天没有被使用的记录；
+        - 总数超过 max_entries 时，删除最久未使用的记录。
+    """
+
+    TABLE = "image_descriptions"
+
+    # 每写入多少条检查一次淘汰
+    EVICT_EVERY = 500
+
+    def __init__(
+            self,
+            db_path: str | Path,
+            max_entries: int = 20000,
+            max_age_days: float = 180,
+    ):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+
+        # MediaPipeline 在多个线程里并发识别，共用连接并加锁；ImageStorage 写同一个库时最多等 10 秒
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self._puts = 0
+
+        self._init_database()
+        self.evict()
+
+    def _init_database(self) -> None:
+        with self._lock:
+            self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.TABLE}(
+                sha256 TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                description TEXT NOT NULL,
+                created_time REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY(sha256, model, prompt_version)
+            )
+            """)
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.TABLE}_last_used ON {self.TABLE}(last_used)"
+            )
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    # ==========================================================
+    # 对外接口
+    # ==========================================================
+
+    def get(self, sha256: str, model: str, prompt_version: str) -> str | None:
+        """
+        查询描述，命中时刷新 last_used
+        """
+
+        with self._lock:
+            row = self.conn.execute(
+                f"""
+                SELECT description FROM {self.TABLE}
+                WHERE sha256 = ? AND model = ? AND prompt_version = ?
+                """,
+                (sha256, model, prompt_version),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self.conn.execute(
+                f"""
+                UPDATE {self.TABLE} SET last_used = ?
+                WHERE sha256 = ? AND model = ? AND prompt_version = ?
+                """,
+                (time.time(), sha256, model, prompt_version),
+            )
+            self.conn.commit()
+
+        return row[0]
+
+    def put(self, sha256: str, model: str, prompt_version: str, description: str) -> None:
+        """
+        写入描述（已存在时覆盖）
+        """
+
+        now = time.time()
+
+        with self._lock:
+            self.conn.execute(
+                f"""
+                INSERT INTO {self.TABLE}(sha256, model, prompt_version, description, created_time, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(sha256, model, prompt_version) DO UPDATE SET
+                    description = excluded.description,
+                    created_time = excluded.created_time,
+                    last_used = excluded.last_used
+                """,
+                (sha256, model, prompt_version, description, now, now),
+            )
+            self.conn.commit()
+            self._puts += 1
+            should_evict = self._puts % self.EVICT_EVERY == 0
+
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        按时间和数量淘汰记录
+
+        Returns
+        -------
+        int
+            删除的记录数
+        """
+
+        removed = 0
+
+        with self._lock:
+            if self.max_age_days and self.max_age_days > 0:
+                cursor = self.conn.execute(
+                    f"DELETE FROM {self.TABLE} WHERE last_used < ?",
+                    (time.time() - self.max_age_days * 86400,),
+                )
+                removed += cursor.rowcount
+
+            if self.max_entries and self.max_entries > 0:
+                cursor = self.conn.execute(
+                    f"""
+                    DELETE FROM {self.TABLE} WHERE rowid IN (
+                        SELECT rowid FROM {self.TABLE}
+                        ORDER BY last_used DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+                removed += cursor.rowcount
+
+            self.conn.commit()
+
+        return removed
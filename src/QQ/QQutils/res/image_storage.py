@@ -3,14 +3,15 @@ from __future__ import annotations
 import hashlib
 import io
 import sqlite3
+import threading
 from datetime import datetime
 from pathlib import Path
 
-import requests
 from PIL import Image
 
 from src.QQ.QQutils.msg.msg_wrapper import RecvMessageWrapper, SendMessageWrapper
 from src.config.path import HISTORY_DIR
+from src.utils.tools.fetcher import MediaFetcher
 
 
 class ImageStorage:
@@ -53,8 +54,11 @@ class ImageStorage:
 
         self.db_path = self.bot_root / "image_index.db"
 
-        self.conn = sqlite3.connect(self.db_path)
+        # process 在 BlockingExecutor 的线程中执行，多个线程共用连接，查重到入库之间加锁；
+        # 另一个进程占用写锁时最多等待 10 秒
+        self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        self._lock = threading.RLock()
 
         self._init_database()
 
@@ -76,6 +80,16 @@ class ImageStorage:
         )
         """)
 
+        # 每个 (类型, 日期) 已分配的最大编号
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_counters(
+            image_type TEXT NOT NULL,
+            date TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            PRIMARY KEY(image_type, date)
+        )
+        """)
+
         self.conn.commit()
 
     def close(self):
@@ -96,17 +110,10 @@ class ImageStorage:
     @staticmethod
     def _download(url: str) -> bytes:
         """
-        下载原图
+        下载原图（经 MediaFetcher，同一 URL 只下载一次）
         """
 
-        response = requests.get(
-            url,
-            timeout=20
-        )
-
-        response.raise_for_status()
-
-        return response.content
+        return MediaFetcher.fetch(url)
 
     # ==========================================================
     # 图片格式
@@ -214,6 +221,81 @@ class ImageStorage:
             exist_ok=True
         )
 
+        idx = self._allocate_id(
+            image_type=image_type,
+            date=date,
+            folder=folder
+        )
+
+        filename = f"{date}-{idx}{suffix}"
+
+        return (
+            filename,
+            folder / filename
+        )
+
+    def _allocate_id(
+            self,
+            image_type: str,
+            date: str,
+            folder: Path,
+    ) -> int:
+        """
+        分配 (类型, 日期) 的下一个编号。
+
+        BEGIN IMMEDIATE 先拿到数据库写锁再读改写，
+        两个进程共用同一个 bot_root 时也不会拿到相同编号。
+        计数表中还没有这一天（新的一天或数据库丢失）时，扫描一次目录作为起点。
+        """
+
+        with self._lock:
+            self.conn.commit()
+            self.cursor.execute("BEGIN IMMEDIATE")
+
+            try:
+                self.cursor.execute(
+                    """
+                    SELECT last_id
+                    FROM image_counters
+                    WHERE image_type=? AND date=?
+                    """,
+                    (image_type, date)
+                )
+
+                row = self.cursor.fetchone()
+
+                last_id = (
+                    row[0]
+                    if row is not None
+                    else self._scan_max_id(folder, date)
+                )
+
+                self.cursor.execute(
+                    """
+                    INSERT INTO image_counters(image_type, date, last_id)
+                    VALUES(?,?,?)
+                    ON CONFLICT(image_type, date) DO UPDATE SET last_id=excluded.last_id
+                    """,
+                    (image_type, date, last_id + 1)
+                )
+
+                self.conn.commit()
+
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+        return last_id + 1
+
+    @staticmethod
+    def _scan_max_id(
+            folder: Path,
+            date: str,
+    ) -> int:
+        """
+        扫描目录，返回该日期已有的最大编号
+        """
+
         prefix = f"{date}-"
 
         max_id = 0
@@ -237,12 +319,7 @@ class ImageStorage:
 
             max_id = max(max_id, idx)
 
-        filename = f"{date}-{max_id + 1}{suffix}"
-
-        return (
-            filename,
-            folder / filename
-        )
+        return max_id
 
     # ==========================================================
     # 保存原图
@@ -283,78 +360,110 @@ class ImageStorage:
         # 下载原图
         data = self._download(image_url)
 
+        return self.save_bytes(
+            data=data,
+            image_type=image_type,
+            date=date
+        )
+
+    def save_bytes(
+            self,
+            data: bytes,
+            image_type: str,
+            date: str,
+    ) -> str:
+        """
+        保存已经下载好的图片（MediaPipeline 自己并发下载后调用）。
+
+        Parameters
+        ----------
+        data
+            图片原始字节
+        image_type
+            image 或 qq_emoji
+        date
+            消息日期，YYYY-MM-DD
+
+        Returns
+        -------
+        str
+            图片相对路径
+        """
+
         # SHA256
         sha256 = self._sha256(data)
 
-        # 查重
-        old_path = self._query_image(sha256)
+        # 查重、编号、写文件、入库必须一起完成，避免两个线程同时保存同一张图或抢同一个编号
+        with self._lock:
+            # 查重
+            old_path = self._query_image(sha256)
 
-        if old_path is not None:
+            if old_path is not None:
 
-            full_path = self.bot_root / old_path
+                full_path = self.bot_root / old_path
 
-            # 数据库存在且文件真实存在
-            if full_path.exists():
-                return old_path
+                # 数据库存在且文件真实存在
+                if full_path.exists():
+                    return old_path
 
-            # 数据库存在，但文件被用户删除
-            print(
-                f"[ImageStorage] 图片丢失，重新保存：{old_path}"
-            )
+                # 数据库存在，但文件被用户删除
+                print(
+                    f"[ImageStorage] 图片丢失，重新保存：{old_path}"
+                )
 
-        # 判断图片格式
-        suffix = self._detect_suffix(data)
+            # 判断图片格式
+            suffix = self._detect_suffix(data)
 
-        # 自动编号
-        filename, save_path = self._next_filename(
-            image_type=image_type,
-            suffix=suffix,
-            date=date
-        )
+            # 自动编号
+            filename, save_path = self._next_filename(
+                image_type=image_type,
+                suffix=suffix,
+                date=date
+            )
 
-        # 保存原图
-        self._write_file(
-            save_path,
-            data
-        )
+            # 保存原图
+            self._write_file(
+                save_path,
+                data
+            )
 
-        relative_path = (
-                Path(image_type)
-                / date[:7]
-                / filename
-        ).as_posix()
-
-        # 数据库已有该 sha，说明只是图片被删了
-        if old_path is not None:
-
-            self.cursor.execute(
-                """
-                UPDATE images
-                SET
-                    relative_path=?,
-                    file_size=?,
-                    created_time=?
-                WHERE sha256=?
-                """,
-                (
-                    relative_path,
-                    len(data),
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    sha256
+            relative_path = (
+                    Path(image_type)
+                    / date[:7]
+                    / filename
+            ).as_posix()
+
+            # 数据库已有该 sha，说明只是图片被删了
+            if old_path is not None:
+
+                self.cursor.execute(
+                    """
+                    UPDATE images
+                    SET
+                        relative_path=?,
+                        file_size=?,
+                        created_time=?
+                    WHERE sha256=?
+                    """,
+                    (
+                        relative_path,
+                        len(data),
+                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        sha256
+                    )
                 )
-            )
 
-            self.conn.commit()
+                self.conn.commit()
 
-        else:
+            else:
 
-            self._insert_image(
-                sha256=sha256,
-                relative_path=relative_path,
-                file_size=len(data)
-            )
+                self._insert_image(
+                    sha256=sha256,
+                    relative_path=relative_path,
+                    file_size=len(data)
+                )
 
-        return relative_path
+            return relative_path
 
     # ==========================================================
     # 对 MessageWrapper 进行处理
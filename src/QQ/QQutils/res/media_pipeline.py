@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from urllib.parse import urlparse
+
+from src.QQ.QQutils.msg.msg_wrapper import RecvMessageWrapper
+from src.QQ.QQutils.res.image_storage import ImageStorage
+from src.utils.chat.img_describer import ImageDescriber
+from src.utils.tools.executor import BlockingExecutor
+from src.utils.tools.fetcher import MediaFetcher
+from src.utils.tools.res.emoji_detector import EmojiDetector
+from src.utils.tools.tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class MediaPipeline:
+    """
+    一条消息中所有图片的并发处理流程。
+
+    每个图片 segment 独立经过三个阶段：
+
+        下载（MediaFetcher，按域名限制并发，超时 download_timeout）
+            ↓
+        保存（ImageStorage.save_bytes，SHA256 去重）
+            ↓
+        识别（表情包检测 + VLM 描述，超时 describe_timeout）
+
+    同一条消息的多张图片同时处理，结果按原 segment 写回，顺序不变；
+    某一张图片的某个阶段失败时，只有这一张降级（没有 file 或没有 content），其余图片不受影响。
+
+    取代依次调用 ImageStorage.process 与 RecvMessageWrapper.process_content。
+    """
+
+    def __init__(
+            self,
+            image_storage: ImageStorage,
+            image_describer: ImageDescriber,
+            emoji_detector: EmojiDetector,
+            *,
+            max_concurrency: int = 8,
+            per_host: int = 4,
+            download_timeout: float = 20.0,
+            describe_timeout: float = 60.0,
+    ):
+        """
+        Parameters
+        ----------
+        max_concurrency
+            所有消息合计同时处理的图片数上限
+        per_host
+            同一个图片域名同时下载的数量上限
+        download_timeout
+            下载阶段超时（秒）
+        describe_timeout
+            VLM 描述阶段超时（秒）
+        """
+
+        self.image_storage = image_storage
+        self.image_describer = image_describer
+        self.emoji_detector = emoji_detector
+
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self.download_timeout = download_timeout
+        self.describe_timeout = describe_timeout
+
+        # 信号量在事件循环中按需创建
+        self._semaphore: asyncio.Semaphore | None = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    # ==========================================================
+    # 对外接口
+    # ==========================================================
+
+    async def process(self, message_wrapper: RecvMessageWrapper) -> RecvMessageWrapper:
+        """
+        并发处理消息中的所有图片，填写 file / file_abs / content 字段
+        """
+
+        date = datetime.fromtimestamp(
+            message_wrapper.timestamp
+        ).strftime("%Y-%m-%d")
+
+        segments = [
+            seg for seg in message_wrapper.segments
+            if seg["type"] in ("image", "qq_emoji")
+        ]
+
+        # 只有一张普通图片时才做表情包检测，与 fill_image_content 的规则一致
+        single_image = sum(1 for seg in segments if seg["type"] == "image") == 1
+
+        if segments:
+            await asyncio.gather(*(
+                self._process_segment(
+                    seg,
+                    date=date,
+                    check_emoji=single_image and seg["type"] == "image",
+                    bot_name=message_wrapper.bot_config.name_zh,
+                )
+                for seg in segments
+            ))
+
+        message_wrapper.processed = True
+        return message_wrapper
+
+    # ==========================================================
+    # 单个 segment
+    # ==========================================================
+
+    async def _process_segment(
+            self,
+            seg: dict,
+            *,
+            date: str,
+            check_emoji: bool,
+            bot_name: str,
+    ) -> None:
+        async with self._get_semaphore():
+            with Tracer.span("image.download"):
+                data = await self._download_stage(seg)
+
+            if data is not None and not seg.get("file"):
+                with Tracer.span("image.store"):
+                    await self._store_stage(seg, data, date)
+
+            with Tracer.span("image.describe"):
+                await self._describe_stage(seg, data, check_emoji, bot_name)
+
+    async def _download_stage(self, seg: dict) -> bytes | None:
+        """
+        下载原图；已经落盘的 segment 直接读本地文件
+        """
+
+        url = seg.get("url")
+
+        try:
+            if seg.get("file"):
+                return await BlockingExecutor.run(self._read_file, seg)
+
+            if not url:
+                return None
+
+            async with self._get_host_semaphore(url):
+                return await asyncio.wait_for(
+                    BlockingExecutor.run(MediaFetcher.fetch, url),
+                    timeout=self.download_timeout,
+                )
+        except asyncio.TimeoutError:
+            logger.warning("[MediaPipeline] 下载图片超时（%.0fs）：%s", self.download_timeout, url)
+        except Exception as e:
+            logger.warning("[MediaPipeline] 下载图片失败：%s，%s", url, e)
+
+        return None
+
+    async def _store_stage(self, seg: dict, data: bytes, date: str) -> None:
+        try:
+            seg["file"] = await BlockingExecutor.run(
+                self.image_storage.save_bytes,
+                data=data,
+                image_type=seg["type"],
+                date=date,
+            )
+            # canonical 里保留相对路径用于历史展示；绝对路径方便表情检测等直接读本地文件
+            seg["file_abs"] = str(self.image_storage.bot_root / seg["file"])
+        except Exception as e:
+            logger.warning("[MediaPipeline] 保存图片失败：%s", e)
+
+    async def _describe_stage(
+            self,
+            seg: dict,
+            data: bytes | None,
+            check_emoji: bool,
+            bot_name: str,
+    ) -> None:
+        image_content = ""
+
+        try:
+            # 开启感知哈希时需要解码图片，放到线程池中
+            if check_emoji and data is not None and await BlockingExecutor.run(
+                    self.emoji_detector.is_emoji_bytes, data
+            ):
+                image_content += f"这是一个{bot_name}的表情包。"
+        except Exception as e:
+            logger.warning("[MediaPipeline] 表情包检测失败：%s", e)
+
+        try:
+            if data is not None:
+                call = BlockingExecutor.run(self.image_describer.describe_bytes, data)
+            else:
+                # 下载失败时仍交给 VLM 尝试直接读取 URL
+                source = seg.get("file_abs") or seg.get("file") or seg.get("url")
+                call = BlockingExecutor.run(self.image_describer.describe_img, source) if source else None
+
+            if call is not None:
+                img_desc = await asyncio.wait_for(call, timeout=self.describe_timeout)
+                if img_desc:
+                    image_content += img_desc
+        except asyncio.TimeoutError:
+            logger.warning("[MediaPipeline] 图片识别超时（%.0fs）：%s", self.describe_timeout, seg.get("url"))
+        except Exception as e:
+            logger.warning("[MediaPipeline] 图片识别失败：%s", e)
+
+        seg["content"] = image_content or None
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    def _read_file(self, seg: dict) -> bytes:
+        path = seg.get("file_abs") or str(self.image_storage.bot_root / seg["file"])
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _get_host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
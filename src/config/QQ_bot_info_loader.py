@@ -13,6 +13,58 @@ class BotPaths:
     emoji_dir: str = ""
 
 
+@dataclass(frozen=True)
+class BotHistory:
+    # 聊天记录是否由后台线程攒批写盘
+    buffered: bool = True
+    flush_interval: float = 1.0
+    flush_records: int = 64
+    max_open_files: int = 64
+    # full：raw/canonical/llm_input/human 都写；canonical：只写 canonical，其余视图按需渲染
+    layout: str = "full"
+    # files：按日期的文件树；sqlite：每个 bot 一个 history.db（带全文索引）
+    backend: str = "files"
+
+
+@dataclass(frozen=True)
+class BotReply:
+    # 流式生成回复，第一句话生成完就先发送
+    stream: bool = True
+    # 短于该字数的句子与后文合并后再发送，避免刷出很多条很短的消息
+    min_segment_chars: int = 8
+
+
+@dataclass(frozen=True)
+class BotKnowledge:
+    # llm：每次回复前由 LLM 选择知识；embedding：只用向量检索；
+    # hybrid：向量检索，最高分不确定时再交给 LLM 选择
+    retriever: str = "hybrid"
+    top_k: int = 3
+    # 低于 min_score 的条目不选；最高分达到 accept_score 时不再询问 LLM
+    min_score: float = 0.4
+    accept_score: float = 0.6
+
+
+@dataclass(frozen=True)
+class BotContext:
+    # 每个模型的输入 token 预算（system + 历史 + 当前消息），未列出的模型用 default_budget
+    default_budget: int = 16000
+    budgets: dict[str, int] = field(default_factory=lambda: {
+        "deepseek-v4-pro": 16000,
+        "deepseek-v4-flash": 8000,
+    })
+    # 按优先级排列的各部分上限；角色设定与当前消息总是保留
+    sections: dict[str, int] = field(default_factory=lambda: {
+        "short_term": 1500,
+        "long_term": 1500,
+        "knowledge": 3000,
+        "history": 8000,
+    })
+    # stable_prefix：角色设定与完整知识目录在前，记忆、检索片段与近期历史在后，
+    # 前缀保持不变以命中服务端上下文缓存；classic：记忆与知识都拼在 system prompt 中
+    layout: str = "stable_prefix"
+
+
 @dataclass(frozen=True)
 class BotConfig:
     name_zh: str
@@ -21,6 +73,10 @@ class BotConfig:
     bot_id: int
     admin_qq_id: int
     paths: BotPaths
+    history: BotHistory = field(default_factory=BotHistory)
+    reply: BotReply = field(default_factory=BotReply)
+    knowledge: BotKnowledge = field(default_factory=BotKnowledge)
+    context: BotContext = field(default_factory=BotContext)
 
 
 class BotInfoConfigLoader:
@@ -47,13 +103,83 @@ class BotInfoConfigLoader:
             emoji_dir=str(paths_data.get("emoji_dir") or EMOJI_DIR / bot_name),
         )
 
+        history_data = data.get("history") or {}
+
+        if history_data.get("layout", BotHistory.layout) not in ("full", "canonical"):
+            raise ValueError(
+                f"history.layout 只能是 full 或 canonical: {config_path}"
+            )
+
+        if history_data.get("backend", BotHistory.backend) not in ("files", "sqlite"):
+            raise ValueError(
+                f"history.backend 只能是 files 或 sqlite: {config_path}"
+            )
+
+        history = BotHistory(
+            buffered=bool(history_data.get("buffered", BotHistory.buffered)),
+            flush_interval=float(history_data.get("flush_interval", BotHistory.flush_interval)),
+            flush_records=int(history_data.get("flush_records", BotHistory.flush_records)),
+            max_open_files=int(history_data.get("max_open_files", BotHistory.max_open_files)),
+            layout=str(history_data.get("layout", BotHistory.layout)),
+            backend=str(history_data.get("backend", BotHistory.backend)),
+        )
+
+        reply_data = data.get("reply") or {}
+
+        reply = BotReply(
+            stream=bool(reply_data.get("stream", BotReply.stream)),
+            min_segment_chars=int(reply_data.get("min_segment_chars", BotReply.min_segment_chars)),
+        )
+
+        knowledge_data = data.get("knowledge") or {}
+
+        if knowledge_data.get("retriever", BotKnowledge.retriever) not in ("llm", "embedding", "hybrid"):
+            raise ValueError(
+                f"knowledge.retriever 只能是 llm、embedding 或 hybrid: {config_path}"
+            )
+
+        knowledge = BotKnowledge(
+            retriever=str(knowledge_data.get("retriever", BotKnowledge.retriever)),
+            top_k=int(knowledge_data.get("top_k", BotKnowledge.top_k)),
+            min_score=float(knowledge_data.get("min_score", BotKnowledge.min_score)),
+            accept_score=float(knowledge_data.get("accept_score", BotKnowledge.accept_score)),
+        )
+
+        context_data = data.get("context") or {}
+
+        sections = context_data.get("sections") or BotContext().sections
+        unknown = set(sections) - {"short_term", "long_term", "knowledge", "history"}
+        if unknown:
+            raise ValueError(
+                f"context.sections 只能包含 short_term、long_term、knowledge、history: {config_path}"
+            )
+
+        if context_data.get("layout", BotContext.layout) not in ("stable_prefix", "classic"):
+            raise ValueError(
+                f"context.layout 只能是 stable_prefix 或 classic: {config_path}"
+            )
+
+        context = BotContext(
+            default_budget=int(context_data.get("default_budget", BotContext.default_budget)),
+            budgets={
+                str(model): int(tokens)
+                for model, tokens in (context_data.get("budgets") or BotContext().budgets).items()
+            },
+            sections={str(name): int(tokens) for name, tokens in sections.items()},
+            layout=str(context_data.get("layout", BotContext.layout)),
+        )
+
         return BotConfig(
             name_zh=data["name_zh"],
             name_en=data["name_en"],
             nickname=data["nickname"],
             bot_id=data["bot_id"],
             admin_qq_id=data.get("admin_qq_id", []),
-            paths=paths
+            paths=paths,
+            history=history,
+            reply=reply,
+            knowledge=knowledge,
+            context=context,
         )
 
 
@@ -16,6 +16,9 @@ PICTURES_DIR = ASSETS_DIR / "pictures"
 QQ_BOT_INFO_DIR = CONFIG_DIR / "QQ_bot_info"
 QQ_HISTORY_DIR = HISTORY_DIR / "qq_chat"
 EMOJI_HASH_DIR = CACHE_DIR / "emoji_hash"
+FETCH_CACHE_DIR = CACHE_DIR / "fetch"
+KNOWLEDGE_CACHE_DIR = CACHE_DIR / "knowledge"
+METRICS_DIR = ASSETS_DIR / "metrics"
 
 # print(f"项目根目录: {PROJECT_ROOT}")
 # print(f"资源目录: {ASSETS_DIR}")
@@ -9,6 +9,7 @@ from src.config.path import PROMPT_DIR, EMOJI_DIR
 from src.config.cur_role import current_role
 from src.utils.tools.file import load_from_txt
 from src.utils.chat.role_chat import ChatDSAPI
+from src.utils.tools.metrics import ModelCallMetrics
 
 
 class EmojiDecider(ChatDSAPI):
@@ -167,12 +168,14 @@ class EmojiDecider(ChatDSAPI):
         ]
 
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=temp_msg,
-                temperature=0.0,
-                stream=False
-            )
+            with ModelCallMetrics.track("emoji_decider", self.model_name) as call:
+                completion = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=temp_msg,
+                    temperature=0.0,
+                    stream=False
+                )
+                call.usage = completion.usage
             result = completion.choices[0].message.content.strip()
             if result in self.emoji_map:
                 return result
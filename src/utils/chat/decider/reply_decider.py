@@ -203,7 +203,8 @@ topic_stability: new: 新话题，讨论尚未稳定、stable: 已形成稳定
                 "type": "json_object"
             },
             temperature=0.3,
-            max_tokens=8192
+            max_tokens=8192,
+            caller="reply_decider",
         )
 
     @staticmethod
@@ -1,31 +1,61 @@
 import pandas as pd
 import numpy as np
 import dashscope
+import hashlib
 import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 from src.config.cur_role import current_role
 from src.config.path import VOICE_DIR, API_KEY_DIR
+from src.utils.chat.search.vector_index import VectorIndex
 from src.utils.tools.file import load_from_txt
+from src.utils.tools.metrics import ModelCallMetrics
 
 
 # todo 本地部署： https://huggingface.co/Qwen/Qwen3-VL-Embedding-2B/tree/main
 class VoiceDecider:
-    def __init__(self, csv_path):
+    EMBEDDING_MODEL = "qwen3-vl-embedding"
+
+    # 向量库构建：每次请求的文本数、同时进行的请求数、失败重试次数
+    EMBED_BATCH_SIZE = 10
+    EMBED_CONCURRENCY = 4
+    EMBED_RETRIES = 2
+
+    def __init__(self, csv_path, backend="numpy"):
+        """
+        Parameters
+        ----------
+        csv_path
+            语音描述 CSV（name, content 两列）
+        backend
+            向量索引后端，见 VectorIndex.BACKENDS
+        """
         self.csv_path = Path(csv_path)
         self.api_key = load_from_txt(Path(API_KEY_DIR) / "qwen.txt")
         self.df = pd.read_csv(self.csv_path)
         self.vector_cache_path = self.csv_path.with_name(f"{self.csv_path.stem}_vectors.npy")  # 向量库缓存路径
         self.vector_cache_meta_path = self.vector_cache_path.with_name(f"{self.vector_cache_path.stem}.meta.json")
-        self.library_vectors = self._load_library()  # 预加载或生成向量库
+        # 按文本内容哈希保存的 embedding 缓存，CSV 改动后只请求变化的行，也是中断后续跑的检查点
+        self.embedding_cache_path = self.csv_path.with_name(f"{self.csv_path.stem}_embeddings.db")
+        self._load_library()  # 预加载或生成向量库
+        # 归一化后的 float32 向量以 mmap 方式加载，同进程的多个 bot 共用一份索引
+        self.index = VectorIndex.load(self.vector_cache_path, backend=backend)
+        self.library_vectors = self.index.vectors
 
     def _get_single_embedding(self, text):
         """调用 Qwen API 获取单个文本的向量"""
-        resp = dashscope.MultiModalEmbedding.call(
-            model="qwen3-vl-embedding",
-            input=[{'text': text}],
-            api_key=self.api_key
-        )
+        with ModelCallMetrics.track("voice_embedding", self.EMBEDDING_MODEL) as call:
+            resp = dashscope.MultiModalEmbedding.call(
+                model=self.EMBEDDING_MODEL,
+                input=[{'text': text}],
+                api_key=self.api_key
+            )
+            call.usage = resp.usage
+            if resp.status_code != 200:
+                call.fail(str(resp.message))
         if resp.status_code == 200:
             # 提取向量列表
             return np.array(resp.output['embeddings'][0]['embedding'])
@@ -33,49 +63,204 @@ class VoiceDecider:
             print(f"Embedding 请求失败: {resp.message}")
             return None
 
+    def _get_batch_embeddings(self, texts):
+        """
+        一次请求获取多条文本的向量，按 index 对齐；
+        返回条数与输入不一致（例如服务端把多条输入融合成一个向量）时逐条请求
+        """
+        with ModelCallMetrics.track("voice_embedding", self.EMBEDDING_MODEL) as call:
+            resp = dashscope.MultiModalEmbedding.call(
+                model=self.EMBEDDING_MODEL,
+                input=[{'text': text} for text in texts],
+                api_key=self.api_key
+            )
+            call.usage = resp.usage
+            if resp.status_code != 200:
+                raise RuntimeError(f"Embedding 请求失败: {resp.message}")
+
+        embeddings = resp.output['embeddings']
+        if len(texts) > 1 and len(embeddings) != len(texts):
+            vectors = [self._get_single_embedding(text) for text in texts]
+            if any(vec is None for vec in vectors):
+                raise RuntimeError("Embedding 逐条请求失败")
+            return vectors
+
+        embeddings = sorted(embeddings, key=lambda item: item.get('index', 0))
+        return [np.array(item['embedding']) for item in embeddings]
+
+    # ==========================================================
+    # 向量库构建
+    # ==========================================================
+
     def _load_library(self):
-        """加载本地 .npy 缓存；CSV 变化或元数据缺失时重新生成。"""
+        """确认本地 .npy 缓存可用；CSV 中有文本变化时增量重建。"""
         if self.vector_cache_path.exists() and self._cache_is_valid():
             print(f"正在从本地加载向量库: {self.vector_cache_path.name}")
-            return np.load(self.vector_cache_path)
+            return
 
-        print("未发现本地向量库，正在生成...")
-        vectors = []
-        for index, row in self.df.iterrows():
-            content = row['content']
-            vec = self._get_single_embedding(content)
-            if vec is not None:
-                vectors.append(vec)
-            print(f"已处理 ({index + 1}/{len(self.df)}): {content}")
+        print("向量库缺失或 CSV 已变化，正在增量生成...")
+        self._build_library()
 
-        vectors_np = np.array(vectors)
-        np.save(self.vector_cache_path, vectors_np)  # 保存到本地，下次直接读取
-        self._save_cache_meta()
+    def _build_library(self):
+        """
+        按行生成与 self.df 一一对齐的向量库：
+
+            1. 每行文本按 (模型, 文本) 的 SHA256 查 embedding 缓存库，只有新增或修改的文本需要请求；
+            2. 缺失的文本去重后按 EMBED_BATCH_SIZE 分批，EMBED_CONCURRENCY 个批次并发请求，失败的批次重试；
+            3. 每个批次完成后立即写入缓存库，中途中断后重启只请求剩下的文本；
+            4. 仍然失败的行填零向量（与任何查询的相似度为 0，不会被匹配），行号不会错位，
+               且不写元数据，下次启动时只重试这些行。
+        """
+        contents = self._row_contents()
+        hashes = [self._content_hash(text) for text in contents]
+
+        with sqlite3.connect(self.embedding_cache_path) as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings(
+                hash TEXT PRIMARY KEY,
+                vector BLOB NOT NULL
+            )
+            """)
+
+            cached = self._load_cached_embeddings(conn, set(hashes))
+
+            missing = {}
+            for content_hash, text in zip(hashes, contents):
+                if content_hash not in cached:
+                    missing[content_hash] = text
+
+            print(f"共 {len(contents)} 行，缓存命中 {len(contents) - sum(h in missing for h in hashes)} 行，"
+                  f"需要请求 {len(missing)} 条文本")
+
+            if missing:
+                cached.update(self._embed_missing(conn, list(missing.items())))
+
+        dim = next((len(vec) for vec in cached.values()), None)
+        if dim is None:
+            raise RuntimeError("向量库生成失败：没有任何文本获取到向量")
+
+        vectors_np = np.zeros((len(contents), dim), dtype=np.float32)
+        failed = 0
+        for row, content_hash in enumerate(hashes):
+            vec = cached.get(content_hash)
+            if vec is None:
+                failed += 1
+            else:
+                vectors_np[row] = vec
+
+        tmp_path = self.vector_cache_path.with_name(f"{self.vector_cache_path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, vectors_np)  # 保存到本地，下次直接读取
+        tmp_path.replace(self.vector_cache_path)
+
+        if failed:
+            print(f"⚠️ {failed} 行未获取到向量，已填零向量，下次启动时重试")
+            self.vector_cache_meta_path.unlink(missing_ok=True)
+        else:
+            self._save_cache_meta(hashes)
         print(f"向量库已保存至: {self.vector_cache_path}")
-        return vectors_np
+
+    def _embed_missing(self, conn, items):
+        """
+        并发请求缺失的向量，每个批次完成后立即写入缓存库
+
+        Returns
+        -------
+        dict
+            {content_hash: vector}，只包含成功的条目
+        """
+        batches = [
+            items[i:i + self.EMBED_BATCH_SIZE]
+            for i in range(0, len(items), self.EMBED_BATCH_SIZE)
+        ]
+
+        result = {}
+        done = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.EMBED_CONCURRENCY) as pool:
+            futures = {pool.submit(self._embed_batch, batch): batch for batch in batches}
+
+            for future in as_completed(futures):
+                batch = futures[future]
+                done += len(batch)
+
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    print(f"批次失败（{len(batch)} 条），跳过: {e}")
+                    continue
+
+                succeeded = {
+                    content_hash: np.asarray(vec, dtype=np.float32)
+                    for (content_hash, _), vec in zip(batch, vectors)
+                    if vec is not None
+                }
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings(hash, vector) VALUES (?, ?)",
+                    [(content_hash, vec.tobytes()) for content_hash, vec in succeeded.items()],
+                )
+                conn.commit()
+                result.update(succeeded)
+
+                print(f"已处理 ({done}/{len(items)})，耗时 {time.perf_counter() - start:.1f}s")
+
+        return result
+
+    def _embed_batch(self, batch):
+        """
+        请求一个批次，失败时指数退避重试；仍然失败时逐条请求，单条坏数据不连累整批（失败的条目为 None）
+        """
+        texts = [text for _, text in batch]
+        for attempt in range(self.EMBED_RETRIES + 1):
+            try:
+                return self._get_batch_embeddings(texts)
+            except Exception:
+                if attempt >= self.EMBED_RETRIES:
+                    if len(texts) == 1:
+                        raise
+                    break
+                time.sleep(2 ** attempt)
+
+        return [self._get_single_embedding(text) for text in texts]
+
+    @staticmethod
+    def _load_cached_embeddings(conn, hashes):
+        cached = {}
+        for content_hash, blob in conn.execute("SELECT hash, vector FROM embeddings"):
+            if content_hash in hashes:
+                cached[content_hash] = np.frombuffer(blob, dtype=np.float32)
+        return cached
+
+    def _row_contents(self):
+        return ["" if pd.isna(text) else str(text) for text in self.df['content']]
+
+    def _content_hash(self, text):
+        return hashlib.sha256(f"{self.EMBEDDING_MODEL}\n{text}".encode("utf-8")).hexdigest()
+
+    def _rows_digest(self, hashes):
+        return hashlib.sha256("\n".join(hashes).encode("utf-8")).hexdigest()
 
     def _cache_is_valid(self) -> bool:
-        """校验 .npy 是否对应当前 CSV 的行数、mtime 与 size。"""
+        """校验 .npy 是否对应当前 CSV 每一行的文本（按内容哈希，而不是 mtime）。"""
         try:
-            stat = self.csv_path.stat()
             meta = json.loads(self.vector_cache_meta_path.read_text(encoding="utf-8"))
+            hashes = [self._content_hash(text) for text in self._row_contents()]
             return (
                 meta.get("csv_path") == str(self.csv_path.resolve())
                 and meta.get("rows") == len(self.df)
-                and meta.get("mtime") == stat.st_mtime
-                and meta.get("size") == stat.st_size
+                and meta.get("rows_digest") == self._rows_digest(hashes)
             )
         except Exception:
             return False
 
-    def _save_cache_meta(self) -> None:
-        stat = self.csv_path.stat()
+    def _save_cache_meta(self, hashes) -> None:
         self.vector_cache_meta_path.write_text(
             json.dumps({
                 "csv_path": str(self.csv_path.resolve()),
                 "rows": len(self.df),
-                "mtime": stat.st_mtime,
-                "size": stat.st_size,
+                "model": self.EMBEDDING_MODEL,
+                "rows_digest": self._rows_digest(hashes),
             }),
             encoding="utf-8",
         )
@@ -92,19 +277,13 @@ class VoiceDecider:
         if query_vector is None:
             return False
 
-        # 2. 计算余弦相似度；零向量直接排除，避免除零。
-        norm_library = np.linalg.norm(self.library_vectors, axis=1)
-        norm_query = np.linalg.norm(query_vector)
-        valid = (norm_library > 1e-9) & (norm_query > 1e-9)
-        if not valid.any():
+        # 2. 库向量已归一化，余弦相似度即一次内积检索
+        hits = self.index.search(query_vector, k=1)
+        if not hits:
             return False
-        dot_product = np.dot(self.library_vectors, query_vector)
-        similarities = np.full(len(self.library_vectors), -np.inf)
-        similarities[valid] = dot_product[valid] / (norm_library[valid] * norm_query)
 
         # 3. 获取相似度最高的结果
-        best_idx = int(np.argmax(similarities))
-        max_score = float(similarities[best_idx])
+        best_idx, max_score = hits[0]
 
         print(f"[VoiceDecider] '{user_query}' -> 匹配: '{self.df.iloc[best_idx]['content']}' (得分: {max_score:.4f})")
 
@@ -114,6 +293,42 @@ class VoiceDecider:
         else:
             return False
 
+    def match_topk(self, user_query, k=5):
+        """
+        返回最相似的 k 条语音
+        :return: [(文件名, 描述, 得分)]，按得分从高到低；获取向量失败时为空列表
+        """
+        query_vector = self._get_single_embedding(user_query)
+        if query_vector is None:
+            return []
+
+        return [
+            (self.df.iloc[row]['name'], self.df.iloc[row]['content'], score)
+            for row, score in self.index.search(query_vector, k=k)
+        ]
+
+    def match_batch(self, user_queries, threshold=0.712):
+        """
+        批量匹配，所有查询向量一次矩阵乘法完成检索
+        :return: 与 user_queries 等长的列表，元素为文件名 (str) 或 False
+        """
+        results = [False] * len(user_queries)
+        rows, vectors = [], []
+        for i, query in enumerate(user_queries):
+            vec = self._get_single_embedding(query)
+            if vec is not None:
+                rows.append(i)
+                vectors.append(vec)
+
+        if not vectors:
+            return results
+
+        scores, ids = self.index.search_batch(np.vstack(vectors), k=1)
+        for i, score, best_idx in zip(rows, scores[:, 0], ids[:, 0]):
+            if best_idx >= 0 and score >= threshold:
+                results[i] = self.df.iloc[int(best_idx)]['name']
+        return results
+
 
 if __name__ == "__main__":
     csv_file = Path(VOICE_DIR) / f"{current_role.name_en}/description.csv"
@@ -1,7 +1,11 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from pathlib import Path
+import hashlib
 import json
+import os
+import shutil
 
 from src.QQ.QQutils.res.history_loader import HistoryLoader
 from src.utils.chat.llm.run_prompt import PromptRunner
@@ -52,6 +56,28 @@ class SummaryGenerator:
         prompt = f"""旧摘要：\n{old_summary}\n新增摘要：\n{new_summary}"""
         return self._runner.run(system_prompt=self._MERGE_PROMPT, user_prompt=prompt)
 
+    def merge_summaries(self, old_summary: str, new_summaries: list[tuple[str, str]]) -> str:
+        """
+        一次融合多份按时间排序的新摘要，用于停机后补齐长期摘要。
+
+        Parameters
+        ----------
+        old_summary: 旧摘要。
+        new_summaries: (标签, 摘要) 列表，例如 (日期, daily summary)，越靠后越新。
+
+        Returns
+        -------
+        str: 融合后的摘要。
+        """
+        if len(new_summaries) == 1:
+            return self.merge_summary(old_summary, new_summaries[0][1])
+        new_summary = "\n\n".join(f"[{label}]\n{summary}" for label, summary in new_summaries)
+        prompt = (
+            f"""旧摘要：\n{old_summary}\n"""
+            f"""新增摘要（共{len(new_summaries)}份，按时间顺序排列，越靠后越新）：\n{new_summary}"""
+        )
+        return self._runner.run(system_prompt=self._MERGE_PROMPT, user_prompt=prompt)
+
 
 class SummaryManager:
     """
@@ -83,7 +109,14 @@ class SummaryManager:
     SHORT_TERM_FILE = "short_term.txt"
     DAILY_DIR_NAME = "daily"
     METADATA_FILE = "metadata.json"
+    CHECKPOINT_DIR_NAME = "checkpoint"
     SHORT_INTERVAL = 50
+    # map-reduce 构建长期摘要时的 LLM 并发数
+    MAP_REDUCE_WORKERS = 4
+    # 停机后补 daily summary 的并发数
+    CATCH_UP_WORKERS = 4
+    # 补长期摘要时一次合并多少天的 daily summary
+    LONG_TERM_BATCH_DAYS = 7
 
     def __init__(
             self,
@@ -125,32 +158,55 @@ class SummaryManager:
     # 初始化
     # ============================================================
 
-    def initialize_long_term(self) -> None:
+    def initialize_long_term(self, max_workers: int | None = None) -> None:
         """
         第一次初始化长期摘要。
         该方法理论上每个文件只会执行一次。
+
+        map-reduce：所有 chunk 并发生成初始摘要，再两两合并成一棵平衡树，
+        LLM 轮数从 O(chunk 数) 降到 O(log chunk 数)，每次合并的输入也不会越滚越大。
+        中间结果保存在 summary/checkpoint/initial/，中断后再次调用会从断点继续。
+
+        Parameters
+        ----------
+        max_workers
+            并发数，默认 MAP_REDUCE_WORKERS。
         """
-        # 检查long_term.txt是否存在，如果存在则不执行
-        long_term_path = self.summary_dir / self.LONG_TERM_FILE
-        if long_term_path.exists():
-            print(f"长期摘要已存在，跳过初始化。路径：{long_term_path}")
+        # 检查long_term.txt是否存在，如果存在则不执行（上次初始化被中断时存在断点，继续执行）
+        if not self.long_term_pending():
+            print(f"长期摘要已存在，跳过初始化。路径：{self.summary_dir / self.LONG_TERM_FILE}")
             return
 
+        # 先建断点目录再写占位：两步之间中断时断点目录已存在，下次仍会继续初始化
+        checkpoint_dir = self._checkpoint_dir("initial")
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
         self._save_long_term("长期记忆暂无内容")  # 暂时保存以防止多次调用反复生成
-        long_term = ""
+
         chunks = list(HistoryLoader.iter_chunks(self.bot_id, self.is_private, self.session_id))
-        for i, (start_date, end_date, chunk) in enumerate(chunks, 1):
-            print(f"[{i}/{len(chunks)}] 正在总结 {start_date} ~ {end_date}")
-            summary = self.generator.generate_initial_summary(chunk)
-            if not summary:
-                continue
-            if not long_term:
-                long_term = summary
-            else:
-                long_term = (self.generator.merge_summary(long_term, summary))
-                self._save_long_term(long_term)  # 暂时保存以防止丢失
+        total = len(chunks)
+
+        def summarize(item: tuple[int, tuple[date, date, str]]) -> str:
+            i, (start_date, end_date, chunk) = item
+
+            def produce() -> str:
+                print(f"[{i}/{total}] 正在总结 {start_date} ~ {end_date}")
+                return self.generator.generate_initial_summary(chunk)
+
+            return self._checkpointed(checkpoint_dir, "map", chunk, produce)
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.MAP_REDUCE_WORKERS) as pool:
+            summaries = list(pool.map(summarize, enumerate(chunks, 1)))
+            long_term = self._reduce_summaries(summaries, checkpoint_dir, pool)
 
         self._save_long_term(long_term)
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    def long_term_pending(self) -> bool:
+        """
+        长期摘要还没有初始化，或上次初始化被中断（summary/checkpoint/initial/ 仍在）。
+        """
+        long_term_path = self.summary_dir / self.LONG_TERM_FILE
+        return not long_term_path.exists() or self._checkpoint_dir("initial").exists()
 
     def initialize_short_term(self, recent_history: str | None = None) -> None:
         if recent_history is None:
@@ -235,39 +291,102 @@ class SummaryManager:
     # ============================================================
     # Rebuild
     # ============================================================
-    def rebuild_long_term(self) -> None:
+    def rebuild_long_term(self, max_workers: int | None = None) -> None:
         """
         根据所有 daily summary 重新构建 long_term。
         使用场景：
             - 修改了 Summary Prompt
             - 修改了总结策略
             - long_term 出错
+
+        daily summary 按日期顺序两两合并成平衡树，同一层的合并并发执行；
+        中间结果保存在 summary/checkpoint/rebuild/，中断后再次调用不会重复已完成的合并。
         """
-        long_term = ""
+        checkpoint_dir = self._checkpoint_dir("rebuild")
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
         daily_files = sorted(self.daily_dir.glob("*.txt"))
+        summaries = [self._read_text(file) for file in daily_files]
 
-        for file in daily_files:
-            daily_summary = (self._read_text(file))
-            if not daily_summary:
-                continue
-            if not long_term:
-                long_term = daily_summary
-            else:
-                long_term = (self.generator.merge_summary(long_term, daily_summary))
+        with ThreadPoolExecutor(max_workers=max_workers or self.MAP_REDUCE_WORKERS) as pool:
+            long_term = self._reduce_summaries(summaries, checkpoint_dir, pool)
 
         self._save_long_term(long_term)
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
         print(f"[rebuild_long_term] 更新完成")
 
+    def _reduce_summaries(
+            self,
+            summaries: list[str],
+            checkpoint_dir: Path,
+            pool: ThreadPoolExecutor,
+    ) -> str:
+        """
+        按顺序两两合并摘要，直到只剩一个。
+
+        每一层相邻的两个摘要（前者较早）合并一次，同层并发执行，层数为 O(log n)；
+        奇数个时最后一个直接进入下一层。
+        """
+        level = [summary for summary in summaries if summary]
+        depth = 0
+
+        while len(level) > 1:
+            depth += 1
+            pairs = [level[i:i + 2] for i in range(0, len(level), 2)]
+            print(f"[merge] 第{depth}层：{len(level)} -> {len(pairs)}")
+
+            def merge(pair: list[str]) -> str:
+                if len(pair) == 1:
+                    return pair[0]
+                old_summary, new_summary = pair
+                merged = self._checkpointed(
+                    checkpoint_dir,
+                    "reduce",
+                    old_summary + "\0" + new_summary,
+                    lambda: self.generator.merge_summary(old_summary, new_summary),
+                )
+                # 合并失败时保留较新的摘要，不让整棵树丢内容
+                return merged or new_summary
+
+            level = list(pool.map(merge, pairs))
+
+        return level[0] if level else ""
+
+    def _checkpoint_dir(self, name: str) -> Path:
+        return self.summary_dir / self.CHECKPOINT_DIR_NAME / name
+
+    def _checkpointed(self, checkpoint_dir: Path, stage: str, source: str, produce) -> str:
+        """
+        以输入内容的哈希为键缓存中间摘要：已有结果直接读取，否则生成后落盘。
+
+        输入内容变化（例如新增了聊天）时键也会变化，不会用到过期的结果。
+        """
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        path = checkpoint_dir / f"{stage}-{key}.txt"
+        if path.exists():
+            return self._read_text(path)
+
+        result = produce()
+        if result:
+            self._write_text(path, result)
+        return result
+
     # ============================================================
     # Load
     # ============================================================
 
-    def load_long_term(self) -> str:
+    def load_long_term(self, initialize: bool = True) -> str:
         """
         读取长期摘要。
+
+        Parameters
+        ----------
+        initialize
+            长期摘要未初始化或初始化被中断时，是否先（继续）执行 initialize_long_term。
+            回复路径传 False，初始化交给 SummaryWorker，期间读到占位内容或空字符串。
         """
         path = self.summary_dir / self.LONG_TERM_FILE
-        if not path.exists():
+        if initialize and self.long_term_pending():
             self.initialize_long_term()
         return self._read_text(path)
 
@@ -359,6 +478,12 @@ class SummaryManager:
     # ============================================================
 
     def _sync_daily(self) -> None:
+        """
+        补齐 last_daily_date 之后到昨天的 daily summary。
+
+        停机较久时缺的天数可能很多：没有聊天的日期按计数直接跳过，不调用 LLM；
+        其余日期在线程池中并发生成，metadata 在结束（或出错）时按已连续完成的最后一天保存一次。
+        """
         metadata = self._load_metadata()
         last_date = metadata.get(
             "last_daily_date"
@@ -372,25 +497,49 @@ class SummaryManager:
                 return
 
         yesterday = datetime.now().date() - timedelta(days=1)
+        targets = [
+            last_date + timedelta(days=offset)
+            for offset in range(1, (yesterday - last_date).days + 1)
+        ]
+        if not targets:
+            return
 
-        while last_date < yesterday:
-            target = last_date + timedelta(days=1)
+        if len(targets) > 1:
+            print(f"[_sync_daily] 需要补齐 {targets[0]} ~ {targets[-1]}，共{len(targets)}天")
+
+        completed: date | None = None
+        try:
+            with ThreadPoolExecutor(max_workers=self.CATCH_UP_WORKERS) as pool:
+                # map 按提交顺序返回，completed 始终是连续完成的最后一天
+                for done, target in enumerate(pool.map(self._catch_up_daily, targets), 1):
+                    completed = target
+                    if len(targets) > 1:
+                        print(f"[_sync_daily] 进度 {done}/{len(targets)}：{target}")
+        finally:
+            if completed is not None:
+                metadata = self._load_metadata()
+                metadata["last_daily_date"] = completed.isoformat()
+                self._save_metadata(metadata)
 
+    def _catch_up_daily(self, target: date) -> date:
+        """
+        生成一天的 daily summary，当天没有消息时跳过。
+        """
+        if HistoryLoader.count_date(self.bot_id, self.is_private, self.session_id, target):
             self.update_daily(target)
-
-            last_date = target
-
-            metadata["last_daily_date"] = (
-                target.isoformat()
-            )
-
-            self._save_metadata(metadata)
+        return target
 
     # ============================================================
     # Long Term
     # ============================================================
 
     def _sync_long_term(self) -> None:
+        """
+        把 last_long_date 之后的 daily summary 合并进长期摘要。
+
+        每 LONG_TERM_BATCH_DAYS 天调用一次 merge_summaries，而不是每天一次 merge_summary；
+        每批完成后保存长期摘要和 metadata。
+        """
 
         metadata = self._load_metadata()
 
@@ -406,42 +555,49 @@ class SummaryManager:
             if last_date is None:
                 return
 
-        daily_dates = sorted(
-            self.daily_dir.glob("*.txt")
-        )
-
-        for file in daily_dates:
-
+        pending: list[tuple[date, str]] = []
+        for file in sorted(self.daily_dir.glob("*.txt")):
             current = date.fromisoformat(
                 file.stem
             )
-
             if current <= last_date:
                 continue
-
             daily_summary = self._read_text(file)
+            if daily_summary:
+                pending.append((current, daily_summary))
 
-            if not daily_summary:
-                continue
+        for start in range(0, len(pending), self.LONG_TERM_BATCH_DAYS):
+            batch = pending[start:start + self.LONG_TERM_BATCH_DAYS]
+            if len(pending) > self.LONG_TERM_BATCH_DAYS:
+                print(f"[_sync_long_term] 合并 {batch[0][0]} ~ {batch[-1][0]}（{start + len(batch)}/{len(pending)}）")
 
             old = self.load_long_term()
 
             if old:
-                new = self.generator.merge_summary(
+                new = self.generator.merge_summaries(
                     old,
-                    daily_summary,
+                    [(current.isoformat(), daily_summary) for current, daily_summary in batch],
                 )
+            elif len(batch) == 1:
+                new = batch[0][1]
             else:
-                new = daily_summary
+                new = self.generator.merge_summaries(
+                    batch[0][1],
+                    [(current.isoformat(), daily_summary) for current, daily_summary in batch[1:]],
+                )
 
-            if new:
-                self._save_long_term(new)  # 确保融合后有实质内容再覆盖保存
+            if not new:
+                # 确保融合后有实质内容再覆盖保存，失败的批次留到下次 sync
+                break
 
-                metadata["last_long_date"] = (
-                    current.isoformat()
-                )
+            self._save_long_term(new)
 
-                self._save_metadata(metadata)
+            metadata = self._load_metadata()
+            metadata["last_long_date"] = (
+                batch[-1][0].isoformat()
+            )
+
+            self._save_metadata(metadata)
 
     # ============================================================
     # Metadata
@@ -477,7 +633,8 @@ class SummaryManager:
             data: dict,
     ) -> None:
 
-        self.metadata_path.write_text(
+        tmp_path = self.metadata_path.with_name(self.metadata_path.name + ".tmp")
+        tmp_path.write_text(
             json.dumps(
                 data,
                 ensure_ascii=False,
@@ -485,6 +642,7 @@ class SummaryManager:
             ),
             encoding="utf-8",
         )
+        os.replace(tmp_path, self.metadata_path)
 
     # ============================================================
     # Save
@@ -514,10 +672,10 @@ class SummaryManager:
     # ============================================================
     def _get_message_count(self) -> int:
         """
-        获取当前Session消息数量。
+        获取当前Session今天的消息数量。
 
-        建议直接从HistoryLogger metadata读取，
-        不要每次扫描文件。
+        HistoryLoader.count_today 读取 HistoryLogger 写入时维护的计数表，
+        每次回复后 sync 调用这里不会再扫描当天的文件。
         """
 
         return HistoryLoader.count_today(
@@ -562,8 +720,12 @@ class SummaryManager:
     def _write_text(path: Path, content: str) -> None:
         """
         写入文本文件。
+
+        先写临时文件再替换：SummaryWorker 在后台改写摘要时，ChatPipeline 读到的总是完整内容。
         """
-        path.write_text(content.strip(), encoding="utf-8")
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(content.strip(), encoding="utf-8")
+        os.replace(tmp_path, path)
 
 
 if __name__ == "__main__":
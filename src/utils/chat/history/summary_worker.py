@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from src.config.path import QQ_HISTORY_DIR
+from src.utils.chat.history.manage_summary import SummaryGenerator, SummaryManager
+from src.utils.chat.llm.run_prompt import PromptRunner
+
+logger = logging.getLogger(__name__)
+
+SessionKey = tuple[str, bool, str]
+
+
+class SummaryWorker:
+    """
+    后台 Summary 任务队列。
+
+    ChatPipeline 回复后只调用 submit 把 sync 放进队列就返回，
+    摘要相关的 LLM 调用（merge_summary、generate_recent_summary、逐日补 daily）都在这里执行：
+
+    - 每个 Session 一个任务队列，同一 Session 的任务按顺序执行，不会并发改写同一组摘要文件；
+    - 队列中已有相同的待执行任务时不再重复入队（连续回复只会触发一次 sync）；
+    - 不同 Session 之间并发执行，总并发数由 max_workers 限制；
+    - close 时把尚未完成的任务写入 summary_queue.json，下次启动 resume 后继续执行。
+
+    状态文件：
+
+        QQ_HISTORY_DIR/
+            bot_id/
+                summary_queue.json
+    """
+
+    STATE_FILE = "summary_queue.json"
+
+    # 允许排队的 SummaryManager 方法，均为无参数且可重复执行
+    JOB_KINDS = ("sync", "initialize_long_term", "rebuild_long_term")
+
+    def __init__(
+            self,
+            bot_id: str | int,
+            max_workers: int = 2,
+            manager_factory: Callable[[str, bool, str], SummaryManager] | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        bot_id
+            Bot QQ，决定状态文件位置。
+        max_workers
+            同时执行 Summary 任务的 Session 数上限。
+        manager_factory
+            resume 时为没有现成 SummaryManager 的 Session 创建实例，默认使用 PromptRunner。
+        """
+
+        self.bot_id = str(bot_id)
+        self.state_path = Path(QQ_HISTORY_DIR) / self.bot_id / self.STATE_FILE
+        self.manager_factory = manager_factory or self._default_manager
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="SummaryWorker")
+        self._lock = threading.Lock()
+        # 执行中的任务结束时通知 close
+        self._idle = threading.Condition(self._lock)
+        self._queues: dict[SessionKey, deque[str]] = {}
+        self._running: dict[SessionKey, str | None] = {}
+        self._managers: dict[SessionKey, SummaryManager] = {}
+        self._closed = False
+
+    # ==========================================================
+    # 对外接口
+    # ==========================================================
+
+    def submit(self, manager: SummaryManager, kind: str = "sync") -> bool:
+        """
+        为 manager 对应的 Session 排入一个任务
+
+        Returns
+        -------
+        bool
+            是否真正入队（相同任务已在等待、或 worker 已关闭时返回 False）
+        """
+
+        if kind not in self.JOB_KINDS:
+            raise ValueError(f"不支持的 Summary 任务: {kind}")
+
+        key = self._key(manager.bot_id, manager.is_private, manager.session_id)
+
+        with self._lock:
+            if self._closed:
+                return False
+
+            self._managers[key] = manager
+            queue = self._queues.setdefault(key, deque())
+
+            if kind in queue:
+                return False
+
+            queue.append(kind)
+
+            # 该 Session 没有在执行时才提交，正在执行的会在当前任务结束后继续取队列
+            if key not in self._running:
+                self._running[key] = None
+                self._executor.submit(self._drain, key)
+
+        return True
+
+    def pending(self) -> int:
+        """
+        等待中和执行中的任务数
+        """
+
+        with self._lock:
+            return (
+                    sum(len(queue) for queue in self._queues.values())
+                    + sum(1 for kind in self._running.values() if kind is not None)
+            )
+
+    def resume(self) -> int:
+        """
+        读取上次关闭时保存的任务并重新入队
+
+        Returns
+        -------
+        int
+            恢复的任务数
+        """
+
+        if not self.state_path.exists():
+            return 0
+
+        try:
+            jobs = json.loads(self.state_path.read_text(encoding="utf-8")).get("jobs", [])
+        except (OSError, json.JSONDecodeError):
+            logger.exception("读取 Summary 队列状态失败: %s", self.state_path)
+            return 0
+
+        resumed = 0
+        for job in jobs:
+            key = self._key(job["bot_id"], job["is_private"], job["session_id"])
+            manager = self._managers.get(key) or self.manager_factory(*key)
+            if self.submit(manager, job.get("kind", "sync")):
+                resumed += 1
+
+        self.state_path.unlink(missing_ok=True)
+        logger.info("已恢复 %d 个 Summary 任务", resumed)
+        return resumed
+
+    def close(self, wait: bool = False, timeout: float | None = None) -> None:
+        """
+        停止接收任务，保存未完成的任务
+
+        排队中的任务不再执行，直接写入状态文件，下次启动 resume 后继续。
+
+        Parameters
+        ----------
+        wait
+            是否等待正在执行的任务完成。不等待（或等待超时）时，执行中的任务也会写入状态文件，
+            下次启动重新执行（sync 可重复执行，结果由 metadata.json 判断）。
+        timeout
+            wait 时最多等待的秒数，None 表示一直等
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            queued = {key: list(queue) for key, queue in self._queues.items()}
+            self._queues.clear()
+
+        # 取消还没开始的 Session；已经在执行的任务做完当前这一个就停止
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+        with self._lock:
+            if wait:
+                self._idle.wait_for(
+                    lambda: all(kind is None for kind in self._running.values()),
+                    timeout,
+                )
+
+            jobs = []
+            for key in set(self._running) | set(queued):
+                kinds = queued.get(key, [])
+                running = self._running.get(key)
+                if running is not None and running not in kinds:
+                    kinds.insert(0, running)
+                bot_id, is_private, session_id = key
+                jobs.extend(
+                    {"bot_id": bot_id, "is_private": is_private, "session_id": session_id, "kind": kind}
+                    for kind in kinds
+                )
+
+        self._save_state(jobs)
+
+    # ==========================================================
+    # 执行
+    # ==========================================================
+
+    def _drain(self, key: SessionKey) -> None:
+        """
+        依次执行一个 Session 的任务，直到队列为空
+        """
+
+        while True:
+            with self._lock:
+                queue = self._queues.get(key)
+                if self._closed or not queue:
+                    self._running.pop(key, None)
+                    self._queues.pop(key, None)
+                    return
+                kind = queue.popleft()
+                self._running[key] = kind
+                manager = self._managers[key]
+
+            try:
+                getattr(manager, kind)()
+            except Exception:
+                logger.exception("Summary 任务失败: %s %s", kind, key)
+
+            with self._lock:
+                if key in self._running:
+                    self._running[key] = None
+                self._idle.notify_all()
+
+    def _save_state(self, jobs: list[dict]) -> None:
+        if not jobs:
+            self.state_path.unlink(missing_ok=True)
+            return
+
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".json.tmp")
+        tmp_path.write_text(
+            json.dumps({"jobs": jobs}, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+        os.replace(tmp_path, self.state_path)
+        logger.info("已保存 %d 个未完成的 Summary 任务", len(jobs))
+
+    @staticmethod
+    def _key(bot_id: str | int, is_private: bool, session_id: str | int) -> SessionKey:
+        return str(bot_id), bool(is_private), str(session_id)
+
+    @staticmethod
+    def _default_manager(bot_id: str, is_private: bool, session_id: str) -> SummaryManager:
+        return SummaryManager(
+            bot_id=bot_id,
+            is_private=is_private,
+            session_id=session_id,
+            generator=SummaryGenerator(PromptRunner(caller="summary")),
+        )
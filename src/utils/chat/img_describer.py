@@ -1,12 +1,15 @@
 import base64
-import requests
+import hashlib
 from pathlib import Path
+from typing import Protocol
 import dashscope
 from dashscope import MultiModalConversation
 import io
 from src.config.path import API_KEY_DIR
 from src.utils.chat.model_type import LLMModelType
+from src.utils.tools.fetcher import MediaFetcher
 from src.utils.tools.file import load_from_txt
+from src.utils.tools.metrics import ModelCallMetrics
 from PIL import Image
 
 
@@ -57,9 +60,30 @@ class ImageResizer:
         return image
 
 
+class ImageDescriptionCacheLike(Protocol):
+    """描述缓存需要提供的最小接口（见 ImageDescriptionCache）。"""
+
+    def get(self, sha256: str, model: str, prompt_version: str) -> str | None:
+        ...
+
+    def put(self, sha256: str, model: str, prompt_version: str, description: str) -> None:
+        ...
+
+
 class ImageDescriber:
+    DESCRIBE_PROMPT = """
+请分析这张图片，并生成适合作为聊天上下文的图片描述。
+要求：
+1. 说明图片类型（照片、动漫、表情包、截图、风景、游戏画面等）。
+2. 描述图片中的人物、动物、物体、场景、动作、表情、服装、环境等可见信息。
+3. 如果图中人物存在明显情绪或表情，请说明。
+4. 如果存在文字，请完整地提取文字内容，不要遗漏
+5. 不要分析，不要评价，不要推测用户意图。客观描述图片中实际出现的内容，不要编造不存在的信息。
+6. 使用一段简洁自然语言描述，控制在150字以内（但注意OCR内容不计入字数中，也就是即使OCR出来的文字很长，也全部输出）。
+"""
+
     def __init__(self, api_key: str | None = None, model: str = LLMModelType.QWEN_VL_PLUS.value,
-                 max_pixels: int = 768 * 768):
+                 max_pixels: int = 768 * 768, cache: ImageDescriptionCacheLike | None = None):
         if api_key is not None:
             dashscope.api_key = api_key
         else:
@@ -67,12 +91,40 @@ class ImageDescriber:
 
         self.model = model
         self.max_pixels = max_pixels
+        # 按图片 SHA256 缓存描述；同一张表情包再次出现时不再调用 VLM
+        self.cache = cache
+
+    @property
+    def prompt_version(self) -> str:
+        """
+        提示词与预处理参数的指纹，任一变化都会让缓存中的旧描述失效
+        """
+        key = f"{self.DESCRIBE_PROMPT}\n{self.max_pixels}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
 
     def describe_img(self, image_url: str) -> str:
         # 兼容 URL 与本地路径；消息链路上图片已由 ImageStorage 落盘时，
         # 直接读本地文件可以省掉一次重复下载。
-        image_base64 = self._image_url_to_base64(image_url=image_url)
+        return self.describe_bytes(self._load_bytes(image_url))
 
+    def describe_bytes(self, data: bytes) -> str:
+        # MediaPipeline 已经下载好图片时直接用内存中的字节，不再读文件或下载。
+        if self.cache is None:
+            return self._describe_base64(self._image_to_base64(Image.open(io.BytesIO(data))))
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        prompt_version = self.prompt_version
+
+        cached = self.cache.get(sha256, self.model, prompt_version)
+        if cached is not None:
+            return cached
+
+        description = self._describe_base64(self._image_to_base64(Image.open(io.BytesIO(data))))
+        if description:
+            self.cache.put(sha256, self.model, prompt_version, description)
+        return description
+
+    def _describe_base64(self, image_base64: str) -> str:
         messages = [
             {
                 "role": "user",
@@ -81,37 +133,29 @@ class ImageDescriber:
                         "image": image_base64
                     },
                     {
-                        "text":
-                            """
-请分析这张图片，并生成适合作为聊天上下文的图片描述。
-要求：
-1. 说明图片类型（照片、动漫、表情包、截图、风景、游戏画面等）。
-2. 描述图片中的人物、动物、物体、场景、动作、表情、服装、环境等可见信息。
-3. 如果图中人物存在明显情绪或表情，请说明。
-4. 如果存在文字，请完整地提取文字内容，不要遗漏
-5. 不要分析，不要评价，不要推测用户意图。客观描述图片中实际出现的内容，不要编造不存在的信息。
-6. 使用一段简洁自然语言描述，控制在150字以内（但注意OCR内容不计入字数中，也就是即使OCR出来的文字很长，也全部输出）。
-"""
+                        "text": self.DESCRIBE_PROMPT
                     }
                 ]
             }
         ]
 
-        response = MultiModalConversation.call(model=self.model, messages=messages)
+        with ModelCallMetrics.track("vlm", self.model) as call:
+            response = MultiModalConversation.call(model=self.model, messages=messages)
+            call.usage = response.usage
 
-        if response.status_code != 200:
-            raise RuntimeError(f"图片识别失败: {response.message}")
+            if response.status_code != 200:
+                raise RuntimeError(f"图片识别失败: {response.message}")
 
         return response.output.choices[0].message.content[0]["text"]
 
-    def _image_url_to_base64(self, image_url: str) -> str:
+    @staticmethod
+    def _load_bytes(image_url: str) -> bytes:
         path = Path(image_url)
         if path.is_file():
-            image = Image.open(path)
-        else:
-            response = requests.get(image_url, timeout=20)
-            response.raise_for_status()
-            image = Image.open(io.BytesIO(response.content))
+            return path.read_bytes()
+        return MediaFetcher.fetch(image_url)
+
+    def _image_to_base64(self, image: Image.Image) -> str:
         image = ImageResizer.preprocess(image=image, max_pixels=self.max_pixels)
         buffer = io.BytesIO()
         image.save(buffer, format="JPEG", quality=90, optimize=True)
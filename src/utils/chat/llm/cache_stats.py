@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    hit_tokens: int = 0
+    miss_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hit_tokens + self.miss_tokens
+        return self.hit_tokens / total if total else 0.0
+
+
+class PromptCacheStats:
+    """
+    按会话统计服务端上下文缓存（DeepSeek 前缀缓存）的命中情况。
+
+    从每次调用返回的 usage 中读取：
+
+        - DeepSeek：prompt_cache_hit_tokens / prompt_cache_miss_tokens；
+        - OpenAI 兼容接口：prompt_tokens_details.cached_tokens。
+
+    同进程所有会话登记在类级注册表中，可用 PromptCacheStats.summary() 汇总。
+
+    用法：
+
+        stats = PromptCacheStats.for_session("1121221045/group/1039857271")
+        llm = LLMDSAPI(model=..., on_usage=stats.record)
+    """
+
+    _lock = threading.Lock()
+    _sessions: dict[str, PromptCacheStats] = {}
+
+    def __init__(self, session_key: str):
+        self.session_key = session_key
+        self.usage = CacheUsage()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_session(cls, session_key: str) -> PromptCacheStats:
+        with cls._lock:
+            stats = cls._sessions.get(session_key)
+            if stats is None:
+                stats = cls(session_key)
+                cls._sessions[session_key] = stats
+            return stats
+
+    @classmethod
+    def summary(cls) -> dict[str, CacheUsage]:
+        """
+        所有会话的统计快照，键为会话，另含合计项 "*"
+        """
+
+        with cls._lock:
+            sessions = list(cls._sessions.values())
+
+        result = {"*": CacheUsage()}
+        total = result["*"]
+        for stats in sessions:
+            snapshot = stats.snapshot()
+            result[stats.session_key] = snapshot
+            total.calls += snapshot.calls
+            total.prompt_tokens += snapshot.prompt_tokens
+            total.hit_tokens += snapshot.hit_tokens
+            total.miss_tokens += snapshot.miss_tokens
+            total.completion_tokens += snapshot.completion_tokens
+        return result
+
+    def snapshot(self) -> CacheUsage:
+        with self._lock:
+            return CacheUsage(**vars(self.usage))
+
+    def record(self, usage) -> None:
+        """
+        记录一次调用的 usage（openai 的 CompletionUsage，缺失时忽略）
+        """
+
+        if usage is None:
+            return
+
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+
+        hit = getattr(usage, "prompt_cache_hit_tokens", None)
+        miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        if hit is None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            hit = getattr(details, "cached_tokens", 0) or 0
+            miss = prompt_tokens - hit
+        miss = miss if miss is not None else prompt_tokens - hit
+
+        with self._lock:
+            self.usage.calls += 1
+            self.usage.prompt_tokens += prompt_tokens
+            self.usage.hit_tokens += hit
+            self.usage.miss_tokens += miss
+            self.usage.completion_tokens += completion_tokens
+            hit_rate = self.usage.hit_rate
+
+        logger.info(
+            "[PromptCache] %s 本次命中 %d / 未命中 %d，会话累计命中率 %.1f%%",
+            self.session_key, hit, miss, hit_rate * 100,
+        )
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from pathlib import Path
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from src.config.path import API_KEY_DIR
+from src.utils.tools.file import load_from_txt
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+
+class LLMClientPool:
+    """
+    进程级 OpenAI 兼容客户端注册表。
+
+    同一个 (base_url, api_key) 只创建一个同步客户端，所有 LLMDSAPI、PromptRunner、
+    ChatDSAPI、DeepSeekClient、EmojiDecider 共用它底层 httpx 的 keep-alive 连接池，
+    几百个会话也只占用少量长连接。
+
+    异步客户端（AsyncOpenAI）的连接绑定在创建它的事件循环上，所以按事件循环各建一个，
+    bot 运行时只有一个事件循环，实际上同样每个 base_url 只有一个。
+
+    用法：
+
+        client = LLMClientPool.get(base_url, api_key_path)
+        async_client = LLMClientPool.get_async(base_url, api_key_path)
+    """
+
+    # 每个 base_url 的连接池上限
+    MAX_CONNECTIONS = 20
+    MAX_KEEPALIVE_CONNECTIONS = 10
+    KEEPALIVE_EXPIRY = 30.0
+
+    _lock = threading.Lock()
+    _api_keys: dict[Path, str] = {}
+    _clients: dict[tuple[str, str], OpenAI] = {}
+    _async_clients: dict[tuple[str, str], weakref.WeakKeyDictionary] = {}
+
+    # ==========================================================
+    # 对外接口
+    # ==========================================================
+
+    @classmethod
+    def get(
+            cls,
+            base_url: str = DEEPSEEK_BASE_URL,
+            api_key_path: str | Path | None = None,
+    ) -> OpenAI:
+        """
+        获取共享的同步客户端（线程安全，可在 run_in_executor 的线程中并发使用）
+
+        Parameters
+        ----------
+        base_url
+            API 地址。
+        api_key_path
+            API Key 文件，默认 API_KEY_DIR/deepseek.txt。
+        """
+
+        key = cls._key(base_url, api_key_path)
+
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is None:
+                client = OpenAI(
+                    api_key=key[1],
+                    base_url=base_url,
+                    http_client=DefaultHttpxClient(limits=cls._limits()),
+                )
+                cls._clients[key] = client
+            return client
+
+    @classmethod
+    def get_async(
+            cls,
+            base_url: str = DEEPSEEK_BASE_URL,
+            api_key_path: str | Path | None = None,
+    ) -> AsyncOpenAI:
+        """
+        获取当前事件循环共享的异步客户端，必须在协程中调用
+        """
+
+        key = cls._key(base_url, api_key_path)
+        loop = asyncio.get_running_loop()
+
+        with cls._lock:
+            clients = cls._async_clients.setdefault(key, weakref.WeakKeyDictionary())
+            client = clients.get(loop)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=key[1],
+                    base_url=base_url,
+                    http_client=DefaultAsyncHttpxClient(limits=cls._limits()),
+                )
+                clients[loop] = client
+            return client
+
+    @classmethod
+    def close(cls) -> None:
+        """
+        关闭所有客户端及其连接池；bot 退出时由 BotManager.close 调用
+        """
+
+        with cls._lock:
+            clients = list(cls._clients.values())
+            async_clients = [
+                (loop, client)
+                for by_loop in cls._async_clients.values()
+                for loop, client in by_loop.items()
+            ]
+            cls._clients.clear()
+            cls._async_clients.clear()
+
+        for client in clients:
+            client.close()
+
+        for loop, client in async_clients:
+            # 事件循环已经结束运行时还能借它关闭连接；正在运行或已关闭的循环直接丢弃
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(client.close())
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    @classmethod
+    def _key(cls, base_url: str, api_key_path: str | Path | None) -> tuple[str, str]:
+        if api_key_path is None:
+            api_key_path = Path(API_KEY_DIR) / "deepseek.txt"
+        api_key_path = Path(api_key_path)
+
+        with cls._lock:
+            api_key = cls._api_keys.get(api_key_path)
+            if api_key is None:
+                api_key = load_from_txt(api_key_path)
+                cls._api_keys[api_key_path] = api_key
+
+        return base_url, api_key
+
+    @classmethod
+    def _limits(cls) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=cls.MAX_CONNECTIONS,
+            max_keepalive_connections=cls.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=cls.KEEPALIVE_EXPIRY,
+        )
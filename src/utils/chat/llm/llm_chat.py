@@ -1,10 +1,11 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable
 from pathlib import Path
-from openai import OpenAI
 
-from src.config.path import API_KEY_DIR
+from src.utils.chat.llm.client_pool import DEEPSEEK_BASE_URL, LLMClientPool
 from src.utils.chat.manager.conversation import ConversationManager
 from src.utils.chat.model_type import LLMModelType
-from src.utils.tools.file import load_from_txt
+from src.utils.tools.metrics import ModelCallMetrics
 
 
 class LLMDSAPI:
@@ -23,6 +24,13 @@ class LLMDSAPI:
         - Conversation
         - Role
         - History
+
+    客户端来自 LLMClientPool，所有实例共享同一个连接池，创建本类不再新建 HTTP 客户端。
+    one_chat / one_chat_raw 是同步接口，one_chat_async / one_chat_raw_async 供事件循环直接 await，
+    one_chat_stream 以流式返回回答的增量文本。
+
+    每次调用的耗时与 usage 以 caller 为 stage 记入 ModelCallMetrics（流式调用通过 include_usage 取得 usage）；
+    传入 on_usage 时另外以 usage 回调，用于按会话统计上下文缓存命中。
     """
 
     def __init__(
@@ -33,7 +41,9 @@ class LLMDSAPI:
             response_format: dict | None = None,
             api_key_path: str | Path | None = None,
             temperature: float = 1.3,
-            max_tokens: int = 8192
+            max_tokens: int = 8192,
+            on_usage: Callable[[object], None] | None = None,
+            caller: str = "llm",
     ):
         """
         Parameters
@@ -59,15 +69,17 @@ class LLMDSAPI:
             注意：
                 DeepSeek 思考模式下 temperature 不生效，
                 这里只用于非思考模式。
-        """
 
-        if api_key_path is None:
-            api_key_path = Path(API_KEY_DIR) / "deepseek.txt"
+        on_usage
+            每次调用结束后接收 response.usage 的回调。
 
-        self.client = OpenAI(
-            api_key=load_from_txt(api_key_path),
-            base_url="https://api.deepseek.com",
-        )
+        caller
+            调用方标签，作为 ModelCallMetrics 的 stage。
+        """
+
+        self.base_url = DEEPSEEK_BASE_URL
+        self.api_key_path = api_key_path
+        self.client = LLMClientPool.get(self.base_url, self.api_key_path)
         if isinstance(model, LLMModelType):
             self.model = model.value
         elif isinstance(model, str):
@@ -79,6 +91,8 @@ class LLMDSAPI:
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.response_format = response_format
+        self.on_usage = on_usage
+        self.caller = caller
 
     # ------------------------------------------------------------------
 
@@ -101,6 +115,15 @@ class LLMDSAPI:
 
         return message.content or ""
 
+    async def one_chat_async(self, messages: list[dict]) -> str:
+        """
+        one_chat 的异步版本。
+        """
+
+        message = await self.one_chat_raw_async(messages)
+
+        return message.content or ""
+
     # ------------------------------------------------------------------
 
     def one_chat_raw(self, messages: list[dict]):
@@ -114,10 +137,74 @@ class LLMDSAPI:
         ChatCompletionMessage
         """
 
+        with ModelCallMetrics.track(self.caller, self.model) as call:
+            response = self.client.chat.completions.create(**self._build_kwargs(messages))
+            call.usage = response.usage
+        self._report_usage(response.usage)
+
+        return response.choices[0].message
+
+    async def one_chat_raw_async(self, messages: list[dict]):
+        """
+        one_chat_raw 的异步版本，使用当前事件循环共享的 AsyncOpenAI。
+
+        Returns
+        -------
+        ChatCompletionMessage
+        """
+
+        client = LLMClientPool.get_async(self.base_url, self.api_key_path)
+        with ModelCallMetrics.track(self.caller, self.model) as call:
+            response = await client.chat.completions.create(**self._build_kwargs(messages))
+            call.usage = response.usage
+        self._report_usage(response.usage)
+
+        return response.choices[0].message
+
+    async def one_chat_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """
+        流式聊天，逐段产出模型回答（content）的增量文本。
+
+        思考模式下的 reasoning_content 不会产出；提前停止迭代时关闭底层连接。
+
+        Yields
+        ------
+        str
+            非空的增量文本。
+        """
+
+        client = LLMClientPool.get_async(self.base_url, self.api_key_path)
+
+        # 块内有 yield，span 在流结束时补记，不跨 yield 占用 contextvar
+        with ModelCallMetrics.track(self.caller, self.model, stream=True) as call:
+            stream = await client.chat.completions.create(**self._build_kwargs(messages, stream=True))
+
+            try:
+                async for chunk in stream:
+                    # include_usage 时最后一个 chunk 只有 usage、没有 choices
+                    if chunk.usage is not None:
+                        call.usage = chunk.usage
+                        self._report_usage(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        call.mark_first_token()
+                        yield delta
+            finally:
+                await stream.close()
+
+    # ------------------------------------------------------------------
+
+    def _build_kwargs(self, messages: list[dict], stream: bool = False) -> dict:
+        """
+        构造 chat.completions.create 的参数，同步、异步和流式接口共用。
+        """
+
         kwargs = {
             "model": self.model,
             "messages": messages,
-            "stream": False,
+            "stream": stream,
         }
 
         # --------------------------
@@ -146,9 +233,19 @@ class LLMDSAPI:
         if isinstance(self.max_tokens, int) and self.max_tokens > 0:
             kwargs["max_tokens"] = self.max_tokens
 
-        response = self.client.chat.completions.create(**kwargs)
+        if stream:
+            kwargs["stream_options"] = {"include_usage": True}
 
-        return response.choices[0].message
+        return kwargs
+
+    def _report_usage(self, usage) -> None:
+        if self.on_usage is None or usage is None:
+            return
+        try:
+            self.on_usage(usage)
+        except Exception as e:
+            # 统计失败不影响回复
+            print(f"[LLMDSAPI] usage 回调失败: {e}")
 
 
 def test1(prompt):
@@ -193,7 +290,38 @@ def test2(prompt):
     conv.add_assistant(reply)
 
 
+async def test3(prompt):
+    llm = LLMDSAPI(
+        model=LLMModelType.DS_FLASH,
+    )
+
+    # 同一事件循环里的并发请求共用一个 AsyncOpenAI 的连接池
+    replies = await asyncio.gather(*(
+        llm.one_chat_async([
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": query},
+        ])
+        for query in ("你好", "今天星期几", "唱首歌吧")
+    ))
+    print(replies)
+
+
+async def test4(prompt):
+    llm = LLMDSAPI(
+        model=LLMModelType.DS_FLASH,
+    )
+
+    async for delta in llm.one_chat_stream([
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": "介绍一下你自己"},
+    ]):
+        print(delta, end="", flush=True)
+    print()
+
+
 if __name__ == "__main__":
     prompt = "你是洛天依"
     test1(prompt)
     test2(prompt)
+    asyncio.run(test3(prompt))
+    asyncio.run(test4(prompt))
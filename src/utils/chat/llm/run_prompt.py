@@ -27,21 +27,28 @@ class PromptRunner:
         - Conversation Memory
         - Prompt 拼接
         - 文件管理
+
+    底层 LLMDSAPI 共用 LLMClientPool 的连接池，可以随用随建。
     """
 
     def __init__(
             self,
             model: LLMModelType = LLMModelType.DS_FLASH,
+            caller: str = "prompt",
     ) -> None:
         """
         Parameters
         ----------
         model
             默认模型。
+
+        caller
+            调用方标签，用于 ModelCallMetrics 按用途统计（例如 summary）。
         """
 
         self._llm = LLMDSAPI(
             model=model,
+            caller=caller,
         )
 
     def run(
@@ -66,6 +73,44 @@ class PromptRunner:
             LLM 返回结果。
         """
 
+        messages = self._build_messages(system_prompt, user_prompt)
+        if messages is None:
+            return ""
+
+        reply = self._llm.one_chat(
+            messages,
+        )
+
+        return reply.strip()
+
+    async def run_async(
+            self,
+            system_prompt: str,
+            user_prompt: str,
+    ) -> str:
+        """
+        run 的异步版本。
+        """
+
+        messages = self._build_messages(system_prompt, user_prompt)
+        if messages is None:
+            return ""
+
+        reply = await self._llm.one_chat_async(
+            messages,
+        )
+
+        return reply.strip()
+
+    @staticmethod
+    def _build_messages(
+            system_prompt: str,
+            user_prompt: str,
+    ) -> list[dict] | None:
+        """
+        构造一次性 Prompt 的 messages，user_prompt 为空时返回 None。
+        """
+
         system_prompt = system_prompt.strip()
         user_prompt = user_prompt.strip()
 
@@ -73,7 +118,7 @@ class PromptRunner:
             raise ValueError("system_prompt 不能为空。")
 
         if not user_prompt:
-            return ""
+            return None
 
         conv = ConversationManager(
             system_prompt=system_prompt,
@@ -82,8 +127,4 @@ class PromptRunner:
 
         conv.add_user(user_prompt)
 
-        reply = self._llm.one_chat(
-            conv.messages,
-        )
-
-        return reply.strip()
+        return conv.messages
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from src.config.QQ_bot_info_loader import BotContext
+from src.utils.chat.prompt.load_prompt import KnowledgeItem
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    """
+    token 计数。
+
+    安装了 tiktoken 且编码可用时用 cl100k_base（与 DeepSeek 分词器不完全一致，误差在预算余量内）；
+    否则按字符估算：中日韩字符约 1 token，其余字符约 0.3 token。
+    """
+
+    ENCODING = "cl100k_base"
+
+    _lock = threading.Lock()
+    _encoding = None
+    _loaded = False
+
+    @classmethod
+    def count(cls, text: str) -> int:
+        if not text:
+            return 0
+        encoding = cls._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return int(sum(cls._char_cost(ch) for ch in text) + 0.999)
+
+    @classmethod
+    def truncate(cls, text: str, max_tokens: int, keep: str = "head") -> str:
+        """
+        截断到 max_tokens 以内
+
+        Parameters
+        ----------
+        keep
+            head：保留开头；tail：保留结尾
+        """
+
+        if max_tokens <= 0 or not text:
+            return ""
+        if cls.count(text) <= max_tokens:
+            return text
+
+        encoding = cls._get_encoding()
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            tokens = tokens[:max_tokens] if keep == "head" else tokens[-max_tokens:]
+            return encoding.decode(tokens)
+
+        chars = text if keep == "head" else reversed(text)
+        kept = []
+        total = 0.0
+        for ch in chars:
+            total += cls._char_cost(ch)
+            if total > max_tokens:
+                break
+            kept.append(ch)
+        return "".join(kept) if keep == "head" else "".join(reversed(kept))
+
+    @staticmethod
+    def _char_cost(ch: str) -> float:
+        return 1.0 if ord(ch) >= 0x2E80 else 0.3
+
+    @classmethod
+    def _get_encoding(cls):
+        if cls._loaded:
+            return cls._encoding
+        with cls._lock:
+            if not cls._loaded:
+                try:
+                    import tiktoken
+                    cls._encoding = tiktoken.get_encoding(cls.ENCODING)
+                except Exception as e:
+                    # 未安装，或离线环境下无法下载编码文件
+                    logger.info("[TokenCounter] tiktoken 不可用，按字符估算 token：%s", e)
+                    cls._encoding = None
+                cls._loaded = True
+        return cls._encoding
+
+
+@dataclass
+class AssembledContext:
+    system_prompt: str
+    # 放入上下文的历史消息（按时间顺序，最后一条为当前 user）
+    history: list[dict]
+    # stable_prefix 布局下拼在当前 user 消息前的记忆与知识片段
+    context_block: str = ""
+    # 各部分 token 数
+    usage: dict[str, int] = field(default_factory=dict)
+    # 被截断或丢弃内容的部分
+    truncated: list[str] = field(default_factory=list)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.usage.values())
+
+
+class ContextAssembler:
+    """
+    按 token 预算拼接上下文。
+
+    必须保留：角色设定（system）与当前 user 消息。其余部分按 BotContext.sections 的顺序（即优先级）
+    依次分配剩余预算，每部分不超过自己的上限：
+
+        - short_term：近期记忆，超出时保留结尾（最新的内容）；
+        - long_term：长期记忆，超出时保留开头；
+        - knowledge：知识条目的摘要与片段，按检索给出的相关度顺序逐段放入，放不下的片段跳过；
+        - history：历史消息，从最新往前逐条放入。
+
+    布局（BotContext.layout）：
+
+        - classic：记忆与知识片段都拼进 system prompt；
+        - stable_prefix：system prompt 只含角色设定与完整知识目录，记忆与知识片段拼在当前 user 消息之前。
+          system 与更早的历史在相邻两次请求之间保持逐字相同，可以命中服务端的前缀缓存
+          （DeepSeek 上下文硬盘缓存按请求前缀匹配，命中部分按缓存价格计费）。
+
+    每次拼接记录一条各部分 token 用量的日志。
+    """
+
+    # 每条消息的格式开销
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(self, config: BotContext, model: str):
+        self.config = config
+        self.model = model
+        self.budget = config.budgets.get(model, config.default_budget)
+
+    def assemble(
+            self,
+            base_prompt: str,
+            memory: dict | None,
+            knowledge: dict[str, KnowledgeItem] | None,
+            history: list[dict],
+            passage_order: dict[str, list[int]] | None = None,
+            knowledge_index: str = "",
+    ) -> AssembledContext:
+        """
+        Parameters
+        ----------
+        base_prompt
+            角色设定
+        memory
+            {"long_term": str, "short_term": str}
+        knowledge
+            选中的知识条目（按相关度排序）
+        history
+            按时间顺序的 user/assistant 消息，最后一条为当前 user
+        passage_order
+            {条目名: 片段序号}，缺省时按原文顺序
+        knowledge_index
+            完整知识目录（KnowledgeRetriever.render_index），只在 stable_prefix 布局下放入 system
+        """
+
+        stable = self.config.layout == "stable_prefix"
+
+        usage = {"system": TokenCounter.count(base_prompt) + self.MESSAGE_OVERHEAD}
+        truncated = []
+
+        current = history[-1:] if history else []
+        usage["current"] = self._messages_tokens(current)
+
+        remaining = self.budget - usage["system"] - usage["current"]
+
+        # 知识目录属于不变前缀，只受总预算限制，不参与各部分的分配
+        if stable and knowledge_index:
+            index_header = "\n\n知识目录:\n"
+            index_text = TokenCounter.truncate(
+                knowledge_index, remaining - TokenCounter.count(index_header), keep="head"
+            )
+            if index_text != knowledge_index:
+                truncated.append("knowledge_index")
+            knowledge_index = index_header + index_text if index_text else ""
+            usage["knowledge_index"] = TokenCounter.count(knowledge_index)
+            remaining -= usage["knowledge_index"]
+        else:
+            knowledge_index = ""
+
+        sections: dict[str, str] = {}
+        kept_history: list[dict] = []
+        knowledge_stats = history_stats = ""
+
+        for name, cap in self.config.sections.items():
+            limit = max(0, min(cap, remaining))
+
+            if name in ("short_term", "long_term"):
+                text = ((memory or {}).get(name) or "").strip()
+                if not text:
+                    continue
+                header = "近期记忆：\n" if name == "short_term" else "长期记忆：\n"
+                body = TokenCounter.truncate(
+                    text,
+                    limit - TokenCounter.count(header),
+                    keep="tail" if name == "short_term" else "head",
+                )
+                if body != text:
+                    truncated.append(name)
+                if body:
+                    sections[name] = header + body
+
+            elif name == "knowledge":
+                if not knowledge:
+                    continue
+                sections[name], used_passages, total_passages = self._fit_knowledge(
+                    knowledge, passage_order or {}, limit
+                )
+                knowledge_stats = f"（片段 {used_passages}/{total_passages}）"
+                if used_passages < total_passages:
+                    truncated.append(name)
+
+            elif name == "history":
+                kept_history = self._fit_history(history[:-1], limit)
+                history_stats = f"（消息 {len(kept_history)}/{max(0, len(history) - 1)}）"
+                if len(kept_history) < len(history) - 1:
+                    truncated.append(name)
+                usage[name] = self._messages_tokens(kept_history)
+                remaining -= usage[name]
+                continue
+
+            else:
+                continue
+
+            usage[name] = TokenCounter.count(sections.get(name, ""))
+            remaining -= usage[name]
+
+        context_block = self._render_context(sections)
+        if stable:
+            system_prompt = base_prompt + knowledge_index
+            if context_block and current:
+                content = f"【参考信息】\n{context_block}\n\n【当前消息】\n{current[0]['content']}"
+                current = [{**current[0], "content": content}]
+        else:
+            system_prompt = base_prompt + (f"\n\n{context_block}" if context_block else "")
+            context_block = ""
+
+        logger.info(
+            "[ContextAssembler] %s 预算 %d，使用 %d：%s%s%s",
+            self.model,
+            self.budget,
+            sum(usage.values()),
+            "，".join(f"{name}={tokens}" for name, tokens in usage.items()),
+            f" knowledge{knowledge_stats}" if knowledge_stats else "",
+            f" history{history_stats}" if history_stats else "",
+        )
+        if truncated:
+            logger.info("[ContextAssembler] 超出预算被截断：%s", "、".join(truncated))
+
+        return AssembledContext(
+            system_prompt=system_prompt,
+            history=kept_history + current,
+            context_block=context_block,
+            usage=usage,
+            truncated=truncated,
+        )
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    def _fit_knowledge(
+            self,
+            knowledge: dict[str, KnowledgeItem],
+            passage_order: dict[str, list[int]],
+            limit: int,
+    ) -> tuple[str, int, int]:
+        blocks = []
+        used_tokens = 0
+        used_passages = total_passages = 0
+
+        for name, item in knowledge.items():
+            passages = item.passages or ([item.content] if item.content else [])
+            total_passages += len(passages)
+
+            header = f"【{item.name}】{item.summary}".strip()
+            header_tokens = TokenCounter.count(header) + 1
+            if used_tokens + header_tokens > limit:
+                continue
+
+            order = [i for i in passage_order.get(name, []) if 0 <= i < len(passages)]
+            order += [i for i in range(len(passages)) if i not in order]
+
+            chosen = []
+            block_tokens = header_tokens
+            for i in order:
+                tokens = TokenCounter.count(passages[i]) + 1
+                if used_tokens + block_tokens + tokens > limit:
+                    continue
+                chosen.append(i)
+                block_tokens += tokens
+
+            if not chosen:
+                continue
+
+            # 片段按原文顺序放回，保持上下文连贯
+            blocks.append("\n".join([header, *(passages[i] for i in sorted(chosen))]))
+            used_tokens += block_tokens
+            used_passages += len(chosen)
+
+        return "\n\n".join(blocks), used_passages, total_passages
+
+    def _fit_history(self, history: list[dict], limit: int) -> list[dict]:
+        kept = []
+        used = 0
+        for message in reversed(history):
+            tokens = self._messages_tokens([message])
+            if used + tokens > limit:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+        return kept
+
+    def _messages_tokens(self, messages: list[dict]) -> int:
+        return sum(
+            TokenCounter.count(str(message.get("content") or "")) + self.MESSAGE_OVERHEAD
+            for message in messages
+        )
+
+    @staticmethod
+    def _render_context(sections: dict[str, str]) -> str:
+        parts = []
+
+        memory = [sections[name] for name in ("long_term", "short_term") if sections.get(name)]
+        if memory:
+            parts.append("以下是历史记忆:\n" + "\n\n".join(memory))
+
+        if sections.get("knowledge"):
+            parts.append(f"以下是相关知识:\n{sections['knowledge']}")
+
+        return "\n\n".join(parts)
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import re
 from dataclasses import dataclass, field
 from pathlib import Path
 
@@ -156,6 +157,8 @@ class KnowledgeItem:
     tags: list[str] = field(default_factory=list)
     # Prompt正文
     content: str = ""
+    # 正文按段落切成的片段（加载时生成），供向量检索和按 token 预算拼接上下文
+    passages: list[str] = field(default_factory=list)
 
 
 class KnowledgeLoader:
@@ -180,10 +183,15 @@ class KnowledgeLoader:
     }
 
     每个角色仅加载一次，并缓存到内存。
+
+    正文在加载时切成 passages，每段不超过 PASSAGE_CHARS 字。
     """
 
     KNOWLEDGE_DIR_NAME = "knowledge"
 
+    # 片段目标长度（字）
+    PASSAGE_CHARS = 300
+
     _cache: dict[str, dict[str, KnowledgeItem]] = {}
 
     @classmethod
@@ -225,8 +233,9 @@ class KnowledgeLoader:
 
         return knowledge
 
-    @staticmethod
+    @classmethod
     def _load_file(
+            cls,
             file_path: Path,
     ) -> KnowledgeItem:
         """
@@ -282,8 +291,60 @@ class KnowledgeLoader:
             summary=str(metadata.get("summary", "")),
             tags=list(metadata.get("tags", [])),
             content=content,
+            passages=cls.split_passages(content, cls.PASSAGE_CHARS),
         )
 
+    @staticmethod
+    def split_passages(
+            content: str,
+            max_chars: int,
+    ) -> list[str]:
+        """
+        把正文切成片段。
+
+        按行拆成段落后依次合并，每段不超过 max_chars；
+        单个超长段落优先在句末标点处切开。
+        """
+
+        paragraphs = [
+            p.strip()
+            for p in content.splitlines()
+            if p.strip()
+        ]
+
+        pieces = []
+
+        for paragraph in paragraphs:
+
+            while len(paragraph) > max_chars:
+                ends = [
+                    m.end()
+                    for m in re.finditer(r"[。！？；;.!?]", paragraph[:max_chars])
+                ]
+                cut = ends[-1] if ends else max_chars
+
+                pieces.append(paragraph[:cut])
+                paragraph = paragraph[cut:].strip()
+
+            if paragraph:
+                pieces.append(paragraph)
+
+        passages = []
+        current = ""
+
+        for piece in pieces:
+
+            if current and len(current) + len(piece) + 1 > max_chars:
+                passages.append(current)
+                current = piece
+            else:
+                current = f"{current}\n{piece}" if current else piece
+
+        if current:
+            passages.append(current)
+
+        return passages
+
     @classmethod
     def clear_cache(cls):
 
@@ -323,24 +384,7 @@ class KnowledgeRetriever:
         构建知识选择Prompt。
         """
 
-        sections = []
-
-        for item in knowledge.values():
-
-            line = (
-                f"- {item.name}\n"
-                f"  摘要：{item.summary}"
-            )
-
-            if item.tags:
-                line += (
-                    "\n"
-                    f"  标签：{'、'.join(item.tags)}"
-                )
-
-            sections.append(line)
-
-        sections = "\n\n".join(sections)
+        sections = cls.render_index(knowledge)
 
         return f"""你是一名知识检索器。
 
@@ -364,6 +408,33 @@ none
 {query}
 """
 
+    @staticmethod
+    def render_index(knowledge: dict[str, KnowledgeItem]) -> str:
+        """
+        知识目录：每个条目的名称、摘要与标签，按加载顺序排列。
+
+        内容只随知识文件变化，既用于选择 Prompt，也作为 stable_prefix 布局中不变的前缀。
+        """
+
+        sections = []
+
+        for item in knowledge.values():
+
+            line = (
+                f"- {item.name}\n"
+                f"  摘要：{item.summary}"
+            )
+
+            if item.tags:
+                line += (
+                    "\n"
+                    f"  标签：{'、'.join(item.tags)}"
+                )
+
+            sections.append(line)
+
+        return "\n\n".join(sections)
+
     @staticmethod
     def parse_response(
             response: str,
@@ -3,11 +3,11 @@ import yaml
 import os
 from pathlib import Path
 from abc import ABC, abstractmethod
-from openai import OpenAI
 from requests.exceptions import HTTPError, ConnectionError, Timeout
 
 from src.config.models import model_settings
 from src.config.cur_role import CurrentRole
+from src.utils.chat.llm.client_pool import LLMClientPool
 from src.utils.tools.file import load_from_txt
 from src.config.path import API_KEY_DIR, PROMPT_DIR, CONFIG_DIR
 
@@ -130,13 +130,8 @@ class ChatDSAPI:
                 print(f"不支持的模型名称 {model_name}，默认使用 deepseek-chat")
                 self.model_name = "deepseek-chat"
 
-        if api_path is None:
-            api_path = Path(API_KEY_DIR) / "deepseek.txt"
-
-        self.client = OpenAI(
-            api_key=load_from_txt(api_path),
-            base_url=base_url
-        )
+        # 共享进程级连接池，EmojiDecider 等子类也不再各自创建客户端
+        self.client = LLMClientPool.get(base_url, api_path)
 
     def _init_role_prompt(self):
         """
@@ -253,10 +248,7 @@ class ChatKimiAPI(Chat):
         super().__init__()
         if api_path is None:
             api_path = Path(API_KEY_DIR) / "kimi.txt"
-        self.client = OpenAI(
-            api_key=load_from_txt(api_path),
-            base_url=base_url
-        )
+        self.client = LLMClientPool.get(base_url, api_path)
 
     def one_chat(self, query: str) -> str:
         """
@@ -289,15 +281,9 @@ class DeepSeekClient:
             base_url="https://api.deepseek.com",
             api_path=None
     ):
-        if api_path is None:
-            api_path = Path(API_KEY_DIR) / "deepseek.txt"
-
         self.model = model
 
-        self.client = OpenAI(
-            api_key=load_from_txt(api_path),
-            base_url=base_url
-        )
+        self.client = LLMClientPool.get(base_url, api_path)
 
     def one_chat(
             self,
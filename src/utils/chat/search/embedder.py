@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import dashscope
+import numpy as np
+
+from src.config.path import API_KEY_DIR
+from src.utils.tools.file import load_from_txt
+from src.utils.tools.metrics import ModelCallMetrics
+
+
+class TextEmbedder:
+    """
+    DashScope 文本向量接口（与 VoiceDecider 使用同一个模型）。
+
+    embed_batch 把多条文本按 batch_size 分批，concurrency 个批次并发请求，
+    返回与输入一一对齐的 float32 矩阵；批次失败时指数退避重试，仍失败则抛出 RuntimeError。
+    """
+
+    MODEL = "qwen3-vl-embedding"
+
+    def __init__(
+            self,
+            model: str = MODEL,
+            api_key_path: str | Path | None = None,
+            batch_size: int = 10,
+            concurrency: int = 4,
+            retries: int = 2,
+    ):
+        self.model = model
+        self.api_key = load_from_txt(Path(api_key_path) if api_key_path else Path(API_KEY_DIR) / "qwen.txt")
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self._call([text])[0]
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        """
+        Returns
+        -------
+        np.ndarray
+            (len(texts), d) float32
+        """
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        if len(batches) == 1:
+            results = [self._call_with_retry(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="Embed") as pool:
+                results = list(pool.map(self._call_with_retry, batches))
+
+        return np.vstack([vec for batch in results for vec in batch]).astype(np.float32)
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    def _call_with_retry(self, texts: list[str]) -> list[np.ndarray]:
+        for attempt in range(self.retries + 1):
+            try:
+                return self._call(texts)
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(2 ** attempt)
+        raise AssertionError("unreachable")
+
+    def _call(self, texts: list[str]) -> list[np.ndarray]:
+        with ModelCallMetrics.track("knowledge_embedding", self.model) as call:
+            resp = dashscope.MultiModalEmbedding.call(
+                model=self.model,
+                input=[{"text": text} for text in texts],
+                api_key=self.api_key,
+            )
+            call.usage = resp.usage
+            if resp.status_code != 200:
+                raise RuntimeError(f"Embedding 请求失败: {resp.message}")
+
+        embeddings = resp.output["embeddings"]
+        if len(embeddings) != len(texts):
+            # 服务端把多条输入融合成一个向量时逐条请求
+            if len(texts) == 1:
+                raise RuntimeError("Embedding 返回条数与输入不一致")
+            return [vec for text in texts for vec in self._call([text])]
+
+        embeddings = sorted(embeddings, key=lambda item: item.get("index", 0))
+        return [np.asarray(item["embedding"], dtype=np.float32) for item in embeddings]
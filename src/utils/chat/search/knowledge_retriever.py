@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from src.config.path import KNOWLEDGE_CACHE_DIR
+from src.utils.chat.prompt.load_prompt import KnowledgeItem, KnowledgeLoader
+from src.utils.chat.search.embedder import TextEmbedder
+from src.utils.chat.search.vector_index import VectorIndex
+
+
+@dataclass
+class KnowledgeMatch:
+    # 选中的知识条目
+    selected: dict[str, KnowledgeItem] = field(default_factory=dict)
+    # 每个条目的最高相似度，按从高到低
+    scores: list[tuple[str, float]] = field(default_factory=list)
+    # 最高分落在 [min_score, accept_score) 之间，向量检索结果不确定
+    ambiguous: bool = False
+    # 选中条目的片段序号，按相似度从高到低
+    passage_order: dict[str, list[int]] = field(default_factory=dict)
+
+
+class EmbeddingKnowledgeRetriever:
+    """
+    基于向量的知识检索器，替代每次回复前的 LLM 选择调用。
+
+    每个 KnowledgeItem 拆成若干检索单元分别向量化：
+
+        - 名称 + 摘要 + 标签；
+        - 正文的每个片段（KnowledgeLoader 加载时切好的 passages）。
+
+    条目的得分取其所有单元与查询的最高余弦相似度；
+    选中条目的片段按相似度排序（passage_order），拼接上下文时优先放入最相关的片段。
+
+    向量按条目缓存在 KNOWLEDGE_CACHE_DIR/<角色>/<条目名>.<内容哈希>.npy，
+    知识文件不变时重启不再请求 embedding，只有修改过的条目重新向量化。
+
+    检索时只需一次查询向量请求和一次矩阵乘法；
+    最高分处于 [min_score, accept_score) 时结果标记为 ambiguous，由调用方决定是否交给 LLM 选择器。
+    """
+
+    # 构建失败后多久内不再重试（秒）
+    FAILURE_COOLDOWN = 300.0
+
+    _lock = threading.Lock()
+    _shared: dict[str, EmbeddingKnowledgeRetriever] = {}
+    # 角色 → 构建锁，不同角色的构建互不阻塞
+    _build_locks: dict[str, threading.Lock] = {}
+    # 角色 → (上次构建失败的原因, 允许重试的时间)
+    _failures: dict[str, tuple[str, float]] = {}
+
+    def __init__(
+            self,
+            role_name: str,
+            knowledge: dict[str, KnowledgeItem],
+            embedder: TextEmbedder | None = None,
+            cache_dir: str | Path = KNOWLEDGE_CACHE_DIR,
+    ):
+        """
+        Parameters
+        ----------
+        role_name
+            角色名称，决定缓存子目录
+        knowledge
+            KnowledgeLoader.load 的结果
+        embedder
+            文本向量接口，默认 TextEmbedder()
+        """
+
+        self.role_name = role_name
+        self.knowledge = knowledge
+        self.embedder = embedder or TextEmbedder()
+        self.cache_dir = Path(cache_dir) / role_name
+
+        # 每个检索单元所属的条目名与片段序号（-1 为摘要单元），与 index 的行一一对应
+        self.unit_items: list[str] = []
+        self.unit_passages: list[int] = []
+        self.index = self._build_index()
+
+    @classmethod
+    def for_role(cls, role_name: str) -> EmbeddingKnowledgeRetriever:
+        """
+        同一角色在进程内只构建一次（首次调用会请求 embedding，应在线程池中调用）
+
+        构建只持有该角色自己的锁，不阻塞其他角色；构建失败后 FAILURE_COOLDOWN 秒内
+        直接抛出 RuntimeError，调用方立即改用 LLM 选择，不会每次回复都重新请求、重试 embedding。
+        """
+
+        with cls._lock:
+            retriever = cls._check_shared(role_name)
+            if retriever is not None:
+                return retriever
+            build_lock = cls._build_locks.setdefault(role_name, threading.Lock())
+
+        with build_lock:
+            # 等锁期间可能已由其他线程构建完成或失败
+            with cls._lock:
+                retriever = cls._check_shared(role_name)
+            if retriever is not None:
+                return retriever
+
+            try:
+                retriever = cls(role_name, KnowledgeLoader.load(role_name))
+            except Exception as e:
+                with cls._lock:
+                    cls._failures[role_name] = (f"{type(e).__name__}: {e}", time.monotonic() + cls.FAILURE_COOLDOWN)
+                raise
+
+            with cls._lock:
+                cls._shared[role_name] = retriever
+                cls._failures.pop(role_name, None)
+            return retriever
+
+    @classmethod
+    def _check_shared(cls, role_name: str) -> EmbeddingKnowledgeRetriever | None:
+        """
+        已构建的检索器；仍在失败冷却期内时抛出 RuntimeError（调用方持有 _lock）
+        """
+
+        retriever = cls._shared.get(role_name)
+        if retriever is not None:
+            return retriever
+
+        failure = cls._failures.get(role_name)
+        if failure is not None:
+            error, retry_at = failure
+            remaining = retry_at - time.monotonic()
+            if remaining > 0:
+                raise RuntimeError(f"{role_name} 的向量索引构建失败，{remaining:.0f}s 后重试：{error}")
+
+        return None
+
+    # ==========================================================
+    # 检索
+    # ==========================================================
+
+    def search(self, query: str, k: int = 3) -> tuple[list[tuple[str, float]], dict[str, list[int]]]:
+        """
+        Returns
+        -------
+        tuple
+            (得分最高的 k 个条目 [(条目名, 相似度)], {条目名: 按相似度排序的片段序号})
+        """
+
+        if len(self.index) == 0:
+            return [], {}
+
+        query_vector = self.embedder.embed_one(query)
+
+        # 知识库规模不大，直接对全部单元打分（一次矩阵乘法），同时得到片段排序
+        hits = self.index.search(query_vector, k=len(self.index))
+
+        best: dict[str, float] = {}
+        passage_order: dict[str, list[int]] = {}
+        for row, score in hits:
+            name = self.unit_items[row]
+            if score > best.get(name, -np.inf):
+                best[name] = score
+            if self.unit_passages[row] >= 0:
+                passage_order.setdefault(name, []).append(self.unit_passages[row])
+
+        top = sorted(best.items(), key=lambda item: item[1], reverse=True)[:k]
+        return top, {name: passage_order.get(name, []) for name, _ in top}
+
+    def retrieve(
+            self,
+            query: str,
+            k: int = 3,
+            min_score: float = 0.4,
+            accept_score: float = 0.6,
+    ) -> KnowledgeMatch:
+        """
+        检索知识条目
+
+        Parameters
+        ----------
+        k
+            最多选中的条目数
+        min_score
+            低于该分数的条目不选
+        accept_score
+            最高分达到该分数时认为结果可靠
+        """
+
+        start = time.perf_counter()
+        scores, passage_order = self.search(query, k)
+
+        selected = {
+            name: self.knowledge[name]
+            for name, score in scores
+            if score >= min_score
+        }
+        top = scores[0][1] if scores else -np.inf
+        ambiguous = min_score <= top < accept_score
+
+        print(
+            f"[EmbeddingKnowledgeRetriever] 选择的知识条目有：{list(selected)}，"
+            f"得分：{[(name, round(score, 3)) for name, score in scores]}，"
+            f"{'不确定，' if ambiguous else ''}耗时 {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+
+        return KnowledgeMatch(
+            selected=selected,
+            scores=scores,
+            ambiguous=ambiguous,
+            passage_order={name: passage_order[name] for name in selected},
+        )
+
+    # ==========================================================
+    # 构建
+    # ==========================================================
+
+    def _build_index(self) -> VectorIndex:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        matrices = []
+        for name, item in self.knowledge.items():
+            vectors = self._load_item_vectors(name, item)
+            matrices.append(vectors)
+            self.unit_items.extend([name] * len(vectors))
+            self.unit_passages.extend(range(-1, len(vectors) - 1))
+
+        matrices = [m for m in matrices if len(m)]
+        vectors = np.vstack(matrices) if matrices else np.zeros((0, 1), dtype=np.float32)
+
+        return VectorIndex(VectorIndex.normalize(vectors))
+
+    def _load_item_vectors(self, name: str, item: KnowledgeItem) -> np.ndarray:
+        units = self._units(item)
+        item_hash = self._item_hash(item, units)
+        cache_path = self.cache_dir / f"{name}.{item_hash}.npy"
+
+        if cache_path.exists():
+            vectors = np.load(cache_path)
+            if len(vectors) == len(units):
+                return vectors
+
+        print(f"[EmbeddingKnowledgeRetriever] 正在向量化知识条目 {name}（{len(units)} 块）")
+        vectors = self.embedder.embed_batch(units) if units else np.zeros((0, 1), dtype=np.float32)
+
+        # 条目修改后旧缓存不再使用；按 <name>.<hash>.npy 精确匹配，
+        # 不把条目名放进 glob（[ ] 会被当作通配符，"a.*" 也会匹配到条目 "a.b" 的缓存）
+        for stale in self.cache_dir.glob("*.npy"):
+            stem, _, digest = stale.stem.rpartition(".")
+            if stem == name and len(digest) == 16:
+                stale.unlink(missing_ok=True)
+        np.save(cache_path, vectors)
+
+        return vectors
+
+    def _item_hash(self, item: KnowledgeItem, units: list[str]) -> str:
+        key = "\n\0".join([self.embedder.model, *units])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def _units(self, item: KnowledgeItem) -> list[str]:
+        head = f"{item.name}：{item.summary}"
+        if item.tags:
+            head += f"\n标签：{'、'.join(item.tags)}"
+
+        return [head, *item.passages]
+
+
+if __name__ == "__main__":
+    retriever = EmbeddingKnowledgeRetriever.for_role("LuoTianyi")
+
+    for user_query in ["介绍一下V5声库", "你和乐正绫是什么关系", "今天天气怎么样"]:
+        match = retriever.retrieve(user_query)
+        print(user_query, list(match.selected), match.scores, "ambiguous" if match.ambiguous else "")
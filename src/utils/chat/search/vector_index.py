@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import math
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+class VectorIndex:
+    """
+    余弦相似度向量索引。
+
+    加载时把库向量 L2 归一化一次，以 float32 保存为 `<stem>.normed.npy` 并以 mmap 方式打开，
+    查询时余弦相似度就是一次矩阵乘法（或一次 ANN 探测），不再每次计算整库的范数；
+    多个 bot 共用同一个向量库时，同进程内共享同一个 VectorIndex（VectorIndex.load），
+    跨进程共享操作系统的页缓存，内存占用不随 bot 数量增长。
+
+    后端：
+
+        - numpy：精确内积，argpartition 取 top-k（默认）；
+        - faiss-flat：faiss 精确内积；
+        - faiss-ivf：倒排索引，nprobe 控制精度；
+        - faiss-hnsw：HNSW 图索引。
+
+    faiss 未安装时自动退回 numpy。
+
+    用法：
+
+        index = VectorIndex.load(vector_path, backend="numpy")
+        scores, ids = index.search_batch(queries, k=5)
+        [(row, score), ...] = index.search(query, k=5)
+    """
+
+    BACKENDS = ("numpy", "faiss-flat", "faiss-ivf", "faiss-hnsw")
+
+    _lock = threading.Lock()
+    _shared: dict[tuple[str, float, str], VectorIndex] = {}
+
+    def __init__(self, vectors: np.ndarray, backend: str = "numpy", nprobe: int = 8):
+        """
+        Parameters
+        ----------
+        vectors
+            (N, d) 已归一化的 float32 矩阵，可以是 mmap
+        backend
+            numpy / faiss-flat / faiss-ivf / faiss-hnsw
+        nprobe
+            faiss-ivf 每次查询探测的倒排桶数
+        """
+
+        if backend not in self.BACKENDS:
+            raise ValueError(f"不支持的索引后端: {backend}")
+        if vectors.ndim != 2:
+            raise ValueError(f"向量矩阵应为二维，实际为 {vectors.shape}")
+
+        self.vectors = vectors
+        self.backend = backend
+        self.nprobe = nprobe
+
+        self._faiss_index = None
+        if backend != "numpy" and len(vectors) > 0:
+            self._faiss_index = self._build_faiss(backend)
+            if self._faiss_index is None:
+                self.backend = "numpy"
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    # ==========================================================
+    # 加载
+    # ==========================================================
+
+    @classmethod
+    def load(cls, vector_path: str | Path, backend: str = "numpy", nprobe: int = 8) -> VectorIndex:
+        """
+        从原始向量 .npy 加载索引；同进程内同一文件、同一后端共享一个实例
+
+        原始向量变化（mtime 变化）后重新生成归一化文件。
+        """
+
+        vector_path = Path(vector_path).resolve()
+        key = (str(vector_path), vector_path.stat().st_mtime, backend)
+
+        with cls._lock:
+            index = cls._shared.get(key)
+            if index is None:
+                # 同一文件旧版本的索引不再复用
+                for stale in [k for k in cls._shared if k[0] == key[0] and k[2] == backend]:
+                    del cls._shared[stale]
+                index = cls(cls.load_normalized(vector_path), backend=backend, nprobe=nprobe)
+                cls._shared[key] = index
+            return index
+
+    @classmethod
+    def load_normalized(cls, vector_path: str | Path) -> np.ndarray:
+        """
+        返回 vector_path 对应的归一化 float32 矩阵（mmap 只读）
+        """
+
+        vector_path = Path(vector_path)
+        normed_path = cls.normalized_path(vector_path)
+
+        if not normed_path.exists() or normed_path.stat().st_mtime < vector_path.stat().st_mtime:
+            normed = cls.normalize(np.load(vector_path))
+            tmp_path = normed_path.with_name(f"{normed_path.name}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, normed)
+            tmp_path.replace(normed_path)
+
+        return np.load(normed_path, mmap_mode="r")
+
+    @staticmethod
+    def normalized_path(vector_path: str | Path) -> Path:
+        vector_path = Path(vector_path)
+        return vector_path.with_name(f"{vector_path.stem}.normed.npy")
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """
+        按行 L2 归一化为 float32；零向量保持为零（与任何查询的相似度都是 0）
+        """
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if vectors.size == 0:
+            # 已经是二维，(0, d) 不能再 reshape(0, -1)
+            return vectors
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 1e-9)
+
+    # ==========================================================
+    # 查询
+    # ==========================================================
+
+    def search(self, query: np.ndarray, k: int = 1) -> list[tuple[int, float]]:
+        """
+        单条查询，返回 [(行号, 余弦相似度)]，按相似度从高到低
+        """
+
+        scores, ids = self.search_batch(np.asarray(query).reshape(1, -1), k)
+        return [
+            (int(row), float(score))
+            for row, score in zip(ids[0], scores[0])
+            if row >= 0
+        ]
+
+    def search_batch(self, queries: np.ndarray, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """
+        批量查询
+
+        Parameters
+        ----------
+        queries
+            (n, d) 查询向量，不要求已归一化
+        k
+            每条查询返回的结果数
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            (scores, ids)，形状均为 (n, k)；结果不足 k 个时 id 为 -1、score 为 -inf
+        """
+
+        queries = self.normalize(queries)
+        n = len(queries)
+        k = max(1, k)
+
+        scores = np.full((n, k), -np.inf, dtype=np.float32)
+        ids = np.full((n, k), -1, dtype=np.int64)
+
+        if n == 0 or len(self.vectors) == 0:
+            return scores, ids
+
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"查询向量维度 {queries.shape[1]} 与索引维度 {self.dim} 不一致")
+
+        if self._faiss_index is not None:
+            found_scores, found_ids = self._faiss_index.search(queries, min(k, len(self.vectors)))
+            found_scores[found_ids < 0] = -np.inf
+        else:
+            found_scores, found_ids = self._numpy_topk(queries, k)
+
+        scores[:, :found_ids.shape[1]] = found_scores
+        ids[:, :found_ids.shape[1]] = found_ids
+        return scores, ids
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    def _numpy_topk(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        similarities = queries @ self.vectors.T
+        k = min(k, similarities.shape[1])
+
+        if k < similarities.shape[1]:
+            top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (len(queries), k))
+
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+
+        return (
+            np.take_along_axis(top_scores, order, axis=1),
+            np.take_along_axis(top, order, axis=1).astype(np.int64),
+        )
+
+    def _build_faiss(self, backend: str):
+        try:
+            import faiss
+        except ImportError:
+            print(f"[VectorIndex] 未安装 faiss，{backend} 退回 numpy 精确检索")
+            return None
+
+        vectors = np.ascontiguousarray(self.vectors, dtype=np.float32)
+        n, d = vectors.shape
+
+        if backend == "faiss-flat":
+            index = faiss.IndexFlatIP(d)
+        elif backend == "faiss-hnsw":
+            index = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # 倒排桶数取 4√N，且每个桶至少约 39 个训练样本（faiss 的建议下限）
+            nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+            quantizer = faiss.IndexFlatIP(d)
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = min(self.nprobe, nlist)
+
+        index.add(vectors)
+        return index
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    library = rng.standard_normal((5000, 1024)).astype(np.float32)
+    queries = library[:100] + 0.1 * rng.standard_normal((100, 1024)).astype(np.float32)
+
+    for backend in VectorIndex.BACKENDS:
+        index = VectorIndex(VectorIndex.normalize(library), backend=backend)
+        start = time.perf_counter()
+        scores, ids = index.search_batch(queries, k=5)
+        elapsed = time.perf_counter() - start
+        recall = float(np.mean(ids[:, 0] == np.arange(100)))
+        print(f"{index.backend:<10} recall@1={recall:.2f} {elapsed / len(queries) * 1e6:.0f}us/query")
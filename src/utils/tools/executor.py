@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    """
+    把同步阻塞调用（DeepSeek 请求、requests 下载、VLM 识图、读写文件）移出事件循环。
+
+    所有调用共用一个有上限的线程池，避免慢接口把默认线程池占满；
+    调用时复制当前 contextvars，线程里也能拿到调用方的上下文（例如日志、追踪信息）。
+
+    用法：
+
+        decision = await BlockingExecutor.run(decider.check_if_should_reply, latest, history)
+    """
+
+    MAX_WORKERS = 16
+
+    _executor: ThreadPoolExecutor | None = None
+    _lock = threading.Lock()
+
+    @classmethod
+    async def run(cls, func: Callable[..., T], /, *args, **kwargs) -> T:
+        """
+        在线程池中执行 func(*args, **kwargs) 并等待结果
+        """
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+
+        return await loop.run_in_executor(cls._get_executor(), call)
+
+    @classmethod
+    def shutdown(cls, wait: bool = True) -> None:
+        """
+        关闭线程池；之后再调用 run 会重新创建
+        """
+
+        with cls._lock:
+            executor, cls._executor = cls._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=cls.MAX_WORKERS,
+                    thread_name_prefix="Blocking",
+                )
+            return cls._executor
+
+
+class LoopLagMonitor:
+    """
+    事件循环卡顿监控。
+
+    事件循环中的心跳任务每 interval 秒记录一次时间，后台看门狗线程发现心跳超过 threshold 秒没有更新时，
+    说明有回调长时间占着事件循环，记录一次警告和事件循环线程当时的调用栈，直接指出是哪段同步代码；
+    卡顿结束后再记录一次总时长。
+
+    需要在事件循环运行后调用 start（例如收到第一条消息时）。
+    """
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1):
+        """
+        Parameters
+        ----------
+        threshold
+            心跳超过多少秒未更新视为卡顿
+        interval
+            心跳间隔
+        """
+
+        self.threshold = threshold
+        self.interval = interval
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """
+        在当前事件循环启动心跳与看门狗，重复调用无副作用
+        """
+
+        if self.running:
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            name="LoopLagMonitor",
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    async def _beat(self) -> None:
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        stalled_since: float | None = None
+
+        while not self._stop.wait(self.interval):
+            lag = time.monotonic() - self._heartbeat - self.interval
+
+            if lag > self.threshold:
+                if stalled_since is None:
+                    stalled_since = self._heartbeat
+                    logger.warning(
+                        "事件循环已阻塞 %.2fs，当前调用栈：\n%s",
+                        lag,
+                        self._loop_stack(),
+                    )
+            elif stalled_since is not None:
+                logger.warning(
+                    "事件循环阻塞结束，共 %.2fs",
+                    self._heartbeat - stalled_since - self.interval,
+                )
+                stalled_since = None
+
+    def _loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "（无法获取事件循环线程的调用栈）"
+        return "".join(traceback.format_stack(frame))
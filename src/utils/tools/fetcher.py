@@ -0,0 +1,476 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config.path import FETCH_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class FetchedAsset:
+    data: bytes
+    sha256: str
+    content_type: str
+
+
+class MediaFetcher:
+    """
+    进程级远程资源下载层。
+
+    同一个 QQ 图片/语音 URL 会被 MediaPipeline、ImageStorage、EmojiDetector、ImageDescriber、
+    download_qq_audio 分别用到，这里统一下载并缓存，同一个资源只下载一次：
+
+        - 共用一个带连接池的 requests.Session；
+        - 每个域名同时下载数有上限；
+        - 连接失败、超时、429/5xx 按指数退避重试；
+        - 超过 max_bytes 的资源直接放弃，不读入内存；
+        - 同一 URL 正在下载时，其他线程等待同一次下载的结果；
+        - 两级缓存：内存 LRU（按总字节数）与磁盘 LRU（FETCH_CACHE_DIR，按总字节数），
+          URL → SHA256 的映射有 TTL，内容按 SHA256 存储，不同 URL 的相同内容只存一份。
+
+    用法：
+
+        data = MediaFetcher.fetch(url)
+        asset = MediaFetcher.fetch_asset(url, headers=headers)   # 需要 Content-Type 时
+    """
+
+    # 连接池与并发
+    POOL_MAXSIZE = 32
+    PER_HOST = 4
+
+    # 重试
+    RETRIES = 2
+    BACKOFF = 0.5
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    TIMEOUT = 20.0
+    MAX_BYTES = 20 * 1024 * 1024
+
+    # 缓存
+    URL_TTL = 6 * 3600
+    MAX_URLS = 4096
+    MEMORY_BYTES = 64 * 1024 * 1024
+    DISK_BYTES = 512 * 1024 * 1024
+    EVICT_EVERY = 100
+
+    _lock = threading.Lock()
+    _session: requests.Session | None = None
+    _host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+    _inflight: dict[str, threading.Event] = {}
+
+    # url -> (sha256, content_type, 过期时间)
+    _urls: OrderedDict[str, tuple[str, str, float]] = OrderedDict()
+    # sha256 -> data
+    _contents: OrderedDict[str, bytes] = OrderedDict()
+    _memory_bytes = 0
+
+    _disk: _DiskCache | None = None
+
+    # ==========================================================
+    # 对外接口
+    # ==========================================================
+
+    @classmethod
+    def fetch(
+            cls,
+            url: str,
+            *,
+            headers: dict | None = None,
+            max_bytes: int | None = None,
+            timeout: float | None = None,
+    ) -> bytes:
+        """
+        下载 URL 内容（命中缓存时不访问网络）
+        """
+
+        return cls.fetch_asset(url, headers=headers, max_bytes=max_bytes, timeout=timeout).data
+
+    @classmethod
+    def fetch_asset(
+            cls,
+            url: str,
+            *,
+            headers: dict | None = None,
+            max_bytes: int | None = None,
+            timeout: float | None = None,
+    ) -> FetchedAsset:
+        """
+        下载 URL，返回内容、SHA256 与 Content-Type
+
+        Parameters
+        ----------
+        headers
+            额外请求头（例如下载 QQ 语音时伪装的 User-Agent）
+        max_bytes
+            大小上限，默认 MAX_BYTES；超过时抛出 ValueError
+        timeout
+            单次请求超时，默认 TIMEOUT
+
+        Raises
+        ------
+        requests.RequestException
+            重试后仍然失败
+        """
+
+        while True:
+            asset = cls._get_cached(url)
+            if asset is not None:
+                return asset
+
+            with cls._lock:
+                event = cls._inflight.get(url)
+                leader = event is None
+                if leader:
+                    event = threading.Event()
+                    cls._inflight[url] = event
+
+            if not leader:
+                # 等同一 URL 的下载结束后重新查缓存；对方失败时自己再下载一次
+                event.wait()
+                asset = cls._get_cached(url)
+                if asset is not None:
+                    return asset
+                with cls._lock:
+                    if url in cls._inflight:
+                        continue
+                    cls._inflight[url] = event = threading.Event()
+
+            try:
+                asset = cls._download(
+                    url,
+                    headers=headers,
+                    max_bytes=max_bytes or cls.MAX_BYTES,
+                    timeout=timeout or cls.TIMEOUT,
+                )
+                cls._put_cached(url, asset)
+                return asset
+            finally:
+                with cls._lock:
+                    cls._inflight.pop(url, None)
+                event.set()
+
+    @classmethod
+    def close(cls) -> None:
+        """
+        关闭连接池与磁盘缓存索引；bot 退出时由 BotManager.close 调用
+        """
+
+        with cls._lock:
+            session, cls._session = cls._session, None
+            disk, cls._disk = cls._disk, None
+
+        if session is not None:
+            session.close()
+        if disk is not None:
+            disk.close()
+
+    # ==========================================================
+    # 下载
+    # ==========================================================
+
+    @classmethod
+    def _download(
+            cls,
+            url: str,
+            *,
+            headers: dict | None,
+            max_bytes: int,
+            timeout: float,
+    ) -> FetchedAsset:
+
+        session = cls._get_session()
+
+        for attempt in range(cls.RETRIES + 1):
+            try:
+                with cls._get_host_semaphore(url):
+                    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+                        if response.status_code in cls.RETRY_STATUS and attempt < cls.RETRIES:
+                            raise requests.HTTPError(f"{response.status_code} 可重试", response=response)
+                        response.raise_for_status()
+
+                        data = cls._read_limited(response, max_bytes)
+                        content_type = response.headers.get("Content-Type", "")
+
+                return FetchedAsset(
+                    data=data,
+                    sha256=hashlib.sha256(data).hexdigest(),
+                    content_type=content_type,
+                )
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                status = e.response.status_code if e.response is not None else None
+                retryable = status is None or status in cls.RETRY_STATUS
+                if not retryable or attempt >= cls.RETRIES:
+                    raise
+
+                delay = cls.BACKOFF * (2 ** attempt)
+                logger.info("[MediaFetcher] 下载失败，%.1fs 后重试（%d/%d）：%s，%s",
+                            delay, attempt + 1, cls.RETRIES, url, e)
+                time.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    def _read_limited(response: requests.Response, max_bytes: int) -> bytes:
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise ValueError(f"资源过大：{int(length)} 字节，上限 {max_bytes}")
+
+        chunks = []
+        total = 0
+        for chunk in response.iter_content(chunk_size=256 * 1024):
+            total += len(chunk)
+            if total > max_bytes:
+                raise ValueError(f"资源超过上限 {max_bytes} 字节")
+            chunks.append(chunk)
+
+        return b"".join(chunks)
+
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        with cls._lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=cls.POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def _get_host_semaphore(cls, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc.lower()
+        with cls._lock:
+            semaphore = cls._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(cls.PER_HOST)
+                cls._host_semaphores[host] = semaphore
+            return semaphore
+
+    # ==========================================================
+    # 缓存
+    # ==========================================================
+
+    @classmethod
+    def _get_cached(cls, url: str) -> FetchedAsset | None:
+        now = time.time()
+
+        with cls._lock:
+            entry = cls._urls.get(url)
+            if entry is not None and entry[2] < now:
+                del cls._urls[url]
+                entry = None
+
+            if entry is not None:
+                cls._urls.move_to_end(url)
+                data = cls._contents.get(entry[0])
+                if data is not None:
+                    cls._contents.move_to_end(entry[0])
+                    return FetchedAsset(data=data, sha256=entry[0], content_type=entry[1])
+
+        disk = cls._get_disk()
+        if disk is None:
+            return None
+
+        hit = disk.get(url, now - cls.URL_TTL)
+        if hit is None:
+            return None
+
+        asset = FetchedAsset(data=hit[2], sha256=hit[0], content_type=hit[1])
+        cls._put_memory(url, asset, expires=hit[3] + cls.URL_TTL)
+        return asset
+
+    @classmethod
+    def _put_cached(cls, url: str, asset: FetchedAsset) -> None:
+        now = time.time()
+        cls._put_memory(url, asset, expires=now + cls.URL_TTL)
+
+        disk = cls._get_disk()
+        if disk is not None:
+            try:
+                disk.put(url, asset, now)
+            except Exception as e:
+                logger.warning("[MediaFetcher] 写入磁盘缓存失败：%s", e)
+
+    @classmethod
+    def _put_memory(cls, url: str, asset: FetchedAsset, expires: float) -> None:
+        with cls._lock:
+            cls._urls[url] = (asset.sha256, asset.content_type, expires)
+            cls._urls.move_to_end(url)
+            while len(cls._urls) > cls.MAX_URLS:
+                cls._urls.popitem(last=False)
+
+            if asset.sha256 not in cls._contents:
+                cls._contents[asset.sha256] = asset.data
+                cls._memory_bytes += len(asset.data)
+            cls._contents.move_to_end(asset.sha256)
+
+            while cls._memory_bytes > cls.MEMORY_BYTES and len(cls._contents) > 1:
+                _, data = cls._contents.popitem(last=False)
+                cls._memory_bytes -= len(data)
+
+    @classmethod
+    def _get_disk(cls) -> _DiskCache | None:
+        with cls._lock:
+            if cls._disk is None and cls.DISK_BYTES > 0:
+                try:
+                    cls._disk = _DiskCache(FETCH_CACHE_DIR, cls.DISK_BYTES, cls.EVICT_EVERY)
+                except Exception as e:
+                    logger.warning("[MediaFetcher] 磁盘缓存不可用：%s", e)
+                    cls.DISK_BYTES = 0
+            return cls._disk
+
+
+class _DiskCache:
+    """
+    MediaFetcher 的磁盘缓存。
+
+        root/index.db
+            urls(url PK, sha256, content_type, fetched_time)
+            contents(sha256 PK, size, last_used)
+        root/<sha256[:2]>/<sha256>
+
+    总大小超过 max_bytes 时按 last_used 删除最久未使用的内容及指向它的 URL。
+    """
+
+    def __init__(self, root: str | Path, max_bytes: int, evict_every: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.conn = sqlite3.connect(self.root / "index.db", timeout=10, check_same_thread=False)
+
+        with self._lock:
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls(
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                fetched_time REAL NOT NULL
+            )
+            """)
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS contents(
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_sha256 ON urls(sha256)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_contents_last_used ON contents(last_used)")
+            self.conn.commit()
+
+        self.evict()
+
+    def get(self, url: str, min_fetched_time: float) -> tuple[str, str, bytes, float] | None:
+        """
+        返回 (sha256, content_type, data, fetched_time)；过期或文件缺失时返回 None
+        """
+
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT sha256, content_type, fetched_time FROM urls WHERE url = ? AND fetched_time >= ?",
+                (url, min_fetched_time),
+            ).fetchone()
+            if row is None:
+                return None
+
+            sha256, content_type, fetched_time = row
+            try:
+                data = self._path(sha256).read_bytes()
+            except OSError:
+                self.conn.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+                self.conn.execute("DELETE FROM contents WHERE sha256 = ?", (sha256,))
+                self.conn.commit()
+                return None
+
+            self.conn.execute("UPDATE contents SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+            self.conn.commit()
+
+        return sha256, content_type, data, fetched_time
+
+    def put(self, url: str, asset: FetchedAsset, now: float) -> None:
+        path = self._path(asset.sha256)
+
+        with self._lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(asset.data)
+                tmp_path.replace(path)
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO urls(url, sha256, content_type, fetched_time) VALUES (?, ?, ?, ?)",
+                (url, asset.sha256, asset.content_type, now),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO contents(sha256, size, last_used) VALUES (?, ?, ?)",
+                (asset.sha256, len(asset.data), now),
+            )
+            self.conn.commit()
+
+            self._puts += 1
+            should_evict = self._puts % self.evict_every == 0
+
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        删除最久未使用的内容直到总大小不超过 max_bytes，返回删除的内容数
+        """
+
+        with self._lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM contents").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            removed = []
+            for sha256, size in self.conn.execute(
+                    "SELECT sha256, size FROM contents ORDER BY last_used"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                removed.append((sha256,))
+                total -= size
+
+            self.conn.executemany("DELETE FROM urls WHERE sha256 = ?", removed)
+            self.conn.executemany("DELETE FROM contents WHERE sha256 = ?", removed)
+            self.conn.commit()
+
+        for (sha256,) in removed:
+            self._path(sha256).unlink(missing_ok=True)
+
+        return len(removed)
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def _path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+
+if __name__ == "__main__":
+    test_url = "https://www.python.org/static/img/python-logo.png"
+
+    for _ in range(2):
+        start = time.perf_counter()
+        asset = MediaFetcher.fetch_asset(test_url)
+        print(asset.sha256, asset.content_type, len(asset.data), f"{time.perf_counter() - start:.3f}s")
+
+    MediaFetcher.close()
@@ -0,0 +1,475 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from src.config.path import METRICS_DIR
+from src.utils.tools.tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+# 当前调用所属的会话，由 ModelCallMetrics.session 设置；BlockingExecutor 会把它带进线程池
+_session_var: contextvars.ContextVar[str] = contextvars.ContextVar("model_call_session", default="-")
+
+
+@dataclass
+class ModelCall:
+    """
+    一次模型调用的记录
+    """
+
+    ts: float
+    stage: str
+    model: str
+    session: str
+    latency: float
+    ok: bool = True
+    cancelled: bool = False
+    error: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    # 流式调用的首个 token 延迟
+    first_token: float | None = None
+
+
+class CallHandle:
+    """
+    ModelCallMetrics.track 产出的句柄，调用方在 with 块内补充 usage 与结果
+    """
+
+    __slots__ = ("usage", "error", "first_token", "_start")
+
+    def __init__(self):
+        self.usage = None
+        self.error = ""
+        self.first_token: float | None = None
+        self._start = time.perf_counter()
+
+    def fail(self, error: str) -> None:
+        """
+        接口没有抛异常、但返回了失败结果时标记失败
+        """
+        self.error = error or "failed"
+
+    def mark_first_token(self) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self._start
+
+
+@dataclass
+class _StageStats:
+    buckets: list[int]
+    calls: int = 0
+    errors: int = 0
+    cancelled: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency_sum: float = 0.0
+    # 滚动窗口：(时间戳, 延迟)
+    window: deque = field(default_factory=deque)
+
+
+class ModelCallMetrics:
+    """
+    进程级模型调用统计（LLM、VLM、Embedding）。
+
+    每次调用记录耗时、prompt / completion / 缓存命中 token、模型、调用方（stage）与会话，
+    按 (stage, model) 聚合：
+
+        - 累计计数与 token；
+        - 延迟直方图（固定桶，Prometheus histogram 语义）；
+        - 最近 WINDOW_SECONDS 内的延迟，用于计算滚动 p50 / p95。
+
+    最近 RECENT_CALLS 次调用的明细保存在环形缓冲中，可导出为 JSONL。
+    记录只是一次加锁的计数更新，开销在微秒级，可以在生产环境常开。
+
+    用法：
+
+        with ModelCallMetrics.session("1121221045/group/1039857271"):
+            ...
+
+        with ModelCallMetrics.track("vlm", model) as call:
+            response = MultiModalConversation.call(...)
+            call.usage = response.usage
+
+        print(ModelCallMetrics.report())
+        ModelCallMetrics.export()
+    """
+
+    # 延迟直方图的桶上界（秒）
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+    WINDOW_SECONDS = 600
+    # 每个 (stage, model) 滚动窗口最多保留的样本数
+    WINDOW_SIZE = 1024
+    RECENT_CALLS = 2000
+
+    # 每百万 token 的价格：(未命中缓存的输入, 命中缓存的输入, 输出)，未登记的模型不计算费用
+    PRICES: dict[str, tuple[float, float, float]] = {}
+
+    enabled = True
+
+    _lock = threading.Lock()
+    _stats: dict[tuple[str, str], _StageStats] = {}
+    _recent: deque[ModelCall] = deque(maxlen=RECENT_CALLS)
+
+    # ==========================================================
+    # 记录
+    # ==========================================================
+
+    @classmethod
+    @contextmanager
+    def session(cls, session_key: str) -> Iterator[None]:
+        """
+        在 with 块内发起的模型调用都归属于 session_key
+        """
+
+        token = _session_var.set(session_key)
+        try:
+            yield
+        finally:
+            _session_var.reset(token)
+
+    @classmethod
+    @contextmanager
+    def track(cls, stage: str, model: str, stream: bool = False) -> Iterator[CallHandle]:
+        """
+        统计 with 块内的一次模型调用；块内抛出的异常记为失败并继续抛出
+
+        Parameters
+        ----------
+        stream
+            with 块内有 yield（异步生成器逐段产出）时传 True：span 不能跨 yield 保持在
+            contextvar 中（会留在消费方的上下文里，消费方之后开的 span 都会挂到模型调用下面），
+            改为结束时用 Tracer.add_span 补记到开始时的 span 下
+        """
+
+        call = CallHandle()
+        error = ""
+        cancelled = False
+        parent = Tracer.active() if stream else None
+        start = time.time()
+        try:
+            if stream:
+                yield call
+            else:
+                # 在 trace 中时同时记一个 span
+                with Tracer.span(f"model.{stage}", model=model):
+                    yield call
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        except BaseException:
+            # 任务取消或流式迭代被提前关闭，不算接口失败
+            cancelled = True
+            raise
+        finally:
+            if parent is not None:
+                attrs = {"error": error} if error else {}
+                Tracer.add_span(f"model.{stage}", start, parent=parent, model=model, **attrs)
+            cls.record(
+                stage,
+                model,
+                time.perf_counter() - call._start,
+                usage=call.usage,
+                error=error or call.error,
+                cancelled=cancelled,
+                first_token=call.first_token,
+            )
+
+    @classmethod
+    def record(
+            cls,
+            stage: str,
+            model: str,
+            latency: float,
+            usage=None,
+            error: str = "",
+            cancelled: bool = False,
+            first_token: float | None = None,
+    ) -> None:
+        """
+        记录一次调用
+
+        Parameters
+        ----------
+        usage
+            OpenAI 的 CompletionUsage 或 DashScope 的 usage，缺失时 token 记为 0
+        error
+            非空表示调用失败
+        """
+
+        if not cls.enabled:
+            return
+
+        prompt_tokens, completion_tokens, cached_tokens = cls._usage_tokens(usage)
+        now = time.time()
+        call = ModelCall(
+            ts=now,
+            stage=stage,
+            model=str(model),
+            session=_session_var.get(),
+            latency=latency,
+            ok=not error,
+            cancelled=cancelled,
+            error=error,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            first_token=first_token,
+        )
+
+        with cls._lock:
+            stats = cls._stats.get((stage, call.model))
+            if stats is None:
+                stats = _StageStats(buckets=[0] * (len(cls.BUCKETS) + 1))
+                cls._stats[(stage, call.model)] = stats
+
+            stats.calls += 1
+            stats.errors += 0 if call.ok else 1
+            stats.cancelled += 1 if cancelled else 0
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cached_tokens += cached_tokens
+            stats.latency_sum += latency
+            stats.buckets[bisect.bisect_left(cls.BUCKETS, latency)] += 1
+
+            stats.window.append((now, latency))
+            while stats.window and (
+                    len(stats.window) > cls.WINDOW_SIZE or stats.window[0][0] < now - cls.WINDOW_SECONDS
+            ):
+                stats.window.popleft()
+
+            cls._recent.append(call)
+
+        if error:
+            logger.warning("[ModelCallMetrics] %s/%s 调用失败（%.2fs）：%s", stage, call.model, latency, error)
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls._stats.clear()
+            cls._recent.clear()
+
+    # ==========================================================
+    # 查询与导出
+    # ==========================================================
+
+    @classmethod
+    def snapshot(cls) -> list[dict]:
+        """
+        每个 (stage, model) 的聚合结果，按累计耗时从高到低排序
+        """
+
+        now = time.time()
+        with cls._lock:
+            items = [
+                (stage, model, stats, sorted(lat for ts, lat in stats.window if ts >= now - cls.WINDOW_SECONDS))
+                for (stage, model), stats in cls._stats.items()
+            ]
+
+            rows = []
+            for stage, model, stats, window in items:
+                rows.append({
+                    "stage": stage,
+                    "model": model,
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "cancelled": stats.cancelled,
+                    "error_rate": stats.errors / stats.calls if stats.calls else 0.0,
+                    "prompt_tokens": stats.prompt_tokens,
+                    "completion_tokens": stats.completion_tokens,
+                    "cached_tokens": stats.cached_tokens,
+                    "latency_sum": stats.latency_sum,
+                    "latency_avg": stats.latency_sum / stats.calls if stats.calls else 0.0,
+                    "window_calls": len(window),
+                    "p50": cls._percentile(window, 0.50),
+                    "p95": cls._percentile(window, 0.95),
+                    "max": window[-1] if window else 0.0,
+                    "cost": cls._cost(model, stats),
+                })
+
+        rows.sort(key=lambda row: row["latency_sum"], reverse=True)
+        return rows
+
+    @classmethod
+    def report(cls) -> str:
+        """
+        适合直接发到聊天里的文字报表
+        """
+
+        rows = cls.snapshot()
+        if not rows:
+            return "还没有模型调用记录"
+
+        total_time = sum(row["latency_sum"] for row in rows) or 1.0
+        lines = [f"模型调用统计（滚动窗口 {cls.WINDOW_SECONDS // 60} 分钟）："]
+        for row in rows:
+            line = (
+                f"{row['stage']}[{row['model']}] "
+                f"{row['calls']}次 失败{row['errors']} "
+                f"p50={row['p50']:.2f}s p95={row['p95']:.2f}s "
+                f"耗时占比{row['latency_sum'] / total_time:.0%} "
+                f"tokens 入{row['prompt_tokens']}(缓存{row['cached_tokens']}) 出{row['completion_tokens']}"
+            )
+            if row["cost"] is not None:
+                line += f" 约{row['cost']:.4f}元"
+            lines.append(line)
+        return "\n".join(lines)
+
+    @classmethod
+    def to_prometheus(cls) -> str:
+        """
+        Prometheus 文本格式
+        """
+
+        with cls._lock:
+            items = [
+                (stage, model, _StageStats(**{**vars(stats), "buckets": list(stats.buckets), "window": deque()}))
+                for (stage, model), stats in cls._stats.items()
+            ]
+
+        lines = [
+            "# HELP model_call_latency_seconds 模型调用耗时",
+            "# TYPE model_call_latency_seconds histogram",
+        ]
+        for stage, model, stats in items:
+            labels = f'stage="{cls._escape(stage)}",model="{cls._escape(model)}"'
+            cumulative = 0
+            for bound, count in zip((*cls.BUCKETS, "+Inf"), stats.buckets):
+                cumulative += count
+                lines.append(f'model_call_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"model_call_latency_seconds_sum{{{labels}}} {stats.latency_sum:.6f}")
+            lines.append(f"model_call_latency_seconds_count{{{labels}}} {stats.calls}")
+
+        lines += [
+            "# HELP model_call_errors_total 失败的模型调用次数",
+            "# TYPE model_call_errors_total counter",
+        ]
+        for stage, model, stats in items:
+            labels = f'stage="{cls._escape(stage)}",model="{cls._escape(model)}"'
+            lines.append(f"model_call_errors_total{{{labels}}} {stats.errors}")
+
+        lines += [
+            "# HELP model_call_tokens_total 模型调用的 token 数",
+            "# TYPE model_call_tokens_total counter",
+        ]
+        for stage, model, stats in items:
+            labels = f'stage="{cls._escape(stage)}",model="{cls._escape(model)}"'
+            for kind in ("prompt", "completion", "cached"):
+                lines.append(
+                    f'model_call_tokens_total{{{labels},kind="{kind}"}} {getattr(stats, f"{kind}_tokens")}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def export(cls, directory: str | Path = METRICS_DIR) -> tuple[Path, Path]:
+        """
+        导出最近调用明细（JSONL）与聚合指标（Prometheus 文本）
+
+        Returns
+        -------
+        tuple[Path, Path]
+            (calls_<时间>.jsonl, model_calls.prom)
+        """
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        with cls._lock:
+            calls = list(cls._recent)
+
+        jsonl_path = directory / f"calls_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            for call in calls:
+                f.write(json.dumps(asdict(call), ensure_ascii=False) + "\n")
+
+        prom_path = directory / "model_calls.prom"
+        tmp_path = prom_path.with_name(f"{prom_path.name}.tmp")
+        tmp_path.write_text(cls.to_prometheus(), encoding="utf-8")
+        tmp_path.replace(prom_path)
+
+        return jsonl_path, prom_path
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    @classmethod
+    def _usage_tokens(cls, usage) -> tuple[int, int, int]:
+        """
+        兼容 OpenAI / DeepSeek 与 DashScope 的 usage 字段
+        """
+
+        if usage is None:
+            return 0, 0, 0
+
+        def get(obj, name):
+            if obj is None:
+                return None
+            if isinstance(obj, Mapping):
+                return obj.get(name)
+            return getattr(obj, name, None)
+
+        prompt = get(usage, "prompt_tokens") or get(usage, "input_tokens") or 0
+        completion = get(usage, "completion_tokens") or get(usage, "output_tokens") or 0
+        cached = get(usage, "prompt_cache_hit_tokens")
+        if cached is None:
+            cached = get(get(usage, "prompt_tokens_details"), "cached_tokens") or 0
+
+        return int(prompt), int(completion), int(cached)
+
+    @classmethod
+    def _cost(cls, model: str, stats: _StageStats) -> float | None:
+        price = cls.PRICES.get(model)
+        if price is None:
+            return None
+        miss_price, hit_price, output_price = price
+        miss_tokens = max(0, stats.prompt_tokens - stats.cached_tokens)
+        return (
+                miss_tokens * miss_price
+                + stats.cached_tokens * hit_price
+                + stats.completion_tokens * output_price
+        ) / 1_000_000
+
+    @staticmethod
+    def _percentile(values: list[float], q: float) -> float:
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+if __name__ == "__main__":
+    import random
+
+    with ModelCallMetrics.session("demo"):
+        for _ in range(200):
+            ModelCallMetrics.record(
+                "chat",
+                "deepseek-v4-pro",
+                random.uniform(0.5, 8),
+                usage={"prompt_tokens": 3000, "completion_tokens": 200, "prompt_cache_hit_tokens": 2500},
+            )
+
+    start = time.perf_counter()
+    for _ in range(10000):
+        ModelCallMetrics.record("bench", "m", 0.01)
+    print(f"record: {(time.perf_counter() - start) / 10000 * 1e6:.1f}us/次")
+
+    print(ModelCallMetrics.report())
+    print(ModelCallMetrics.to_prometheus())
@@ -1,23 +1,44 @@
 from __future__ import annotations
 
 import hashlib
+import os
+import posixpath
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import requests
-
 from src.config.path import EMOJI_HASH_DIR
+from src.utils.tools.fetcher import MediaFetcher
+from src.utils.tools.res.perceptual_hash import MultiIndexHash, PerceptualHash
 
 
 class EmojiDetector:
     """
     判断网络图片是否属于本地表情包库。
 
-    使用 SHA-256 精确匹配。
+    默认使用 SHA-256 精确匹配。
 
     初始化时自动同步 SQLite 数据库，
     所有 SHA256 会加载到内存 set 中，
     后续判断复杂度为 O(1)。
+
+    QQ 转发图片时会重新编码、缩放，SHA-256 往往对不上。
+    开启 perceptual 后，数据库额外保存每张表情的感知哈希（列名即哈希类型），
+    精确匹配失败时再用 MultiIndexHash 查找汉明距离 ≤ max_distance 的表情。
+
+    同步是增量的：
+
+        - 数据库记录每个目录的 mtime，目录 mtime 未变时不再列目录、不再 stat 其中的文件，
+          只继续检查子目录（在目录中增删、重命名文件都会改变目录 mtime）；
+        - 新增或变化的文件用线程池并发计算哈希，结果在一个事务中 executemany 写入；
+        - sha_set 与感知哈希索引按差异增量更新，不重新加载。
+
+    原地覆盖写入、目录 mtime 不变的修改检测不到，需要时调用 sync(full=True)。
+
+    background=True 时初始同步在后台线程进行，构造函数只加载上次的数据库；
+    watch_interval 大于 0 时后台线程按该间隔轮询同步，表情库变化无需重启 bot。
     """
 
     IMAGE_SUFFIXES = {
@@ -29,12 +50,46 @@ class EmojiDetector:
         ".webp",
     }
 
+    # 计算哈希的线程数
+    SYNC_WORKERS = min(8, os.cpu_count() or 4)
+
     def __init__(
             self,
             emoji_dir: str | Path,
             cache_dir: str | Path = EMOJI_HASH_DIR,
+            perceptual: bool = False,
+            hash_kind: str = "phash",
+            max_distance: int = 6,
+            background: bool = False,
+            watch_interval: float = 0,
     ):
+        """
+        Parameters
+        ----------
+        emoji_dir
+            表情包目录
+        cache_dir
+            SQLite 缓存目录
+        perceptual
+            是否启用感知哈希近似匹配
+        hash_kind
+            ahash / dhash / phash
+        max_distance
+            感知哈希的最大汉明距离（64 位），越大召回越高、误报越多
+        background
+            是否在后台线程执行初始同步
+        watch_interval
+            轮询同步间隔（秒），0 表示不监视
+        """
+
+        if hash_kind not in PerceptualHash.KINDS:
+            raise ValueError(f"不支持的感知哈希类型: {hash_kind}")
+
         self.emoji_dir = Path(emoji_dir)
+        self.perceptual = perceptual
+        self.hash_kind = hash_kind
+        self.max_distance = max_distance
+        self.watch_interval = watch_interval
 
         cache_dir = Path(cache_dir)
         cache_dir.mkdir(parents=True, exist_ok=True)
@@ -43,15 +98,39 @@ class EmojiDetector:
         path_hash = hashlib.sha256(str(self.emoji_dir.resolve()).encode("utf-8")).hexdigest()[:16]
         self.db_path = cache_dir / f"{self.emoji_dir.name}_{path_hash}.db"
 
-        self.conn = sqlite3.connect(self.db_path)
+        # 同步可能在后台线程执行，连接跨线程使用，由 _sync_lock 串行化
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
 
-        self.session = requests.Session()
+        # _sync_lock：同一时间只有一个同步；_index_lock：保护 sha_set 与感知哈希索引
+        self._sync_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
 
         self._create_table()
-        self._sync_database()
 
-        self.sha_set = self._load_sha_set()
+        # sha256 -> 文件数，同一张图存了多份时删除一份不影响判断
+        self._sha_counts: dict[str, int] = {}
+        self.sha_set: set[str] = set()
+        self.phash_index = MultiIndexHash(max_distance) if perceptual else None
+        self._load_index()
+
+        if background or watch_interval > 0:
+            self._thread = threading.Thread(
+                target=self._run_background,
+                args=(not background,),
+                name="EmojiSync",
+                daemon=True,
+            )
+            if not background:
+                self.sync()
+                self._ready.set()
+            self._thread.start()
+        else:
+            self.sync()
+            self._ready.set()
 
     # ==========================================================
     # Public
@@ -70,25 +149,75 @@ class EmojiDetector:
             return False
         try:
             data = self._download(image_url)
-            sha = self._calc_sha256_bytes(data)
-            # print("network:", sha)
-            # print("exist:", sha in self.sha_set)
         except Exception as e:
             print(f"下载图片失败: {image_url}，错误: {e}")
             return False
 
-        return sha in self.sha_set
+        return self.is_emoji_bytes(data)
 
     def is_emoji_file(self, path: str | Path) -> bool:
         """判断本地图片文件是否属于表情包库，避免再次下载同一张网络图。"""
+        path = Path(path)
         try:
-            return self._calc_sha256(Path(path)) in self.sha_set
+            if self._calc_sha256(path) in self.sha_set:
+                return True
+            return self._match_perceptual(path)
         except Exception:
             return False
 
+    def is_emoji_bytes(self, data: bytes) -> bool:
+        """判断已经下载好的图片是否属于表情包库。"""
+        if self._calc_sha256_bytes(data) in self.sha_set:
+            return True
+        return self._match_perceptual(data)
+
+    def find_similar(self, image: bytes | str | Path) -> list[tuple[int, str]]:
+        """
+        返回与图片相近的表情 [(汉明距离, 相对路径)]，按距离排序；未开启 perceptual 时为空
+        """
+
+        if self.phash_index is None:
+            return []
+        try:
+            hash_value = PerceptualHash.compute(image, self.hash_kind)
+        except Exception:
+            return []
+        with self._index_lock:
+            return self.phash_index.search(hash_value, self.max_distance)
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """
+        等待初始同步完成
+        """
+
+        return self._ready.wait(timeout)
+
+    def sync(self, full: bool = False) -> tuple[int, int]:
+        """
+        增量同步表情目录到数据库与内存索引
+
+        Parameters
+        ----------
+        full
+            忽略目录 mtime，重新列出并 stat 所有文件
+
+        Returns
+        -------
+        tuple[int, int]
+            (新增或更新的文件数, 删除的文件数)
+        """
+
+        with self._sync_lock:
+            if self._stop.is_set():
+                return 0, 0
+            return self._sync_database(full)
+
     def close(self):
-        self.session.close()
-        self.conn.close()
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._sync_lock:
+            self.conn.close()
 
     # ==========================================================
     # Database
@@ -111,104 +240,311 @@ class EmojiDetector:
             """
         )
 
+        # 目录 mtime，用于跳过未变化的目录
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS emoji_dirs(
+
+                path TEXT PRIMARY KEY,
+
+                mtime REAL NOT NULL
+            )
+            """
+        )
+
+        # 感知哈希列按需添加，旧库升级后该列为 NULL，下次同步时补算
+        if self.perceptual:
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(emoji)")}
+            if self.hash_kind not in columns:
+                self.conn.execute(f"ALTER TABLE emoji ADD COLUMN {self.hash_kind} INTEGER")
+
         self.conn.commit()
 
-    def _sync_database(self):
+    def _sync_database(self, full: bool = False) -> tuple[int, int]:
 
-        cursor = self.conn.cursor()
+        start = time.perf_counter()
+        hash_column = f", {self.hash_kind}" if self.perceptual else ""
 
         db_files = {}
 
-        for row in cursor.execute(
-                """
-                SELECT path,mtime,size
+        for row in self.conn.execute(
+                f"""
+                SELECT path,mtime,size,sha256{hash_column}
                 FROM emoji
                 """
         ):
             db_files[row["path"]] = (
                 row["mtime"],
                 row["size"],
+                row["sha256"],
+                row[self.hash_kind] if self.perceptual else None,
             )
 
+        db_dirs = {
+            row["path"]: row["mtime"]
+            for row in self.conn.execute("SELECT path,mtime FROM emoji_dirs")
+        }
+
+        disk_files, disk_dirs = self._scan(db_files, db_dirs, full)
+
+        # 删除数据库中已经不存在的图片
+        removed = [path for path in db_files if path not in disk_files]
+
+        # 新增或更新；开启感知哈希后，旧库中缺少感知哈希的行也要补算
+        pending = []
+
+        for rel_path, (mtime, size) in disk_files.items():
+            old = db_files.get(rel_path)
+
+            if old is None or old[0] != mtime or old[1] != size:
+                pending.append((rel_path, mtime, size, None))
+            elif self.perceptual and old[3] is None:
+                pending.append((rel_path, mtime, size, old[2]))
+
+        rows = self._hash_files(pending)
+
+        # 有文件读取失败的目录不记录新的 mtime，下次增量同步会重新扫描它
+        hashed = {row[0] for row in rows}
+        failed_dirs = {posixpath.dirname(item[0]) for item in pending if item[0] not in hashed}
+
+        changed_dirs = [
+            (path, mtime)
+            for path, mtime in disk_dirs.items()
+            if db_dirs.get(path) != mtime and path not in failed_dirs
+        ]
+        removed_dirs = [(path,) for path in db_dirs if path not in disk_dirs]
+
+        if not (removed or rows or changed_dirs or removed_dirs):
+            return 0, 0
+
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM emoji WHERE path=?",
+                [(path,) for path in removed],
+            )
+
+            if self.perceptual:
+                self.conn.executemany(
+                    f"""
+                    INSERT OR REPLACE INTO emoji
+                    (path, mtime, size, sha256, {self.hash_kind})
+                    VALUES (?,?,?,?,?)
+                    """,
+                    rows,
+                )
+            else:
+                self.conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO emoji
+                    (path, mtime, size, sha256)
+                    VALUES (?,?,?,?)
+                    """,
+                    [row[:4] for row in rows],
+                )
+
+            self.conn.executemany("DELETE FROM emoji_dirs WHERE path=?", removed_dirs)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO emoji_dirs(path, mtime) VALUES (?,?)",
+                changed_dirs,
+            )
+
+        self._update_index(
+            removed=[(path, db_files[path]) for path in removed],
+            updated=[(row, db_files.get(row[0])) for row in rows],
+        )
+
+        if removed or rows:
+            print(
+                f"[EmojiDetector] 同步 {self.emoji_dir.name}：更新 {len(rows)}，删除 {len(removed)}，"
+                f"耗时 {time.perf_counter() - start:.2f}s"
+            )
+
+        return len(rows), len(removed)
+
+    def _scan(
+            self,
+            db_files: dict[str, tuple],
+            db_dirs: dict[str, float],
+            full: bool,
+    ) -> tuple[dict[str, tuple[float, int]], dict[str, float]]:
+        """
+        遍历表情目录，目录 mtime 未变时直接沿用数据库中该目录的文件
+
+        Returns
+        -------
+        tuple
+            ({相对路径: (mtime, size)}, {相对目录: mtime})
+        """
+
+        files_by_dir: dict[str, list[str]] = {}
+        for rel_path in db_files:
+            files_by_dir.setdefault(posixpath.dirname(rel_path), []).append(rel_path)
+
+        subdirs_by_dir: dict[str, list[str]] = {}
+        for rel_dir in db_dirs:
+            if rel_dir:
+                subdirs_by_dir.setdefault(posixpath.dirname(rel_dir), []).append(rel_dir)
+
         disk_files = {}
+        disk_dirs = {}
+        stack = [""]
 
-        for file in self.emoji_dir.rglob("*"):
+        while stack:
+            rel_dir = stack.pop()
+            abs_dir = self.emoji_dir / rel_dir if rel_dir else self.emoji_dir
 
-            if not file.is_file():
+            try:
+                dir_mtime = abs_dir.stat().st_mtime
+            except OSError:
                 continue
 
-            if file.suffix.lower() not in self.IMAGE_SUFFIXES:
+            disk_dirs[rel_dir] = dir_mtime
+
+            if not full and db_dirs.get(rel_dir) == dir_mtime:
+                for rel_path in files_by_dir.get(rel_dir, ()):
+                    disk_files[rel_path] = db_files[rel_path][:2]
+                stack.extend(subdirs_by_dir.get(rel_dir, ()))
                 continue
 
-            stat = file.stat()
+            try:
+                entries = list(os.scandir(abs_dir))
+            except OSError:
+                continue
 
-            rel_path = file.relative_to(self.emoji_dir).as_posix()
+            for entry in entries:
+                rel_path = posixpath.join(rel_dir, entry.name) if rel_dir else entry.name
 
-            disk_files[rel_path] = (
-                stat.st_mtime,
-                stat.st_size,
-                file,
-            )
+                if entry.is_dir():
+                    stack.append(rel_path)
+                    continue
 
-        # 删除数据库中已经不存在的图片
+                if not entry.is_file():
+                    continue
 
-        for path in set(db_files) - set(disk_files):
-            cursor.execute(
-                "DELETE FROM emoji WHERE path=?",
-                (path,),
-            )
+                if Path(entry.name).suffix.lower() not in self.IMAGE_SUFFIXES:
+                    continue
 
-        # 新增或更新
+                stat = entry.stat()
+                disk_files[rel_path] = (stat.st_mtime, stat.st_size)
 
-        for rel_path, (mtime, size, file) in disk_files.items():
+        return disk_files, disk_dirs
 
-            update = False
+    def _hash_files(self, pending: list[tuple[str, float, int, str | None]]) -> list[tuple]:
+        """
+        线程池中计算 SHA256（及感知哈希），返回待写入的行
 
-            if rel_path not in db_files:
-                update = True
-            else:
-                old_mtime, old_size = db_files[rel_path]
+        pending 中第四项为已知的 SHA256（只需补算感知哈希时），否则为 None
+        """
 
-                if old_mtime != mtime or old_size != size:
-                    update = True
+        def work(item):
+            rel_path, mtime, size, sha = item
+            file = self.emoji_dir / rel_path
 
-            if update:
-                sha = self._calc_sha256(file)
+            try:
+                if sha is None:
+                    sha = self._calc_sha256(file)
+            except OSError as e:
+                # 扫描后被删除或无法读取，留到下次同步
+                print(f"读取表情失败: {rel_path}，错误: {e}")
+                return None
 
-                cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO emoji
-                    (
-                        path,
-                        mtime,
-                        size,
-                        sha256
-                    )
-                    VALUES (?,?,?,?)
-                    """,
-                    (
-                        rel_path,
-                        mtime,
-                        size,
-                        sha,
-                    ),
-                )
+            hash_value = None
+            if self.perceptual:
+                try:
+                    hash_value = PerceptualHash.to_signed(PerceptualHash.compute(file, self.hash_kind))
+                except Exception as e:
+                    print(f"计算感知哈希失败: {rel_path}，错误: {e}")
 
-        self.conn.commit()
+            return rel_path, mtime, size, sha, hash_value
 
-    def _load_sha_set(self) -> set[str]:
+        if not pending:
+            return []
+
+        if len(pending) == 1:
+            results = [work(pending[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=self.SYNC_WORKERS, thread_name_prefix="EmojiHash") as pool:
+                results = list(pool.map(work, pending))
+
+        return [row for row in results if row is not None]
+
+    def _load_index(self):
+
+        hash_column = f", {self.hash_kind}" if self.perceptual else ""
 
         cursor = self.conn.execute(
-            """
-            SELECT sha256
+            f"""
+            SELECT path, sha256{hash_column}
             FROM emoji
             """
         )
 
-        return {
-            row["sha256"]
-            for row in cursor
-        }
+        with self._index_lock:
+            for row in cursor:
+                self._add_sha(row["sha256"])
+                if self.perceptual and row[self.hash_kind] is not None:
+                    self.phash_index.add(PerceptualHash.to_unsigned(row[self.hash_kind]), row["path"])
+
+    def _update_index(
+            self,
+            removed: list[tuple[str, tuple]],
+            updated: list[tuple[tuple, tuple | None]],
+    ):
+        """
+        按同步差异增量更新 sha_set 与感知哈希索引
+
+        removed 为 [(path, 旧行)]，updated 为 [(新行, 旧行或 None)]
+        """
+
+        with self._index_lock:
+            for path, (_, _, sha, hash_value) in removed:
+                self._remove_sha(sha)
+                if self.phash_index is not None and hash_value is not None:
+                    self.phash_index.remove(PerceptualHash.to_unsigned(hash_value), path)
+
+            for (path, _, _, sha, hash_value), old in updated:
+                if old is not None:
+                    self._remove_sha(old[2])
+                    if self.phash_index is not None and old[3] is not None:
+                        self.phash_index.remove(PerceptualHash.to_unsigned(old[3]), path)
+
+                self._add_sha(sha)
+                if self.phash_index is not None and hash_value is not None:
+                    self.phash_index.add(PerceptualHash.to_unsigned(hash_value), path)
+
+    def _add_sha(self, sha: str):
+        self._sha_counts[sha] = self._sha_counts.get(sha, 0) + 1
+        self.sha_set.add(sha)
+
+    def _remove_sha(self, sha: str):
+        count = self._sha_counts.get(sha, 0) - 1
+        if count > 0:
+            self._sha_counts[sha] = count
+        else:
+            self._sha_counts.pop(sha, None)
+            self.sha_set.discard(sha)
+
+    def _run_background(self, skip_initial: bool):
+
+        if not skip_initial:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[EmojiDetector] 后台同步失败: {e}")
+            finally:
+                self._ready.set()
+
+        if self.watch_interval <= 0:
+            return
+
+        while not self._stop.wait(self.watch_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[EmojiDetector] 轮询同步失败: {e}")
+
+    def _match_perceptual(self, image: bytes | Path) -> bool:
+        return bool(self.find_similar(image))
 
     # ==========================================================
     # SHA256
@@ -234,9 +570,7 @@ class EmojiDetector:
 
     @staticmethod
     def _download(url: str) -> bytes:
-        response = requests.get(url, timeout=20)
-        response.raise_for_status()
-        return response.content
+        return MediaFetcher.fetch(url)
 
     @staticmethod
     def _calc_sha256_bytes(data: bytes) -> str:
@@ -252,6 +586,7 @@ class EmojiDetector:
 if __name__ == "__main__":
     emoji_detector = EmojiDetector(
         emoji_dir=r"D:\Users\Administrator\Desktop\Emoji\LuoTianyi",
+        perceptual=True,
     )
     print(emoji_detector._calc_sha256(Path(r"D:\Users\Administrator\Desktop\Emoji\LuoTianyi\探头.jpg")))
     test_url = "https://multimedia.nt.qq.com.cn/download?appid=1406&fileid=EhRhQHjb1gOKhfNAj5K8vFj45itAJRi92gIg_gooksWOkO3PlQMyBHByb2RQgLsvWhCu8LFaYy91vEFoRErxOXXAegJuPYIBAmd6&rkey=CAQSMLZByR-pFjttB2Qz6hACUflyATJX5RhqSSABGczxLtGIg3d-YBqOD4uz-WINwnyyNQ"
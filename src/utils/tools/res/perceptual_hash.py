@@ -0,0 +1,387 @@
+from __future__ import annotations
+
+import io
+import random
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Generic, TypeVar
+
+import numpy as np
+from PIL import Image
+
+V = TypeVar("V")
+
+
+class PerceptualHash:
+    """
+    64 位感知哈希。
+
+    QQ 转发图片时会重新编码、缩放、压缩，SHA-256 完全不同，但感知哈希只差几位，
+    用汉明距离判断是否为同一张图：
+
+        - ahash：8x8 灰度图与均值比较，最快，对亮度/对比度变化敏感；
+        - dhash：9x8 灰度图相邻像素比较，对缩放和压缩稳定；
+        - phash：32x32 灰度图做 DCT，取低频 8x8 与中位数比较，最稳健（默认）。
+
+    动图只取第一帧。
+    """
+
+    KINDS = ("ahash", "dhash", "phash")
+
+    _dct_matrix: np.ndarray | None = None
+
+    @classmethod
+    def compute(cls, image: Image.Image | bytes | str | Path, kind: str = "phash") -> int:
+        """
+        计算感知哈希
+
+        Parameters
+        ----------
+        image
+            PIL 图片、图片字节或文件路径
+        kind
+            ahash / dhash / phash
+        """
+
+        if kind not in cls.KINDS:
+            raise ValueError(f"不支持的感知哈希类型: {kind}")
+
+        if isinstance(image, bytes):
+            image = Image.open(io.BytesIO(image))
+        elif isinstance(image, (str, Path)):
+            with Image.open(image) as f:
+                f.load()
+                image = f.copy()
+
+        return getattr(cls, kind)(image)
+
+    @classmethod
+    def ahash(cls, image: Image.Image) -> int:
+        pixels = cls._gray(image, (8, 8))
+        return cls._to_int(pixels > pixels.mean())
+
+    @classmethod
+    def dhash(cls, image: Image.Image) -> int:
+        pixels = cls._gray(image, (9, 8))
+        return cls._to_int(pixels[:, 1:] > pixels[:, :-1])
+
+    @classmethod
+    def phash(cls, image: Image.Image) -> int:
+        pixels = cls._gray(image, (32, 32))
+        dct = cls._dct()
+        low = (dct @ pixels @ dct.T)[:8, :8].flatten()
+        # 不含直流分量求中位数，避免整体亮度主导结果
+        return cls._to_int(low > np.median(low[1:]))
+
+    @staticmethod
+    def hamming(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+
+    # ==========================================================
+    # SQLite 存储（INTEGER 是有符号 64 位）
+    # ==========================================================
+
+    @staticmethod
+    def to_signed(value: int) -> int:
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    @staticmethod
+    def to_unsigned(value: int) -> int:
+        return value + (1 << 64) if value < 0 else value
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    @staticmethod
+    def _gray(image: Image.Image, size: tuple[int, int]) -> np.ndarray:
+        if getattr(image, "is_animated", False):
+            image.seek(0)
+        if image.mode in ("RGBA", "LA", "P"):
+            # 透明背景统一铺白，与 ImageResizer 的处理一致
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        gray = image.convert("L").resize(size, Image.Resampling.LANCZOS)
+        return np.asarray(gray, dtype=np.float64)
+
+    @staticmethod
+    def _to_int(bits: np.ndarray) -> int:
+        return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+    @classmethod
+    def _dct(cls) -> np.ndarray:
+        """
+        32 点 DCT-II 变换矩阵
+        """
+
+        if cls._dct_matrix is None:
+            n = 32
+            k = np.arange(n).reshape(-1, 1)
+            i = np.arange(n).reshape(1, -1)
+            matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+            matrix[0] /= np.sqrt(2)
+            cls._dct_matrix = matrix
+        return cls._dct_matrix
+
+
+class BKTree(Generic[V]):
+    """
+    按汉明距离组织的 BK 树。
+
+    查询距离 ≤ d 的所有哈希时，利用三角不等式只访问 |dist - d| 范围内的子树，
+    几万个表情包的近似查询通常只需访问几百个节点。
+    """
+
+    def __init__(self, items: Iterable[tuple[int, V]] = ()):
+        # 节点：[hash, values, {distance: child}]
+        self._root: list | None = None
+        self._size = 0
+        for hash_value, value in items:
+            self.add(hash_value, value)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, hash_value: int, value: V) -> None:
+        self._size += 1
+
+        if self._root is None:
+            self._root = [hash_value, [value], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = PerceptualHash.hamming(hash_value, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [value], {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, max_distance: int) -> list[tuple[int, V]]:
+        """
+        返回距离 ≤ max_distance 的 (距离, 值)，按距离从小到大排序
+        """
+
+        if self._root is None:
+            return []
+
+        result = []
+        stack = [self._root]
+
+        while stack:
+            node = stack.pop()
+            distance = PerceptualHash.hamming(hash_value, node[0])
+            if distance <= max_distance:
+                result.extend((distance, value) for value in node[1])
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(
+                child
+                for child_distance, child in node[2].items()
+                if low <= child_distance <= high
+            )
+
+        result.sort(key=lambda item: item[0])
+        return result
+
+
+class MultiIndexHash(Generic[V]):
+    """
+    多索引哈希（multi-index hashing）。
+
+    把 64 位哈希切成 max_distance + 1 段，每段建一个字典。
+    由抽屉原理，距离 ≤ max_distance 的两个哈希至少有一段完全相同，
+    查询只需 max_distance + 1 次字典查找，再对少量候选计算汉明距离，与索引规模基本无关。
+    只支持 ≤ 建索引时 max_distance 的查询；需要任意距离时用 BKTree。
+    """
+
+    BITS = 64
+
+    def __init__(self, max_distance: int = 6, items: Iterable[tuple[int, V]] = ()):
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        # 各段的 (位移, 掩码)，前面的段多分一位
+        self._slices = []
+        start = 0
+        for index in range(chunks):
+            width = self.BITS // chunks + (1 if index < self.BITS % chunks else 0)
+            self._slices.append((self.BITS - start - width, (1 << width) - 1))
+            start += width
+
+        self._tables: list[dict[int, list[int]]] = [{} for _ in self._slices]
+        self._values: dict[int, list[V]] = {}
+
+        for hash_value, value in items:
+            self.add(hash_value, value)
+
+    def __len__(self) -> int:
+        return sum(len(values) for values in self._values.values())
+
+    def add(self, hash_value: int, value: V) -> None:
+        values = self._values.get(hash_value)
+        if values is not None:
+            values.append(value)
+            return
+
+        self._values[hash_value] = [value]
+        for table, (shift, mask) in zip(self._tables, self._slices):
+            table.setdefault((hash_value >> shift) & mask, []).append(hash_value)
+
+    def remove(self, hash_value: int, value: V) -> None:
+        values = self._values.get(hash_value)
+        if not values or value not in values:
+            return
+
+        values.remove(value)
+        if values:
+            return
+
+        del self._values[hash_value]
+        for table, (shift, mask) in zip(self._tables, self._slices):
+            key = (hash_value >> shift) & mask
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.remove(hash_value)
+                if not bucket:
+                    del table[key]
+
+    def search(self, hash_value: int, max_distance: int | None = None) -> list[tuple[int, V]]:
+        """
+        返回距离 ≤ max_distance 的 (距离, 值)，按距离从小到大排序
+        """
+
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance > self.max_distance:
+            raise ValueError(f"查询距离 {max_distance} 超过索引支持的 {self.max_distance}")
+
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._slices):
+            candidates.update(table.get((hash_value >> shift) & mask, ()))
+
+        result = []
+        for candidate in candidates:
+            distance = PerceptualHash.hamming(hash_value, candidate)
+            if distance <= max_distance:
+                result.extend((distance, value) for value in self._values[candidate])
+
+        result.sort(key=lambda item: item[0])
+        return result
+
+
+def benchmark(
+        emoji_dir: str | Path,
+        samples: int = 200,
+        max_distance: int = 6,
+        kind: str = "phash",
+        seed: int = 0,
+) -> dict:
+    """
+    对比 SHA-256 精确匹配与感知哈希的召回率和查询耗时。
+
+    从表情库随机抽取 samples 张图，模拟 QQ 转发（缩放 + JPEG 重新压缩）后查询；
+    另用同尺寸的随机噪声图估计误报率。
+
+    Returns
+    -------
+    dict
+        exact_recall / perceptual_recall / false_positive_rate / index_size /
+        exact_lookup_us / perceptual_hash_us（计算哈希）/
+        mih_lookup_us（MultiIndexHash 查询）/ bktree_lookup_us（BKTree 查询）
+    """
+
+    import hashlib
+
+    suffixes = {".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp"}
+    files = [
+        file for file in Path(emoji_dir).rglob("*")
+        if file.is_file() and file.suffix.lower() in suffixes
+    ]
+    if not files:
+        raise ValueError(f"表情目录为空: {emoji_dir}")
+
+    sha_set = set()
+    index: MultiIndexHash[str] = MultiIndexHash(max_distance)
+    tree: BKTree[str] = BKTree()
+    for file in files:
+        data = file.read_bytes()
+        sha_set.add(hashlib.sha256(data).hexdigest())
+        try:
+            hash_value = PerceptualHash.compute(data, kind)
+        except Exception:
+            continue
+        index.add(hash_value, file.name)
+        tree.add(hash_value, file.name)
+
+    rng = random.Random(seed)
+    picked = rng.sample(files, min(samples, len(files)))
+
+    exact_hits = perceptual_hits = false_hits = 0
+    exact_time = hash_time = mih_time = bktree_time = 0.0
+
+    for file in picked:
+        with Image.open(file) as image:
+            image = image.convert("RGB")
+            scale = rng.uniform(0.5, 0.9)
+            resized = image.resize(
+                (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                Image.Resampling.BILINEAR,
+            )
+            buffer = io.BytesIO()
+            resized.save(buffer, format="JPEG", quality=rng.randint(60, 85))
+            forwarded = buffer.getvalue()
+
+            noise = Image.fromarray(
+                np.random.default_rng(rng.randint(0, 1 << 30)).integers(
+                    0, 256, (image.height, image.width, 3), dtype=np.uint8
+                )
+            )
+
+        start = time.perf_counter()
+        exact_hits += hashlib.sha256(forwarded).hexdigest() in sha_set
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        hash_value = PerceptualHash.compute(forwarded, kind)
+        hash_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        perceptual_hits += bool(index.search(hash_value, max_distance))
+        mih_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        tree.search(hash_value, max_distance)
+        bktree_time += time.perf_counter() - start
+
+        false_hits += bool(index.search(PerceptualHash.compute(noise, kind), max_distance))
+
+    n = len(picked)
+    return {
+        "index_size": len(index),
+        "exact_recall": exact_hits / n,
+        "perceptual_recall": perceptual_hits / n,
+        "false_positive_rate": false_hits / n,
+        "exact_lookup_us": exact_time / n * 1e6,
+        "perceptual_hash_us": hash_time / n * 1e6,
+        "mih_lookup_us": mih_time / n * 1e6,
+        "bktree_lookup_us": bktree_time / n * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="感知哈希与 SHA-256 的表情包匹配对比")
+    parser.add_argument("emoji_dir")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--max-distance", type=int, default=6)
+    parser.add_argument("--kind", choices=PerceptualHash.KINDS, default="phash")
+    args = parser.parse_args()
+
+    for key, value in benchmark(args.emoji_dir, args.samples, args.max_distance, args.kind).items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
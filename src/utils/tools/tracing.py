@@ -0,0 +1,444 @@
+from __future__ import annotations
+
+import contextvars
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from src.config.path import METRICS_DIR
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    trace_id: str
+    # Chrome trace 的 tid：同一条 trace 的 span 画在同一行
+    tid: int
+    span_id: int
+    parent_id: int | None
+    name: str
+    start: float
+    # 所在 trace 的开始时间（收到消息的时间）
+    trace_start: float
+    end: float | None = None
+    thread: str = ""
+    attrs: dict = field(default_factory=dict)
+    error: str = ""
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+
+@dataclass(frozen=True)
+class TraceRef:
+    """
+    跨任务延续 trace 用的引用（例如 ReplyScheduler 稍后在另一个 Task 中执行回复）
+    """
+
+    trace_id: str
+    tid: int
+    # trace 开始的时间
+    start: float
+    # 取得引用的时间
+    at: float
+
+
+# 当前 span；BlockingExecutor 与 asyncio.create_task 会复制 contextvars，线程池和子任务中的 span 自动挂到调用方下面
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("trace_span", default=None)
+
+
+class Tracer:
+    """
+    进程级轻量 span 追踪。
+
+    每条消息一个 trace id，处理过程中的各阶段是嵌套的 span（开始/结束时间、所属线程、属性、异常）。
+    结束的 span 进入环形缓冲（最近 BUFFER_SIZE 个）；每当一个根 span 结束，
+    它所在 trace 新结束的 span 以 Chrome trace 事件追加到 TRACE_DIR/trace_<日期>.json，
+    可以直接用 chrome://tracing 或 Perfetto（ui.perfetto.dev）打开。
+    写文件由后台线程 TraceWriter 完成，结束 span 时只在锁内追加缓冲，不在事件循环上做文件 I/O；
+    退出前调用 close 写完队列中剩余的 span。
+
+    从收到消息到回复结束超过 SLOW_SECONDS 时，在日志中打印该 trace 各 span 的耗时。
+
+    不在 trace 中时 span() 什么都不做，可以放心地加在公共代码里。
+
+    用法：
+
+        with Tracer.trace("handle_message", session=session_id):
+            with Tracer.span("media"):
+                ...
+            ctx.trace = Tracer.current()
+
+        # 另一个 Task 中
+        with Tracer.trace("reply", trace=ctx.trace):
+            ...
+    """
+
+    BUFFER_SIZE = 20000
+    SLOW_SECONDS = 10.0
+    TRACE_DIR = METRICS_DIR / "traces"
+
+    enabled = True
+
+    _lock = threading.Lock()
+    _buffer: deque[Span] = deque(maxlen=BUFFER_SIZE)
+    # 已结束、尚未写入文件的 span
+    _pending: list[Span] = []
+    _span_ids = itertools.count(1)
+    _tids = itertools.count(1)
+
+    # 待写入文件的批次；None 为停止信号，Event 为 flush 请求
+    _queue: queue.Queue[list[Span] | threading.Event | None] = queue.Queue()
+    _writer: threading.Thread | None = None
+    _closed = False
+
+    # ==========================================================
+    # 记录
+    # ==========================================================
+
+    @classmethod
+    @contextmanager
+    def trace(cls, name: str, trace: TraceRef | None = None, **attrs) -> Iterator[Span | None]:
+        """
+        开始一个根 span
+
+        Parameters
+        ----------
+        trace
+            延续的 trace；缺省时新建 trace id
+        """
+
+        if not cls.enabled:
+            yield None
+            return
+
+        if trace is None:
+            trace_id, tid, trace_start = uuid.uuid4().hex[:16], next(cls._tids), None
+        else:
+            trace_id, tid, trace_start = trace.trace_id, trace.tid, trace.start
+
+        with cls._open(name, trace_id, tid, None, trace_start, attrs) as span:
+            yield span
+
+        if trace is not None:
+            total = span.end - trace.start
+            if total >= cls.SLOW_SECONDS:
+                cls._log_slow(trace_id, total)
+
+    @classmethod
+    @contextmanager
+    def span(cls, name: str, **attrs) -> Iterator[Span | None]:
+        """
+        当前 span 下的子 span；不在 trace 中时不记录
+        """
+
+        parent = _current_span.get()
+        if parent is None or not cls.enabled:
+            yield None
+            return
+
+        with cls._open(name, parent.trace_id, parent.tid, parent.span_id, parent.trace_start, attrs) as span:
+            yield span
+
+    @classmethod
+    def add_span(
+            cls,
+            name: str,
+            start: float,
+            end: float | None = None,
+            parent: Span | None = None,
+            **attrs,
+    ) -> None:
+        """
+        在当前 span 下补记一个已经发生的区间（例如调度器等待的时间）
+
+        Parameters
+        ----------
+        parent
+            挂在哪个 span 下，缺省为当前 span；跨 yield 的区间（流式生成）在开始时用 active() 取得
+        """
+
+        parent = parent or _current_span.get()
+        if parent is None or not cls.enabled:
+            return
+
+        span = Span(
+            trace_id=parent.trace_id,
+            tid=parent.tid,
+            span_id=next(cls._span_ids),
+            parent_id=parent.span_id,
+            name=name,
+            start=start,
+            trace_start=parent.trace_start,
+            end=end or time.time(),
+            thread=threading.current_thread().name,
+            attrs=attrs,
+        )
+        cls._finish(span)
+
+    @classmethod
+    def annotate(cls, **attrs) -> None:
+        """
+        给当前 span 补充属性
+        """
+
+        span = _current_span.get()
+        if span is not None:
+            span.attrs.update(attrs)
+
+    @classmethod
+    def active(cls) -> Span | None:
+        """
+        当前 span（不在 trace 中时为 None）
+        """
+
+        return _current_span.get()
+
+    @classmethod
+    def current(cls) -> TraceRef | None:
+        span = _current_span.get()
+        if span is None:
+            return None
+        return TraceRef(trace_id=span.trace_id, tid=span.tid, start=span.trace_start, at=time.time())
+
+    # ==========================================================
+    # 查询与导出
+    # ==========================================================
+
+    @classmethod
+    def recent(cls, trace_id: str | None = None) -> list[Span]:
+        """
+        环形缓冲中已结束的 span，按开始时间排序；指定 trace_id 时只返回该 trace
+        """
+
+        with cls._lock:
+            spans = [s for s in cls._buffer if trace_id is None or s.trace_id == trace_id]
+        return sorted(spans, key=lambda s: s.start)
+
+    @classmethod
+    def export(cls, path: str | Path | None = None) -> Path:
+        """
+        把环形缓冲中的全部 span 导出为完整的 Chrome trace 文件（{"traceEvents": [...]}）
+        """
+
+        path = Path(path) if path else cls.TRACE_DIR / f"trace_dump_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        events = [cls._to_event(span) for span in cls.recent()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return path
+
+    @classmethod
+    def flush(cls, timeout: float | None = None) -> bool:
+        """
+        等待此前结束的 trace 全部写入文件
+
+        Returns
+        -------
+        bool
+            超时返回 False
+        """
+
+        with cls._lock:
+            writer = cls._writer
+        if writer is None or not writer.is_alive() or threading.current_thread() is writer:
+            return True
+
+        done = threading.Event()
+        cls._queue.put(done)
+        return done.wait(timeout)
+
+    @classmethod
+    def close(cls) -> None:
+        """
+        写完队列中剩余的 trace 并停止后台线程；之后结束的 trace 直接同步写入
+        """
+
+        with cls._lock:
+            if cls._closed:
+                return
+            cls._closed = True
+            writer = cls._writer
+
+        if writer is not None:
+            cls._queue.put(None)
+            writer.join()
+
+    # ==========================================================
+    # Private
+    # ==========================================================
+
+    @classmethod
+    @contextmanager
+    def _open(
+            cls,
+            name: str,
+            trace_id: str,
+            tid: int,
+            parent_id: int | None,
+            trace_start: float | None,
+            attrs: dict,
+    ) -> Iterator[Span]:
+        start = time.time()
+        span = Span(
+            trace_id=trace_id,
+            tid=tid,
+            span_id=next(cls._span_ids),
+            parent_id=parent_id,
+            name=name,
+            start=start,
+            trace_start=trace_start or start,
+            thread=threading.current_thread().name,
+            attrs=attrs,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            span.end = time.time()
+            _current_span.reset(token)
+            cls._finish(span)
+
+    @classmethod
+    def _finish(cls, span: Span) -> None:
+        with cls._lock:
+            cls._buffer.append(span)
+            cls._pending.append(span)
+            if span.parent_id is not None:
+                return
+            flushed = [s for s in cls._pending if s.trace_id == span.trace_id]
+            cls._pending = [s for s in cls._pending if s.trace_id != span.trace_id]
+            # 未正常结束的 trace 留下的 span 不无限堆积
+            if len(cls._pending) > cls.BUFFER_SIZE:
+                cls._pending = cls._pending[-cls.BUFFER_SIZE:]
+
+            if not cls._closed:
+                if cls._writer is None:
+                    cls._writer = threading.Thread(target=cls._run_writer, name="TraceWriter", daemon=True)
+                    cls._writer.start()
+                cls._queue.put(flushed)
+                return
+
+        # 已经 close（退出过程中结束的 trace）：直接同步写，避免丢失
+        cls._write(flushed)
+
+    @classmethod
+    def _run_writer(cls) -> None:
+        while (item := cls._queue.get()) is not None:
+            if isinstance(item, threading.Event):
+                item.set()
+            else:
+                cls._write(item)
+
+        # close 与 flush 并发时，唤醒停止信号之后才排进队列的 flush 请求
+        while not cls._queue.empty():
+            item = cls._queue.get_nowait()
+            if isinstance(item, threading.Event):
+                item.set()
+
+    @classmethod
+    def _write(cls, spans: list[Span]) -> None:
+        try:
+            cls._append_events(spans)
+        except OSError as e:
+            logger.warning("[Tracer] 写入 trace 文件失败：%s", e)
+
+    @classmethod
+    def _append_events(cls, spans: list[Span]) -> None:
+        """
+        以 Chrome trace 的 JSON Array 格式追加（允许没有结尾的 ]）
+        """
+
+        path = cls.TRACE_DIR / f"trace_{time.strftime('%Y%m%d')}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        lines = [] if path.exists() else ["[\n"]
+        for span in sorted(spans, key=lambda s: s.start):
+            if span.parent_id is None and span.name == "handle_message":
+                lines.append(json.dumps({
+                    "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": span.tid,
+                    "args": {"name": f"trace {span.trace_id}"},
+                }) + ",\n")
+            lines.append(json.dumps(cls._to_event(span), ensure_ascii=False) + ",\n")
+
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    @staticmethod
+    def _to_event(span: Span) -> dict:
+        args = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "thread": span.thread,
+            **{key: str(value) for key, value in span.attrs.items()},
+        }
+        if span.error:
+            args["error"] = span.error
+        return {
+            "name": span.name,
+            "cat": "bot",
+            "ph": "X",
+            "ts": int(span.start * 1e6),
+            "dur": int(span.duration * 1e6),
+            "pid": os.getpid(),
+            "tid": span.tid,
+            "args": args,
+        }
+
+    @classmethod
+    def _log_slow(cls, trace_id: str, total: float) -> None:
+        spans = cls.recent(trace_id)
+        children: dict[int | None, list[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        lines = [f"[Tracer] trace {trace_id} 从收到消息到回复结束耗时 {total:.1f}s："]
+
+        def walk(parent_id: int | None, depth: int) -> None:
+            for span in children.get(parent_id, []):
+                error = f" ({span.error})" if span.error else ""
+                lines.append(f"{'  ' * (depth + 1)}{span.name} {span.duration:.2f}s{error}")
+                walk(span.span_id, depth + 1)
+
+        walk(None, 0)
+        logger.warning("\n".join(lines))
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    logging.basicConfig(level=logging.INFO)
+    Tracer.SLOW_SECONDS = 0.1
+
+    async def main():
+        with Tracer.trace("handle_message", session="demo"):
+            with Tracer.span("media"):
+                await asyncio.sleep(0.02)
+            ref = Tracer.current()
+
+        await asyncio.sleep(0.05)
+        with Tracer.trace("reply", trace=ref):
+            Tracer.add_span("reply_scheduler.wait", start=ref.at)
+            with Tracer.span("llm"):
+                await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    Tracer.close()
+    print(Tracer.export())
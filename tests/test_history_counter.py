@@ -0,0 +1,36 @@
+from src.QQ.QQutils.res.history_counter import MessageCounter
+
+
+def test_sync_waits_for_partial_header(tmp_path):
+    counter = MessageCounter("1", root=tmp_path)
+    file = tmp_path / "1" / "2026-07-13.txt"
+
+    file.write_text("[2026-07-13 09:59:32] 甲：你好\n", encoding="utf-8")
+    assert counter.sync(file) == 1
+
+    # 消息头分两次写入，sync 发生在中间
+    with file.open("a", encoding="utf-8") as f:
+        f.write("[2026-07-13 10:00")
+    assert counter.sync(file) == 1
+
+    with file.open("a", encoding="utf-8") as f:
+        f.write(":01] 乙：在吗\n")
+    assert counter.sync(file) == 2
+    assert counter.count(file) == 2
+    assert counter.recount(file) == 2
+
+    counter.close()
+
+
+def test_recount_ignores_partial_last_line(tmp_path):
+    counter = MessageCounter("1", root=tmp_path)
+    file = tmp_path / "1" / "2026-07-13.txt"
+
+    file.write_text("[2026-07-13 09:59:32] 甲：你好\n[2026-07-13 10:00:01] 乙：在", encoding="utf-8")
+    assert counter.recount(file) == 1
+
+    with file.open("a", encoding="utf-8") as f:
+        f.write("吗\n")
+    assert counter.count(file) == 2
+
+    counter.close()
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from src.QQ.QQutils.res.history_db import HistoryDatabase
+
+
+def _database(tmp_path) -> tuple[HistoryDatabase, list[str]]:
+    database = HistoryDatabase("1", root=tmp_path)
+    base = datetime(2026, 7, 1, 10).timestamp()
+    rows = [
+        (
+            {"timestamp": int(base + (i // 10) * 86400 + (i % 10) // 2), "is_private": False,
+             "session_id": 5, "message_id": i, "user_id": 1},
+            f"m{i}",
+        )
+        for i in range(35)
+    ]
+    database.insert_many(rows)
+    return database, [text for _, text in rows]
+
+
+def test_load_range_across_days(tmp_path):
+    database, texts = _database(tmp_path)
+    try:
+        for start in range(0, 36):
+            assert database.load_range("group", 5, start, start + 12) == texts[start:start + 12]
+
+        day = datetime(2026, 7, 2).date()
+        assert database.load_range("group", 5, 3, 8, day) == texts[13:18]
+    finally:
+        database.close()
+
+
+def test_load_page_cursor(tmp_path):
+    database, texts = _database(tmp_path)
+    try:
+        result, cursor = [], None
+        while True:
+            page, cursor = database.load_page("group", 5, 8, cursor)
+            if not page:
+                break
+            result.extend(page)
+        assert result == texts
+    finally:
+        database.close()
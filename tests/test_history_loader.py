@@ -0,0 +1,27 @@
+import json
+
+from src.QQ.QQutils.res.history_index import CANONICAL_INDEX
+from src.QQ.QQutils.res.history_loader import HistoryLoader
+
+
+def test_canonical_keeps_unicode_line_separators(tmp_path):
+    file = tmp_path / "2026-07-13.jsonl"
+    records = [{"text": "第一行 第二行"}, {"text": "下一\u0085条"}]
+    with file.open("w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    # 按索引读取与整天拆分都不能在 U+2028 / U+0085 处断行
+    assert [json.loads(line) for line in CANONICAL_INDEX.read(file, 0, 2)] == records
+    assert HistoryLoader._split_lines(file.read_text(encoding="utf-8")) == [
+        json.dumps(record, ensure_ascii=False) for record in records
+    ]
+
+
+def test_split_messages_keeps_unicode_line_separators():
+    history = "[2026-07-13 09:59:32] 甲：你好 世界\n[2026-07-13 10:00:01] 乙：在吗\r\n"
+
+    assert HistoryLoader._split_messages(history) == [
+        "[2026-07-13 09:59:32] 甲：你好 世界",
+        "[2026-07-13 10:00:01] 乙：在吗",
+    ]
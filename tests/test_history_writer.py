@@ -0,0 +1,15 @@
+from src.QQ.QQutils.res.history_writer import HistoryWriter
+
+
+def test_insert_batches_rows_per_sink():
+    batches = []
+    writer = HistoryWriter(flush_interval=60, flush_records=100)
+    try:
+        for i in range(3):
+            writer.insert(batches.append, i)
+        assert writer.flush(5)
+    finally:
+        writer.close()
+
+    # 同一批的行合并为一次调用（HistoryDatabase.insert_many 即一个事务）
+    assert batches == [[0, 1, 2]]
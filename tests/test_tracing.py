@@ -0,0 +1,52 @@
+import json
+import threading
+
+from src.utils.tools.tracing import Tracer
+
+
+def test_trace_file_written_off_caller_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(Tracer, "TRACE_DIR", tmp_path)
+    threads = []
+    append_events = Tracer._append_events.__func__
+
+    def spy(cls, spans):
+        threads.append(threading.current_thread().name)
+        append_events(cls, spans)
+
+    monkeypatch.setattr(Tracer, "_append_events", classmethod(spy))
+
+    with Tracer.trace("handle_message"):
+        with Tracer.span("media"):
+            pass
+    assert Tracer.flush(5)
+
+    assert threads == ["TraceWriter"]
+    (file,) = tmp_path.glob("trace_*.json")
+    events = json.loads(file.read_text(encoding="utf-8").rstrip(",\n") + "]")
+    assert {event["name"] for event in events if event["ph"] == "X"} == {"handle_message", "media"}
+
+
+def test_stream_call_does_not_parent_consumer_spans(tmp_path, monkeypatch):
+    import asyncio
+
+    from src.utils.tools.metrics import ModelCallMetrics
+
+    monkeypatch.setattr(Tracer, "TRACE_DIR", tmp_path)
+
+    async def stream():
+        with ModelCallMetrics.track("chat", "m", stream=True):
+            for delta in ("a", "b"):
+                yield delta
+
+    async def main():
+        with Tracer.trace("handle_message") as root:
+            async for _ in stream():
+                with Tracer.span("reply.send"):
+                    pass
+        return root
+
+    root = asyncio.run(main())
+    spans = Tracer.recent(root.trace_id)
+    parents = {span.name: span.parent_id for span in spans}
+    assert parents["reply.send"] == root.span_id
+    assert parents["model.chat"] == root.span_id
@@ -0,0 +1,17 @@
+import numpy as np
+
+from src.utils.chat.search.vector_index import VectorIndex
+
+
+def test_normalize_empty():
+    normed = VectorIndex.normalize(np.zeros((0, 4)))
+    assert normed.shape == (0, 4)
+    assert normed.dtype == np.float32
+
+    index = VectorIndex(VectorIndex.normalize(np.zeros((0, 1))))
+    assert index.search(np.ones(1)) == []
+
+
+def test_normalize_keeps_zero_vectors():
+    normed = VectorIndex.normalize(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    np.testing.assert_allclose(normed, [[0.6, 0.8], [0.0, 0.0]])